@@ -1,46 +1,104 @@
 # main.py
 # ------------------------------------------------------------
 # Orchestrates discovery, continuous readers, aggregation and upload.
-# - Readers continuously update an in-memory "latest_frames" map.
-# - Aggregator (every 60s) snapshots latest frames (fresh enough and with
-#   required keys) and appends an entry to /container_storage/temporary_device_data.json.
-# - Uploader (every SCHEDULE_SECONDS) sends the buffer and clears it on 200.
+# - Readers continuously update an in-memory "latest_frames" map; they are
+#   owned by a ReaderManager, and a HotplugMonitor starts/stops them when
+#   adapters are plugged in or removed (module/hotplug.py).
+# - Aggregator (every 30s) snapshots latest frames (fresh enough and with
+#   required keys) plus per-window statistics from every frame in between,
+#   and appends an entry to the segmented buffer log next to
+#   /container_storage/temporary_device_data.json (migrated automatically).
+# - Uploader (triggered every SCHEDULE_SECONDS, runs on its own thread) sends
+#   the buffer in bounded pages and advances its cursor after every page
+#   acknowledged with 200.
 # - Webcam daily capture retained as before.
+# - Motion detector (module/motion.py) watches the webcam at low resolution;
+#   its activity counts go into every entry as "motion", and motion events
+#   trigger an extra (rate-limited) webcam capture.
+# - Metrics (module/utils/metrics.py): frames/s, parser errors, reconnects,
+#   snapshot age, buffer backlog, uploads and webcam timings are served over
+#   HTTP on port 9108 (device loopback by default) and written to
+#   /container_storage/metrics.json.
+# - Raw capture (RAW_CAPTURE_ENABLED, module/capture.py) records every byte
+#   the readers see; replay.py feeds captures back through the parser and
+#   the same entry building (roll_window_stats / build_entry) offline.
+# - Remote config (module/config.py) is cached on disk and refreshed in the
+#   background; its [station] table overrides the intervals, freshness window
+#   and capture time below while running (apply_config). Startup never waits
+#   on it.
+# - Startup is readiness-driven (module/startup.py): nothing sleeps; the first
+#   entry is aggregated as soon as the wall clock is synchronized and every
+#   discovered role has its required keys, with STARTUP_DELAY and
+#   AGGREGATOR_WARMUP_SECONDS as upper bounds.
 # ------------------------------------------------------------
 
+import re
+import signal
+import sys
 import threading
 import time
 from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
 
 import schedule
+from module.buffer import BufferUploader, FileBuffer
+from module.config import AppConfig
 from module.device import (
-    FRESHNESS_SECONDS,  # fixed constant from device.py
-    FileBuffer,
-    ReaderThread,
+    FRESHNESS_SECONDS,  # default of freshness_seconds (remote config may override)
+    FrameMerger,
+    ReaderManager,
     Webcam,
-    classify_roles,
+    cached_devices,
     discover_devices,
+    required_keys_for,
+    save_identity_cache,
 )
+from module.hotplug import HotplugMonitor
+from module.motion import MOTION_EVENT_CAPTURE, MotionDetector
+from module.startup import StartupGate
 from module.utils.logger import setup_custom_logger
+from module.utils.metrics import METRICS_FILE_SECONDS, REGISTRY, start_http_server
+from module.vedirect import Snapshot, WindowStats
 from tzlocal import get_localzone
 
 # --------------------
 # Fixed config (no getenv)
 # --------------------
-SCHEDULE_SECONDS = 300  # upload interval in seconds
-CAPTURE_TIME = "07:25"  # daily webcam capture (HH:MM, local time)
-STARTUP_DELAY = 20  # startup delay in seconds (allow NTP/udev settle)
+# Values marked [station] are defaults: the same keys in the [station] table
+# of the remote device config override them live (apply_config)
+SCHEDULE_SECONDS = 300  # upload interval in seconds [station] upload_seconds
+AGGREGATE_SECONDS = 30  # aggregator interval in seconds [station] aggregate_seconds
+FIRST_UPLOAD_DELAY = 60  # early first upload after boot, in seconds
+CAPTURE_TIME = (
+    "07:25"  # daily webcam capture (HH:MM, local time) [station] capture_time
+)
+# FRESHNESS_SECONDS (module/device.py): [station] freshness_seconds
+STARTUP_DELAY = 20  # max seconds to wait for the wall clock to sync (NTP)
 
 BUFFER_PATH = "/container_storage/temporary_device_data.json"
 
-# Extra warmup so ReaderThread rekker å "merge" inn H17/H18/H22 før vi begynner å samle
+# Max extra seconds (after STARTUP_DELAY) for ReaderThread å "merge" inn
+# H17/H18/H22 før vi begynner å samle; aggregation starts earlier once every
+# discovered role has its required keys
 AGGREGATOR_WARMUP_SECONDS = 60
 
-REQUIRED_KEYS = {
-    "loadlogger": ("PID", "V", "I", "P", "SOC", "CE", "H17"),  # H18 fjernet
-    "charger": ("PID", "SER#", "V", "I", "VPV", "PPV", "H22"),
-    "charger_2": ("PID", "SER#", "V", "I", "VPV", "PPV", "H22"),
-}
+# Serial reader engine: "threads" (one ReaderThread per port) or "selector"
+# (one SerialReaderEngine thread multiplexing every port)
+READER_ENGINE = "threads"
+
+# Headless motion/activity detection on the webcam (module/motion.py), opt-in:
+# it keeps the camera open and costs CPU on the Pi
+MOTION_ENABLED = False
+
+# Record every reader's raw serial bytes to /container_storage/raw_capture
+# (rotating, module/capture.py) for offline replay with replay.py
+RAW_CAPTURE_ENABLED = False
+
+# Metrics endpoint (http://127.0.0.1:9108/metrics on the device; published on
+# loopback only unless set otherwise in docker-compose.yml) and periodic
+# metrics file
+METRICS_HTTP_ENABLED = True
+METRICS_FILE_ENABLED = True
 
 
 # --------------------
@@ -49,72 +107,82 @@ REQUIRED_KEYS = {
 main_logger = setup_custom_logger("main")
 
 # In-memory latest frames from readers:
-#   latest_frames[role] = { "PID": ..., ..., "_ts": iso-str }
+#   latest_frames[role] = FrameMerger; .snapshot() -> Snapshot (typed values,
+#   .age() in seconds), see module/device.py and module/vedirect.py
 latest_frames = {}
 
-# File buffer
-buffer = FileBuffer(BUFFER_PATH)
+# Per-role streaming statistics over the current aggregation window
+# (fed by readers on every frame, rolled by aggregate_once):
+#   window_stats[role] = WindowStats
+window_stats = {}
 
-# Webcam
-webcam = Webcam()
+# File buffer + background uploader (network I/O never runs on the scheduler thread)
+# and webcam; created in main(), so importing this module has no side effects
+buffer = None
+uploader = None
+webcam = None
+
+# Motion detector (started in bootstrap when MOTION_ENABLED)
+motion = None
+
+# Remote device config (created in main()) and the settings applied from it
+app_config = None
+freshness_seconds = FRESHNESS_SECONDS
+_jobs: Dict[str, Tuple[Any, schedule.Job]] = {}  # name -> (setting, job)
+
+# Startup gate (created in main()): aggregation starts once it has opened
+startup = None
 
 # Internal state
-_boot_time = time.time()
 _role_ready_logged = set()  # so we don't spam logs every 30s
 
 
 # --------------------
 # Helpers
 # --------------------
-def _role_has_required(role: str, frame: dict) -> bool:
-    req = REQUIRED_KEYS.get(role)
+def _role_has_required(role: str, frame: Snapshot) -> bool:
+    req = required_keys_for(role)
     if not req:
         return True
     return all(k in frame for k in req)
 
 
-def _age_seconds(now: datetime, ts_iso: str) -> float:
-    try:
-        from datetime import datetime as _dt
-
-        return (now - _dt.fromisoformat(ts_iso)).total_seconds()
-    except Exception:
-        return float("inf")
+def roll_window_stats(window_stats: Dict[str, WindowStats]) -> Dict[str, Dict]:
+    """Close the statistics window of every role and return the summaries."""
+    stats = {role: st.roll() for role, st in list(window_stats.items())}
+    for role, st in stats.items():
+        if st["window_s"] > 0:
+            REGISTRY.set(
+                "frames_per_second", round(st["frames"] / st["window_s"], 2), role=role
+            )
+    return stats
 
 
-# --------------------
-# Jobs
-# --------------------
-def aggregate_once():
+def build_entry(
+    latest_frames: Dict[str, FrameMerger],
+    stats: Dict[str, Dict],
+    now: datetime,
+    mono_now: float,
+) -> Tuple[Dict, List[str], List[Tuple[str, str]]]:
     """
-    Snapshot latest frames and write one entry into the buffer.
-    Include only roles with frames fresher than FRESHNESS_SECONDS
-    AND that contain the required keys for that role (H17/H18, H22, ...).
+    Build one aggregate entry at wall time now / monotonic time mono_now
+    (the mergers' clock). Returns (entry, included roles, dropped roles with
+    reason). Shared by aggregate_once and replay.py.
     """
-    # Varm opp litt ekstra etter boot for å sikre at history-felter har rukket å komme
-    if time.time() - _boot_time < (STARTUP_DELAY + AGGREGATOR_WARMUP_SECONDS):
-        main_logger.info(
-            "Aggregator warmup window not elapsed yet; skipping this tick."
-        )
-        return
-
-    now = datetime.now(get_localzone())
-    now_iso = now.isoformat()
-
-    entry = {"timestamp": now_iso}
+    entry = {"timestamp": now.isoformat()}
     included = []
     dropped = []
 
     # Copy keys to avoid concurrent modification during iteration
     for role in list(latest_frames.keys()):
-        frame = latest_frames.get(role, {}) or {}
-        ts = frame.get("_ts")
-        if not ts:
+        source = latest_frames.get(role)
+        frame = source.snapshot() if source is not None else None
+        if frame is None:
             dropped.append((role, "missing_ts"))
             continue
 
-        age = _age_seconds(now, ts)
-        if age > FRESHNESS_SECONDS:
+        age = frame.age(mono_now)
+        if age > freshness_seconds:
             dropped.append((role, f"stale:{int(age)}s"))
             continue
 
@@ -122,7 +190,7 @@ def aggregate_once():
         if not _role_has_required(role, frame):
             # log at most once per role to avoid spam
             if role not in _role_ready_logged:
-                missing = [k for k in REQUIRED_KEYS.get(role, ()) if k not in frame]
+                missing = [k for k in required_keys_for(role) if k not in frame]
                 main_logger.info(
                     f"Role '{role}' not ready; missing keys: {missing}. Will include once available."
                 )
@@ -130,11 +198,96 @@ def aggregate_once():
             dropped.append((role, "missing_required"))
             continue
 
-        # Copy without _ts for the output format
-        clean = {k: v for k, v in frame.items() if k != "_ts"}
-        entry[role] = clean
+        # Plain dict of typed values (last seen) + window statistics
+        entry[role] = frame.to_dict()
+        if role in stats:
+            entry[role]["stats"] = stats[role]
         included.append(role)
 
+    return entry, included, dropped
+
+
+def _is_hhmm(value: str) -> bool:
+    return re.fullmatch(r"([01][0-9]|2[0-3]):[0-5][0-9]", value) is not None
+
+
+def _reschedule(name: str, setting: Any, make_job: Callable[[], schedule.Job]) -> None:
+    """(Re)create a scheduled job if its setting changed; unchanged jobs keep their timing."""
+    current = _jobs.get(name)
+    if current is not None:
+        if current[0] == setting:
+            return
+        schedule.cancel_job(current[1])
+        main_logger.info(f"Rescheduling {name}: {current[0]} -> {setting}")
+    _jobs[name] = (setting, make_job())
+
+
+def apply_config(config: AppConfig) -> None:
+    """
+    Apply the [station] table of the device config; missing or invalid keys
+    fall back to the constants above. Called from the main loop between
+    schedule.run_pending() calls, so jobs are never changed while they run.
+    """
+    global freshness_seconds
+    aggregate_s = config.get(
+        "station", "aggregate_seconds", AGGREGATE_SECONDS, minimum=5, maximum=3600
+    )
+    upload_s = config.get(
+        "station", "upload_seconds", SCHEDULE_SECONDS, minimum=30, maximum=86400
+    )
+    capture_time = config.get("station", "capture_time", CAPTURE_TIME, check=_is_hhmm)
+    freshness_seconds = config.get(
+        "station", "freshness_seconds", FRESHNESS_SECONDS, minimum=10, maximum=3600
+    )
+
+    _reschedule(
+        "aggregate",
+        aggregate_s,
+        lambda: schedule.every(aggregate_s).seconds.do(aggregate_once),
+    )
+    _reschedule(
+        "upload", upload_s, lambda: schedule.every(upload_s).seconds.do(upload_once)
+    )
+    _reschedule(
+        "webcam",
+        capture_time,
+        lambda: schedule.every().day.at(capture_time).do(webcam_job),
+    )
+    main_logger.info(
+        f"Config v{config.version} applied: aggregate every {aggregate_s}s, upload every {upload_s}s, "
+        f"freshness {freshness_seconds}s, webcam at {capture_time}."
+    )
+
+
+# --------------------
+# Jobs
+# --------------------
+def aggregate_once():
+    """
+    Snapshot latest frames and write one entry into the buffer.
+    Include only roles with frames fresher than freshness_seconds
+    AND that contain the required keys for that role (H17/H18, H22, ...).
+    Each included role also carries "stats": min/max/mean/last and energy
+    integrals over every frame seen since the previous tick.
+    """
+    # Close the statistics window for every role, included or not, so the next
+    # window starts now
+    stats = roll_window_stats(window_stats)
+
+    # Vent til klokka er synkronisert og history-feltene har kommet (startup gate)
+    if startup is None or not startup.opened:
+        main_logger.info("Startup not ready yet; skipping this tick.")
+        return
+
+    entry, included, dropped = build_entry(
+        latest_frames, stats, datetime.now(get_localzone()), time.monotonic()
+    )
+
+    # Activity counts since the previous tick (not a device role, so not counted
+    # in "included")
+    if motion is not None:
+        entry["motion"] = motion.roll()
+
     if not included:
         main_logger.info(
             f"No fresh/ready frames for aggregation window; dropped={dropped}"
@@ -142,61 +295,128 @@ def aggregate_once():
         return
 
     buffer.append(entry)
+    REGISTRY.inc("entries_aggregated_total")
     main_logger.info(f"Aggregated entry with roles: {included}; dropped={dropped}")
 
 
 def upload_once():
-    ok = buffer.upload_and_clear()
-    if ok:
-        main_logger.info("Upload job: success or nothing to upload.")
-    else:
-        main_logger.warning("Upload job: failed, will retry later.")
+    uploader.trigger()
+
+
+def metrics_job():
+    REGISTRY.write_file()
+
+
+def _on_sigterm(signum, frame):
+    # exit through sys.exit so atexit hooks (buffer flush) run on `docker stop`
+    main_logger.info("SIGTERM received; flushing buffer and exiting.")
+    sys.exit(0)
+
+
+def motion_event_capture():
+    main_logger.info("Motion event: triggering webcam capture.")
+    webcam.trigger()
 
 
 def webcam_job():
     t = threading.Thread(target=webcam.trigger, daemon=True)
     t.start()
-    main_logger.info(f"Daily webcam capture triggered at {CAPTURE_TIME}.")
+    main_logger.info(f"Daily webcam capture triggered at {_jobs['webcam'][0]}.")
 
 
 # --------------------
 # Bootstrap
 # --------------------
-if __name__ == "__main__":
+def main():
+    global buffer, uploader, webcam, motion, app_config, startup
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
     try:
+        # Clock sync and per-role readiness instead of fixed sleeps; the old
+        # delays are the upper bounds
+        startup = StartupGate(STARTUP_DELAY, AGGREGATOR_WARMUP_SECONDS)
+
+        buffer = FileBuffer(BUFFER_PATH)
+        uploader = BufferUploader(buffer)
+        webcam = Webcam()
+
+        # Last known device config from disk; refreshed on its own thread
+        app_config = AppConfig()
+        app_config.start()
+        REGISTRY.add_collector(app_config.collect_metrics)
+
+        # 1) Devices: trust the identity cache for known adapters (verified in
+        #    the background below) and probe only ports the cache does not know
+        known, unknown, silent = cached_devices()
+        probed = discover_devices(unknown) if unknown else []
+        rejected = set(unknown) - {port for port, _ in probed}
+        if rejected:
+            save_identity_cache({port: {} for port in rejected}, {})
         main_logger.info(
-            f"Delaying startup for {STARTUP_DELAY} seconds to allow time sync..."
+            f"Devices: {len(known)} from cache, {len(probed)} probed, "
+            f"{len(silent)} silent port(s) probed in background."
         )
-        time.sleep(STARTUP_DELAY)
 
-        # 1) Discover devices (ports + samples)
-        devs = discover_devices()
-        roles = classify_roles(devs)  # [(role, port), ...]
-
-        # 2) Start dedicated readers
-        readers = []
-        for role, port in roles:
-            r = ReaderThread(role=role, port=port, latest_frames=latest_frames)
-            r.start()
-            readers.append(r)
-            main_logger.info(f"Started reader for {role} on {port}")
-
-        if not readers:
+        # 2) Start readers (dedicated threads, or one selector engine for all
+        #    ports); devices plugged in later are picked up by the hotplug monitor
+        readers = ReaderManager(
+            latest_frames,
+            window_stats,
+            engine=READER_ENGINE,
+            capture=RAW_CAPTURE_ENABLED,
+            on_ready=startup.role_ready,
+        )
+        roles = readers.start(known + probed)  # [(role, port), ...]
+        startup.expect(role for role, _ in roles)
+        REGISTRY.add_collector(readers.collect_metrics)
+        readers.verify_identities([port for port, _ in known])
+        readers.probe_in_background(silent)
+        HotplugMonitor(readers).start()
+
+        if not roles:
             main_logger.warning(
-                "No devices discovered. Will continue and rely on future restarts/hotplug."
+                "No devices discovered. Will continue and pick them up on hotplug."
             )
 
-        # 3) Schedule aggregator + uploader + webcam
+        # 3) Motion detector beside the readers (shares the camera with Webcam)
+        if MOTION_ENABLED:
+            motion = MotionDetector(
+                on_event=motion_event_capture if MOTION_EVENT_CAPTURE else None
+            )
+            motion.start()
+            main_logger.info("Started motion detector.")
+
+        # 4) Schedule aggregator + uploader + webcam (+ metrics)
+        REGISTRY.add_collector(buffer.collect_metrics)
+        if METRICS_HTTP_ENABLED:
+            start_http_server()
+        if METRICS_FILE_ENABLED:
+            schedule.every(METRICS_FILE_SECONDS).seconds.do(metrics_job)
+        uploader.start()
+        applied_version = app_config.version
+        apply_config(app_config)
         # Kick off an early upload ~60s after boot so first couple of samples get sent quickly
-        schedule.every(30).seconds.do(aggregate_once)
-        threading.Timer(60.0, upload_once).start()
-        schedule.every(SCHEDULE_SECONDS).seconds.do(upload_once)
-        schedule.every().day.at(CAPTURE_TIME).do(webcam_job)
+        threading.Timer(FIRST_UPLOAD_DELAY, upload_once).start()
 
-        # 4) Main loop
+        # 5) Main loop (picks up remote config changes between jobs)
         while True:
+            if app_config.version != applied_version:
+                applied_version = app_config.version
+                apply_config(app_config)
+            if not startup.opened and startup.check():
+                # first entry right away (the job's next run is one interval
+                # later) and sent without waiting for the upload schedule
+                _jobs["aggregate"][1].run()
+                upload_once()
             schedule.run_pending()
-            time.sleep(1)
+            if startup.opened:
+                time.sleep(1)
+            else:
+                startup.wait(1)
 
     except Exception as e:
         main_logger.error(f"Fatal error in main: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,73 @@
+import gzip
+import json
+import threading
+import time
 from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 from tzlocal import get_localzone
 
 from module.utils.logger import setup_custom_logger
+from module.utils.metrics import REGISTRY
 
 # from utils.logger import setup_custom_logger
 
 logger = setup_custom_logger(__name__)
 
+# Default (connect, read) timeouts in seconds
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+# Connections kept alive per host in the session pool
+POOL_MAXSIZE = 4
+
+Timeout = Union[float, Tuple[float, float]]
+
 
 class ApiGatewayConnector:
-    def __init__(self, base_url: str, api_key: str) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ) -> None:
         """
         Initializes the API Gateway Connector.
 
+        One pooled requests.Session is kept per connector, so consecutive requests
+        reuse the same keep-alive TCP/TLS connection.
+
         Args:
         base_url (str): The base URL for the API.
         api_key (str): The API key for authentication.
-        station_id (str): The ID of the station to be included in requests.
+        connect_timeout (float): Default connect timeout in seconds.
+        read_timeout (float): Default read timeout in seconds.
         """
 
         self.base_url = base_url
         self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"x-api-key": self.api_key})
+
+    def close(self) -> None:
+        """Closes the pooled connections."""
+        self.session.close()
 
     def post_dict(
-        self, endpoint: str, data: dict, payload_parent_keys: dict = {}
+        self,
+        endpoint: str,
+        data: dict,
+        payload_parent_keys: dict = {},
+        timeout: Optional[Timeout] = None,
+        compress: bool = False,
     ) -> dict:
         """
         Performs a POST request with a dictionary. Data is automatically serialzied to JSON.
@@ -33,6 +75,8 @@ class ApiGatewayConnector:
         Args:
         endpoint (str): The endpoint to add to the base url
         data (dict): The data as dictionary format
+        timeout (float | tuple): Optional timeout override, seconds or (connect, read)
+        compress (bool): Send the JSON body gzip-compressed (Content-Encoding: gzip)
 
         Returns:
         dict: The response from the server
@@ -41,11 +85,111 @@ class ApiGatewayConnector:
         payload = self._construct_payload(payload_parent_keys)
         payload["data"] = data
 
+        headers = {"Content-Type": "application/json"}
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
         # logger.info(f"Performing POST request to {endpoint} with payload {payload}")
-        response = requests.post(
-            self.base_url + f"/{endpoint}",
-            json=payload,
-            headers={"x-api-key": self.api_key, "Content-Type": "application/json"},
+        return self._post(endpoint, body, headers, timeout)
+
+    def post_gzip_data(
+        self,
+        endpoint: str,
+        data_gz: bytes,
+        payload_parent_keys: dict = {},
+        timeout: Optional[Timeout] = None,
+    ) -> dict:
+        """
+        Performs a gzip POST request where the "data" value is already gzip-compressed JSON.
+
+        The body is the concatenation of three gzip members: the payload head
+        ('{...,"data":'), data_gz as-is and the closing '}'. Concatenated members
+        decode as one stream, so the data is never decompressed or re-encoded here.
+
+        Args:
+        endpoint (str): The endpoint to add to the base url
+        data_gz (bytes): gzip stream(s) of the JSON value for "data"
+        timeout (float | tuple): Optional timeout override, seconds or (connect, read)
+
+        Returns:
+        dict: The response from the server
+        """
+
+        payload = self._construct_payload(payload_parent_keys)
+        # payload always holds "timestamp", so the head is '{...,"data":'
+        head = json.dumps(payload, separators=(",", ":"))[:-1] + ',"data":'
+
+        body = (
+            gzip.compress(head.encode("utf-8"), compresslevel=6)
+            + data_gz
+            + gzip.compress(b"}", compresslevel=6)
+        )
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        return self._post(endpoint, body, headers, timeout)
+
+    def post_binary(
+        self,
+        endpoint: str,
+        data: Union[bytes, memoryview],
+        content_type: str = "application/octet-stream",
+        query_params: dict = {},
+        timeout: Optional[Timeout] = None,
+    ) -> dict:
+        """
+        Performs a POST request with a raw binary body (e.g. a JPEG).
+
+        The buffer is handed to the socket as-is (a memoryview is not copied);
+        metadata such as deviceId goes in the query string together with a timestamp.
+
+        Args:
+        endpoint (str): The endpoint to add to the base url
+        data (bytes | memoryview): The request body
+        content_type (str): Content-Type of the body
+        query_params (dict): Query parameters, a "timestamp" is added
+        timeout (float | tuple): Optional timeout override, seconds or (connect, read)
+
+        Returns:
+        dict: The response from the server
+        """
+
+        params = self._construct_payload(query_params)
+        body = data.cast("B") if isinstance(data, memoryview) else data
+
+        headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        return self._post(endpoint, body, headers, timeout, params=params)
+
+    def _post(
+        self,
+        endpoint: str,
+        body: Union[bytes, memoryview],
+        headers: dict,
+        timeout: Optional[Timeout],
+        params: Optional[dict] = None,
+    ):
+        """POST body to endpoint on the pooled session, recording request metrics
+        (latency, bytes sent, responses by status, errors) per endpoint.
+        """
+        start = time.monotonic()
+        try:
+            response = self.session.post(
+                self.base_url + f"/{endpoint}",
+                data=body,
+                params=params,
+                headers=headers,
+                timeout=timeout or self.timeout,
+            )
+        except Exception:
+            REGISTRY.inc("http_errors_total", endpoint=endpoint)
+            raise
+        finally:
+            REGISTRY.observe(
+                "http_request_seconds", time.monotonic() - start, endpoint=endpoint
+            )
+        REGISTRY.inc("http_request_bytes_total", len(body), endpoint=endpoint)
+        REGISTRY.inc(
+            "http_responses_total", endpoint=endpoint, status=response.status_code
         )
 
         logger.info(f"Response status code: {response.status_code}")
@@ -69,10 +213,11 @@ class ApiGatewayConnector:
 
         logger.info(f"Performing POST request to {endpoint} with payload {payload}")
 
-        response = requests.post(
+        response = self.session.post(
             self.base_url + f"/{endpoint}",
             data=payload,
-            headers={"x-api-key": self.api_key, "Content-Type": "application/json"},
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
         )
 
         logger.info(f"Response status code: {response.status_code}")
@@ -94,10 +239,7 @@ class ApiGatewayConnector:
 
         logger.info(f"Performing GET request to {url}")
 
-        response = requests.get(
-            url,
-            headers={"x-api-key": self.api_key},
-        )
+        response = self.session.get(url, timeout=self.timeout)
 
         logger.info(f"Response status code: {response.status_code}")
 
@@ -105,6 +247,49 @@ class ApiGatewayConnector:
 
         return data
 
+    def get_response(
+        self,
+        endpoint: str,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        timeout: Optional[Timeout] = None,
+    ) -> requests.Response:
+        """
+        Performs a GET request and returns the response as-is (status code and
+        headers such as ETag included), recording the same metrics as POSTs.
+
+        Args:
+        endpoint (str): The endpoint to add to the base url
+        params (dict): Query parameters
+        headers (dict): Extra headers, e.g. If-None-Match
+        timeout (float | tuple): Optional timeout override, seconds or (connect, read)
+
+        Returns:
+        requests.Response: The response from the server
+        """
+        start = time.monotonic()
+        try:
+            response = self.session.get(
+                self.base_url + f"/{endpoint}",
+                params=params,
+                headers=headers,
+                timeout=timeout or self.timeout,
+            )
+        except Exception:
+            REGISTRY.inc("http_errors_total", endpoint=endpoint)
+            raise
+        finally:
+            REGISTRY.observe(
+                "http_request_seconds", time.monotonic() - start, endpoint=endpoint
+            )
+        REGISTRY.inc(
+            "http_responses_total", endpoint=endpoint, status=response.status_code
+        )
+
+        logger.info(f"GET {endpoint}: response status code: {response.status_code}")
+
+        return response
+
     def _construct_payload(self, payload_parent_keys):
         """
         Adds a timestamp and station ID to the request data.
@@ -126,3 +311,21 @@ class ApiGatewayConnector:
         payload["timestamp"] = timestamp
 
         return payload
+
+
+# --------------------
+# Shared connectors
+# --------------------
+_shared: Dict[Tuple[str, str], ApiGatewayConnector] = {}
+_shared_lock = threading.Lock()
+
+
+def get_connector(base_url: str, api_key: str) -> ApiGatewayConnector:
+    """Return a process-wide connector (and its connection pool) for base_url/api_key."""
+    key = (base_url, api_key)
+    with _shared_lock:
+        connector = _shared.get(key)
+        if connector is None:
+            connector = ApiGatewayConnector(base_url=base_url, api_key=api_key)
+            _shared[key] = connector
+        return connector
@@ -0,0 +1,1038 @@
+# buffer.py
+# ------------------------------------------------------------
+# Persistent telemetry buffer (append-only segmented log)
+# - Entries are stored one JSON object per line in numbered segment files
+#   (seg-00000001.jsonl, ...) in a directory next to the old buffer file,
+#   e.g. /container_storage/temporary_device_data.d/.
+# - Appends only ever touch the active (newest) segment, so their cost does
+#   not depend on the size of the backlog. They are group-committed: batched
+#   in memory and flushed + fsynced every N entries or N seconds.
+# - The active segment is rotated once it reaches SEGMENT_MAX_BYTES or
+#   SEGMENT_MAX_ENTRIES and then sealed: gzip-compressed, with the entries
+#   comma-separated so the file is a gzip'ed JSON array body. Every line is
+#   checked while sealing; its entry count goes into state.json (so stats()
+#   never has to decompress it), and a segment with only valid lines is marked
+#   clean there and can be uploaded by splicing its bytes into a gzip request
+#   body as-is (the backend's gzip decoder must accept multi-member streams).
+#   Other segments are sent in pages, skipping the corrupt lines.
+# - An upload cursor (segment, entry index) is persisted in state.json.
+#   Segments entirely behind the cursor are deleted.
+# - Uploads are sent in pages bounded by entry count and bytes; the cursor is
+#   committed after every acknowledged page, so an interrupted drain resumes
+#   from the last acknowledged page. A page answered 413 is halved and sent
+#   again; a page the API keeps rejecting with another 4xx is moved to a
+#   dead-letter file after UPLOAD_REJECT_MAX_RUNS runs, so it cannot block
+#   the backlog behind it.
+# - The lock is only held to seal and to acknowledge a page; the HTTP request
+#   itself runs without it, on the BufferUploader background thread.
+# - Retention keeps the buffer within a byte and age budget: near the byte
+#   budget old segments are compacted into coarser rollups, and only then is
+#   the oldest data evicted (each drop is logged).
+# - The legacy JSON-array buffer file is migrated into segment 0 on first start.
+# - Every page is sent with "units" (vedirect.FIELD_UNITS, label -> unit of
+#   the integer values and their window stats) next to deviceId.
+# ------------------------------------------------------------
+
+import atexit
+import fcntl
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from module.aws.apigateway import get_connector
+from module.encoding import FORMAT_COLUMNAR, FORMAT_ENTRIES, encode_power_batch
+from module.utils.logger import setup_custom_logger
+from module.utils.metrics import REGISTRY, MetricsRegistry
+from module.vedirect import FIELD_UNITS
+
+# --------------------
+# Environment (kept) & constants (fixed)
+# --------------------
+apigateway_url = os.getenv("API_GATEWAY_MILJOSTASJON_URL")
+apigateway_key = os.getenv("API_GATEWAY_MILJOSTASJON_KEY")
+device_id = os.getenv("DEVICE_ID")
+
+# Upload paging: one POST carries at most this many entries / raw bytes, and a
+# single upload run sends at most UPLOAD_MAX_PAGES_PER_RUN pages.
+PAGE_MAX_ENTRIES = 120
+PAGE_MAX_BYTES = 128 * 1024
+UPLOAD_MAX_PAGES_PER_RUN = 10
+
+# Segment rotation limits (whichever is hit first). Kept equal to the page
+# limits so a sealed segment can be uploaded as one page as-is.
+SEGMENT_MAX_BYTES = PAGE_MAX_BYTES
+SEGMENT_MAX_ENTRIES = PAGE_MAX_ENTRIES
+
+# Group commit: appended entries are kept in memory and written (and fsynced)
+# to the active segment every FLUSH_EVERY_ENTRIES entries or FLUSH_EVERY_SECONDS,
+# whichever comes first. Uploads and shutdown flush as well. FLUSH_EVERY_SECONDS
+# bounds how much a power cut can lose.
+FLUSH_EVERY_ENTRIES = 10
+FLUSH_EVERY_SECONDS = 30
+FSYNC_ON_FLUSH = True
+
+# gzip level for sealed segments
+SEGMENT_GZIP_LEVEL = 6
+
+# Sealed segments up to this uncompressed size are uploaded as stored (gzip
+# spliced into the request body); larger ones (e.g. migrated legacy data) are paged.
+SEGMENT_STREAM_MAX_BYTES = 2 * PAGE_MAX_BYTES
+
+# (connect, read) timeouts for one page upload, in seconds
+UPLOAD_TIMEOUT = (10, 60)
+
+# A page rejected with a 4xx in this many consecutive runs is quarantined in
+# DEAD_LETTER_NAME (one {"status", "entry"} JSON line per entry) and skipped.
+# 413 is handled by halving the page first (a single entry is quarantined at
+# once). The statuses below are never quarantined: they are about the API key,
+# the endpoint or throttling, not about the page.
+UPLOAD_REJECT_MAX_RUNS = 3
+UPLOAD_RETRY_STATUSES = (401, 403, 404, 408, 429)
+DEAD_LETTER_NAME = "dead-letter.jsonl"
+
+# gzip page bodies. Off until the API is confirmed to accept
+# Content-Encoding: gzip; sealed segments are only spliced in when on (the
+# body is then several concatenated gzip members).
+UPLOAD_GZIP = False
+
+# Payload format of the 'power' endpoint, sent as payload key "format" when not
+# legacy: "entries" (legacy list of entries) or "columnar-delta/1"
+# (module/encoding.py; the backend must run decode_power_batch first)
+UPLOAD_FORMAT = FORMAT_ENTRIES
+
+# Retention: byte budget for all segments on disk and maximum age of an entry.
+# Above COMPACT_AT_FRACTION of the byte budget, old segments are rolled up into
+# ROLLUP_BUCKET_SECONDS buckets; only above the budget is the oldest data evicted.
+BUFFER_MAX_BYTES = 64 * 1024 * 1024
+BUFFER_MAX_AGE_SECONDS = 30 * 24 * 3600
+COMPACT_AT_FRACTION = 0.8
+ROLLUP_BUCKET_SECONDS = 600
+COMPACT_MAX_PER_PASS = 4
+
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".jsonl"  # active segment: one JSON entry per line
+SEALED_SUFFIX = ".jsonl.gz"  # sealed segment: gzip of "e1,\ne2,\n...eN\n"
+
+log = setup_custom_logger("module.buffer")
+
+Cursor = Tuple[int, int]  # (segment sequence number, entry index within segment)
+
+
+# --------------------
+# File buffer manager
+# --------------------
+class FileBuffer:
+    """Append-only, line-delimited segment log with a persisted upload cursor.
+    Path is typically /container_storage/temporary_device_data.json; segments live
+    in the sibling directory temporary_device_data.d/.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dir = os.path.splitext(path)[0] + ".d"
+        os.makedirs(self.dir, exist_ok=True)
+        self._state_path = os.path.join(self.dir, "state.json")
+        self._lock_path = os.path.join(self.dir, ".lock")
+        self._dead_letter_path = os.path.join(self.dir, DEAD_LETTER_NAME)
+        self._upload_guard = threading.Lock()  # one upload run at a time
+
+        # active segment bookkeeping (only touched while holding the lock)
+        self._active_seq = 1
+        self._active_bytes = 0
+        self._active_entries = 0
+
+        # group commit: encoded lines not yet written to the active segment
+        self._pending: List[bytes] = []
+        self._last_flush = time.monotonic()
+
+        # end cursor of the page currently being uploaded (protected from retention)
+        self._inflight_end: Optional[Cursor] = None
+
+        # consecutive upload runs in which the page at this cursor was rejected (4xx)
+        self._rejected: Tuple[Optional[Cursor], int] = (None, 0)
+
+        with self._locked():
+            self._migrate_legacy()
+            self._open_active()
+            self._count_sealed_lines()
+            self._enforce_retention()
+
+        # flush the group-commit batch on interpreter exit
+        atexit.register(self.flush)
+
+    # --------------------
+    # Locking / paths / state
+    # --------------------
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Exclusive lock on the buffer directory (threads and processes)."""
+        with open(self._lock_path, "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _plain_path(self, seq: int) -> str:
+        return os.path.join(self.dir, f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}")
+
+    def _sealed_path(self, seq: int) -> str:
+        return os.path.join(self.dir, f"{SEGMENT_PREFIX}{seq:08d}{SEALED_SUFFIX}")
+
+    def _segment_path(self, seq: int) -> str:
+        """Path of segment seq on disk (sealed form preferred)."""
+        sealed = self._sealed_path(seq)
+        return sealed if os.path.exists(sealed) else self._plain_path(seq)
+
+    def _open_segment(self, seq: int) -> IO[bytes]:
+        path = self._segment_path(seq)
+        return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+    def _segments(self) -> List[int]:
+        """Sorted sequence numbers of all segment files on disk."""
+        seqs = set()
+        for name in os.listdir(self.dir):
+            if not name.startswith(SEGMENT_PREFIX):
+                continue
+            for suffix in (SEALED_SUFFIX, SEGMENT_SUFFIX):
+                if name.endswith(suffix):
+                    try:
+                        seqs.add(int(name[len(SEGMENT_PREFIX) : -len(suffix)]))
+                    except ValueError:
+                        pass
+                    break
+        return sorted(seqs)
+
+    def _write_sealed(self, seq: int, lines: List[bytes], clean: bool = True) -> None:
+        """Atomically write lines (JSON entries, no newline) as sealed segment seq,
+        and record their count and whether all of them are valid JSON (clean: may
+        be spliced).
+        """
+        path = self._sealed_path(seq)
+        tmp = path + ".tmp"
+        body = b",\n".join(lines) + b"\n" if lines else b""
+        with open(tmp, "wb") as f:
+            f.write(gzip.compress(body, compresslevel=SEGMENT_GZIP_LEVEL))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        # the flag follows the file: a crash in between leaves it unset (paged
+        # upload) and the count missing (recounted on the next start)
+        state = self._load_state()
+        clean_segments = set(state.get("clean", []))
+        if clean:
+            clean_segments.add(seq)
+        else:
+            clean_segments.discard(seq)
+        line_counts = dict(state.get("lines", {}))
+        line_counts[str(seq)] = len(lines)
+        self._save_state(
+            self._load_cursor(), clean=list(clean_segments), lines=line_counts
+        )
+
+    def _seal(self, seq: int) -> None:
+        """Compress a plain segment into its sealed form (drops a torn last line)."""
+        plain = self._plain_path(seq)
+        if not os.path.exists(plain):
+            return
+        with open(plain, "rb") as f:
+            raw = f.read()
+        lines = raw.split(b"\n")
+        if lines and lines[-1] == b"":
+            lines.pop()
+        elif lines and _decode_line(lines[-1]) is None:
+            log.warning(f"Dropping torn last line of segment {seq} while sealing.")
+            lines.pop()
+        clean = all(_valid_line(line) for line in lines)
+        if not clean:
+            log.warning(
+                f"Segment {seq} has corrupt lines; it will be uploaded in pages."
+            )
+        self._write_sealed(seq, lines, clean)
+        os.remove(plain)
+
+    def _load_state(self) -> Dict:
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.error(f"Buffer state unreadable ({e}); restarting from oldest segment.")
+            return {}
+
+    def _load_cursor(self) -> Cursor:
+        cur = self._load_state().get("cursor", {})
+        try:
+            return int(cur.get("segment", 0)), int(cur.get("entry", 0))
+        except (ValueError, TypeError, AttributeError):
+            return 0, 0
+
+    def _save_state(
+        self,
+        cursor: Cursor,
+        compacted: Optional[List[int]] = None,
+        clean: Optional[List[int]] = None,
+        lines: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Persist cursor (+ lists of compacted and clean sealed segments and the
+        entry counts of sealed segments {"seq": lines}, kept if not given).
+        """
+        if compacted is None or clean is None or lines is None:
+            state = self._load_state()
+            if compacted is None:
+                compacted = state.get("compacted", [])
+            if clean is None:
+                clean = state.get("clean", [])
+            if lines is None:
+                lines = state.get("lines", {})
+        state = {
+            "cursor": {"segment": cursor[0], "entry": cursor[1]},
+            "compacted": sorted(s for s in set(compacted) if s >= cursor[0]),
+            "clean": sorted(s for s in set(clean) if s >= cursor[0]),
+            "lines": {k: n for k, n in lines.items() if int(k) >= cursor[0]},
+        }
+        tmp = self._state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._state_path)
+
+    # --------------------
+    # Startup
+    # --------------------
+    def _migrate_legacy(self) -> None:
+        """Move entries from the old JSON-array buffer file into segment 0.
+        Idempotent: if segment 0 already exists, the legacy file is just removed.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        migrated = 0
+        if 0 not in self._segments():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    raw = f.read()
+                data = json.loads(raw) if raw.strip() else []
+                if not isinstance(data, list):
+                    data = []
+            except (OSError, json.JSONDecodeError) as e:
+                log.warning(f"Legacy buffer {self.path} unreadable ({e}); discarding.")
+                data = []
+
+            if data:
+                self._write_sealed(0, [_encode_line(e).rstrip(b"\n") for e in data])
+                migrated = len(data)
+
+        os.remove(self.path)
+        log.info(f"Migrated {migrated} entries from legacy buffer {self.path}.")
+
+    def _open_active(self) -> None:
+        """Pick up the newest segment as the active one (or start a new one)."""
+        seqs = self._segments()
+        cursor_seq, _ = self._load_cursor()
+        if not seqs:
+            self._active_seq = max(cursor_seq, 1)
+            self._active_bytes = 0
+            self._active_entries = 0
+            return
+
+        # Plain segments other than the newest were left by a crash mid-rotation
+        for seq in seqs[:-1]:
+            if os.path.exists(self._plain_path(seq)):
+                self._seal(seq)
+
+        last = seqs[-1]
+        plain = self._plain_path(last)
+        raw = b""
+        if os.path.exists(plain):
+            with open(plain, "rb") as f:
+                raw = f.read()
+
+        # Never append to a sealed segment or behind a torn (half-written) last line
+        if not os.path.exists(plain) or (raw and not raw.endswith(b"\n")):
+            self._seal(last)
+            self._active_seq = last + 1
+            self._active_bytes = 0
+            self._active_entries = 0
+        else:
+            self._active_seq = last
+            self._active_bytes = len(raw)
+            self._active_entries = raw.count(b"\n")
+
+    def _count_sealed_lines(self) -> None:
+        """Record the entry counts of sealed segments that have none in state.json
+        (sealed by an older version, or a crash right after sealing).
+        """
+        state = self._load_state()
+        line_counts = dict(state.get("lines", {}))
+        missing = [
+            seq
+            for seq in self._segments()
+            if seq != self._active_seq and str(seq) not in line_counts
+        ]
+        if not missing:
+            return
+        for seq in missing:
+            with self._open_segment(seq) as f:
+                line_counts[str(seq)] = sum(1 for _ in f)
+        self._save_state(self._load_cursor(), lines=line_counts)
+        log.info(f"Counted entries of {len(missing)} sealed segment(s).")
+
+    # --------------------
+    # Writing
+    # --------------------
+    def append(self, entry: Dict) -> None:
+        """Queue one entry; the batch is flushed to disk every FLUSH_EVERY_ENTRIES
+        entries or FLUSH_EVERY_SECONDS, whichever comes first.
+        """
+        try:
+            line = _encode_line(entry)
+            with self._locked():
+                self._pending.append(line)
+                if (
+                    len(self._pending) >= FLUSH_EVERY_ENTRIES
+                    or time.monotonic() - self._last_flush >= FLUSH_EVERY_SECONDS
+                ):
+                    self._flush()
+        except Exception as e:
+            log.error(f"FileBuffer.append failed: {e}")
+
+    def flush(self) -> None:
+        """Write queued entries to disk now."""
+        try:
+            with self._locked():
+                self._flush()
+        except Exception as e:
+            log.error(f"FileBuffer.flush failed: {e}")
+
+    def _flush(self) -> None:
+        """Write the group-commit batch to the active segment (rotating when full)."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        f = open(self._plain_path(self._active_seq), "ab")
+        try:
+            for line in pending:
+                if self._active_entries > 0 and (
+                    self._active_bytes + len(line) > SEGMENT_MAX_BYTES
+                    or self._active_entries >= SEGMENT_MAX_ENTRIES
+                ):
+                    self._sync(f)
+                    f.close()
+                    self._rotate()
+                    f = open(self._plain_path(self._active_seq), "ab")
+                f.write(line)
+                self._active_bytes += len(line)
+                self._active_entries += 1
+            self._sync(f)
+        finally:
+            f.close()
+
+    def _sync(self, f: IO[bytes]) -> None:
+        f.flush()
+        if FSYNC_ON_FLUSH:
+            os.fsync(f.fileno())
+
+    def _rotate(self) -> None:
+        """Seal the active segment and start the next one."""
+        self._seal(self._active_seq)
+        self._active_seq += 1
+        self._active_bytes = 0
+        self._active_entries = 0
+        self._enforce_retention()
+
+    # --------------------
+    # Reading / acknowledging
+    # --------------------
+    def _read_page(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> Tuple[List[Dict], Cursor]:
+        """Return up to one page of entries after the cursor and the cursor just past them.
+        A page always holds at least one entry, even if that entry alone exceeds max_bytes.
+        """
+        max_entries = max_entries or PAGE_MAX_ENTRIES
+        max_bytes = max_bytes or PAGE_MAX_BYTES
+        seg, idx = self._load_cursor()
+        entries: List[Dict] = []
+        size = 0
+        for seq in self._segments():
+            if seq < seg:
+                continue
+            start = idx if seq == seg else 0
+            n = start
+            full = False
+            with self._open_segment(seq) as f:
+                for lineno, raw in enumerate(f):
+                    if lineno < start:
+                        continue
+                    if entries and (
+                        len(entries) >= max_entries or size + len(raw) > max_bytes
+                    ):
+                        full = True
+                        break
+                    n = lineno + 1
+                    entry = _decode_line(raw)
+                    if entry is None:
+                        log.warning(f"Skipping corrupt line {lineno} in segment {seq}.")
+                        continue
+                    entries.append(entry)
+                    size += len(raw)
+            if full or seq == self._active_seq:
+                return entries, (seq, n)
+            # sealed segment fully read -> cursor moves to the next one
+            seg, idx = seq + 1, 0
+        return entries, (seg, idx)
+
+    def _commit(self, cursor: Cursor) -> None:
+        """Persist the cursor and delete segments that are entirely behind it."""
+        self._save_state(cursor)
+        for seq in self._segments():
+            if seq >= cursor[0]:
+                break
+            try:
+                os.remove(self._segment_path(seq))
+            except OSError as e:
+                log.warning(f"Could not delete uploaded segment {seq}: {e}")
+
+    def seal_page(
+        self, max_entries: Optional[int] = None
+    ) -> Tuple[Cursor, List[Dict], Cursor]:
+        """Snapshot the next page (at most max_entries, default PAGE_MAX_ENTRIES)
+        under a short lock. Returns (start, entries, end); the range [start, end)
+        is immutable because segments are append-only, so it can be sent without
+        holding the lock.
+        """
+        with self._locked():
+            self._flush()
+            start = self._load_cursor()
+            entries, end = self._read_page(max_entries)
+            self._inflight_end = end if entries else None
+            return start, entries, end
+
+    def seal_segment_page(self) -> Optional[Tuple[Cursor, bytes, Cursor]]:
+        """If the cursor sits at the start of a clean sealed segment, return
+        (start, gzip bytes of its JSON array, end) so the segment can be sent
+        without decompressing it. Returns None otherwise (use seal_page).
+        """
+        with self._locked():
+            self._flush()
+            state = self._load_state()
+            start = self._load_cursor()
+            seq, idx = start
+            if not os.path.exists(self._segment_path(seq)):
+                # cursor segment already gone (e.g. fresh buffer): next one, from its start
+                later = [s for s in self._segments() if s > seq]
+                if not later:
+                    return None
+                seq, idx = later[0], 0
+            path = self._sealed_path(seq)
+            if idx != 0 or seq == self._active_seq or not os.path.exists(path):
+                return None
+            if seq not in state.get("clean", []):
+                return None  # corrupt lines (or sealed before the check): page it
+            with open(path, "rb") as f:
+                raw = f.read()
+            # gzip trailer: ISIZE = uncompressed size mod 2**32
+            size = struct.unpack("<I", raw[-4:])[0] if len(raw) >= 4 else 0
+            if size == 0 or size > SEGMENT_STREAM_MAX_BYTES:
+                return None
+            end = (seq + 1, 0)
+            self._inflight_end = end
+            data_gz = gzip.compress(b"[", compresslevel=1) + raw
+            data_gz += gzip.compress(b"]", compresslevel=1)
+            return start, data_gz, end
+
+    def ack_page(self, start: Cursor, end: Cursor) -> bool:
+        """Advance the cursor from start to end after a successful send.
+        Ignored (returns False) if the cursor moved since the page was sealed.
+        """
+        with self._locked():
+            self._inflight_end = None
+            current = self._load_cursor()
+            if current != start:
+                log.warning(
+                    f"Buffer cursor moved during upload ({start} -> {current}); ack ignored."
+                )
+                return False
+            self._commit(end)
+            return True
+
+    def _reject_page(
+        self, start: Cursor, end: Cursor, entries: List[Dict], status: int
+    ) -> bool:
+        """Count a 4xx rejection of the page at start. Once it was rejected in
+        UPLOAD_REJECT_MAX_RUNS runs (a single entry answered 413: at once), append
+        it to the dead-letter file and move the cursor past it. Returns True if
+        the page was quarantined.
+        """
+        cursor, runs = self._rejected
+        runs = runs + 1 if cursor == start else 1
+        self._rejected = (start, runs)
+        if status != 413 and runs < UPLOAD_REJECT_MAX_RUNS:
+            log.warning(
+                f"Page at {start} rejected with {status} "
+                f"({runs}/{UPLOAD_REJECT_MAX_RUNS} runs); retrying next run."
+            )
+            return False
+
+        with self._locked():
+            self._inflight_end = None
+            if self._load_cursor() != start:
+                return False
+            with open(self._dead_letter_path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps({"status": status, "entry": entry}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._commit(end)
+        self._rejected = (None, 0)
+        REGISTRY.inc("upload_quarantined_entries_total", len(entries))
+        log.error(
+            f"Quarantined {len(entries)} entries at {start} after status {status} "
+            f"in {self._dead_letter_path}; continuing with the next page."
+        )
+        return True
+
+    # --------------------
+    # Stats
+    # --------------------
+    def stats(self) -> Dict[str, int]:
+        """Pending entries, segment count and bytes on disk. Entry counts of
+        sealed segments come from state.json (recorded when sealing), so no
+        segment is read.
+        """
+        with self._locked():
+            state = self._load_state()
+            cursor = self._load_cursor()
+            line_counts = state.get("lines", {})
+            seqs = self._segments()
+            entries = len(self._pending)
+            size = 0
+            for seq in seqs:
+                size += os.path.getsize(self._segment_path(seq))
+                if seq == self._active_seq:
+                    lines = self._active_entries
+                else:
+                    lines = line_counts.get(str(seq), 0)
+                if seq == cursor[0]:
+                    lines = max(lines - cursor[1], 0)
+                if seq >= cursor[0]:
+                    entries += lines
+            return {"pending_entries": entries, "segments": len(seqs), "bytes": size}
+
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        """Metrics collector: buffer backlog size."""
+        stats = self.stats()
+        registry.set("buffer_pending_entries", stats["pending_entries"])
+        registry.set("buffer_segments", stats["segments"])
+        registry.set("buffer_bytes", stats["bytes"])
+
+    # --------------------
+    # Retention / compaction
+    # --------------------
+    def enforce_retention(self) -> None:
+        """Keep the buffer within its byte and age budget (see _enforce_retention)."""
+        try:
+            with self._locked():
+                self._enforce_retention()
+        except Exception as e:
+            log.error(f"FileBuffer.enforce_retention failed: {e}")
+
+    def _enforce_retention(self) -> None:
+        """
+        Runs at startup and whenever the active segment is rotated:
+          1) evict the oldest segments whose newest entry is older than BUFFER_MAX_AGE_SECONDS
+          2) above COMPACT_AT_FRACTION of BUFFER_MAX_BYTES, roll up old sealed segments
+             into ROLLUP_BUCKET_SECONDS buckets (at most COMPACT_MAX_PER_PASS per run)
+          3) still above BUFFER_MAX_BYTES: evict the oldest segments
+        Every dropped segment is logged with its entry count and time range. The
+        active segment and segments of an in-flight upload page are never touched.
+        """
+        seqs = [s for s in self._segments() if s != self._active_seq]
+        protected = self._inflight_end[0] if self._inflight_end else -1
+
+        # 1) age budget
+        now = datetime.now(timezone.utc)
+        while seqs and seqs[0] > protected:
+            newest = _entry_time(self._read_segment(seqs[0])[-1:])
+            if (
+                newest is None
+                or (now - newest).total_seconds() <= BUFFER_MAX_AGE_SECONDS
+            ):
+                break
+            self._evict(seqs.pop(0), "age")
+
+        # 2) compaction near the byte budget
+        sizes = {s: os.path.getsize(self._segment_path(s)) for s in seqs}
+        total = sum(sizes.values()) + self._active_bytes
+        if total > COMPACT_AT_FRACTION * BUFFER_MAX_BYTES:
+            compacted = set(self._load_state().get("compacted", []))
+            budget = COMPACT_MAX_PER_PASS
+            for seq in seqs:
+                if budget == 0 or total <= COMPACT_AT_FRACTION * BUFFER_MAX_BYTES:
+                    break
+                if seq <= protected or seq in compacted:
+                    continue
+                new_size = self._compact(seq)
+                total += new_size - sizes[seq]
+                sizes[seq] = new_size
+                budget -= 1
+
+        # 3) hard byte budget: drop oldest data
+        while total > BUFFER_MAX_BYTES and seqs and seqs[0] > protected:
+            seq = seqs.pop(0)
+            total -= sizes[seq]
+            self._evict(seq, "size")
+        if total > BUFFER_MAX_BYTES:
+            log.warning(
+                f"Buffer still over budget ({total} > {BUFFER_MAX_BYTES} bytes); "
+                "remaining data is active or being uploaded."
+            )
+
+    def _read_segment(self, seq: int, start: int = 0) -> List[Dict]:
+        """All decodable entries of a segment from entry index start."""
+        entries: List[Dict] = []
+        with self._open_segment(seq) as f:
+            for lineno, raw in enumerate(f):
+                if lineno < start:
+                    continue
+                entry = _decode_line(raw)
+                if entry is not None:
+                    entries.append(entry)
+        return entries
+
+    def _evict(self, seq: int, reason: str) -> None:
+        """Delete a whole (oldest) segment and move the cursor past it."""
+        cursor = self._load_cursor()
+        start = cursor[1] if seq == cursor[0] else 0
+        path = self._segment_path(seq)
+        size = os.path.getsize(path)
+        entries = self._read_segment(seq, start)
+        os.remove(path)
+        if cursor[0] <= seq:
+            self._save_state((seq + 1, 0))
+        first = entries[0].get("timestamp") if entries else None
+        last = entries[-1].get("timestamp") if entries else None
+        log.warning(
+            f"Retention ({reason}): dropped segment {seq} with {len(entries)} "
+            f"pending entries ({first} .. {last}), {size} bytes."
+        )
+
+    def _compact(self, seq: int) -> int:
+        """Replace a sealed segment's pending entries by rollups. Returns the new size."""
+        cursor = self._load_cursor()
+        start = cursor[1] if seq == cursor[0] else 0
+        path = self._segment_path(seq)
+        before = os.path.getsize(path)
+        entries = self._read_segment(seq, start)
+        rolled = _rollup(entries, ROLLUP_BUCKET_SECONDS)
+
+        self._write_sealed(seq, [_encode_line(e).rstrip(b"\n") for e in rolled])
+        path = self._sealed_path(seq)
+
+        compacted = self._load_state().get("compacted", []) + [seq]
+        self._save_state((seq, 0) if seq == cursor[0] else cursor, compacted)
+        after = os.path.getsize(path)
+        log.info(
+            f"Retention: compacted segment {seq} from {len(entries)} to "
+            f"{len(rolled)} entries ({before} -> {after} bytes)."
+        )
+        return after
+
+    def upload_and_clear(self) -> bool:
+        """Upload pending entries page by page, committing the cursor after each
+        acknowledged page. Stops at the first failure; the next run resumes from the
+        last acknowledged page. Returns True if nothing is left to retry.
+        A 413 halves the page; other 4xx rejections go through _reject_page.
+
+        The buffer lock is only held while sealing and acknowledging a page, never
+        during the HTTP request, so appends are not blocked by a slow network.
+        """
+        if not self._upload_guard.acquire(blocking=False):
+            log.info("Upload already in progress; skipping.")
+            return True
+        try:
+            connector = get_connector(apigateway_url, apigateway_key)
+            sent = 0
+            sent_segments = 0
+            splice = UPLOAD_GZIP and UPLOAD_FORMAT == FORMAT_ENTRIES
+            max_entries = PAGE_MAX_ENTRIES  # halved on 413 for the rest of the run
+            for page_no in range(UPLOAD_MAX_PAGES_PER_RUN):
+                if splice:
+                    sealed = self.seal_segment_page()
+                    if sealed is not None:
+                        start, data_gz, end = sealed
+                        resp = connector.post_gzip_data(
+                            endpoint="power",
+                            payload_parent_keys={
+                                "deviceId": device_id,
+                                "units": FIELD_UNITS,
+                            },
+                            data_gz=data_gz,
+                            timeout=UPLOAD_TIMEOUT,
+                        )
+                        log.info(
+                            f"Upload status (page {page_no + 1}, segment {start[0]}, "
+                            f"{len(data_gz)} bytes): {resp.status_code}"
+                        )
+                        if _rejected(resp.status_code):
+                            # the same entries go again as (smaller) pages
+                            log.warning(
+                                f"Segment {start[0]} rejected with {resp.status_code}; "
+                                "sending it in pages."
+                            )
+                            splice = False
+                            continue
+                        if resp.status_code != 200:
+                            log.error(f"Upload failed with status: {resp.status_code}")
+                            return False
+                        if not self.ack_page(start, end):
+                            return False
+                        sent_segments += 1
+                        REGISTRY.inc("upload_segments_total")
+                        continue
+
+                start, data, end = self.seal_page(max_entries)
+
+                if not data:
+                    if end != start:
+                        self.ack_page(start, end)
+                    if sent == 0 and sent_segments == 0:
+                        log.info("No data to send.")
+                    break
+
+                parent_keys = {"deviceId": device_id, "units": FIELD_UNITS}
+                if UPLOAD_FORMAT == FORMAT_COLUMNAR:
+                    parent_keys["format"] = FORMAT_COLUMNAR
+                    body = encode_power_batch(data)
+                else:
+                    body = data
+
+                resp = connector.post_dict(
+                    endpoint="power",
+                    payload_parent_keys=parent_keys,
+                    data=body,
+                    timeout=UPLOAD_TIMEOUT,
+                    compress=UPLOAD_GZIP,
+                )
+                log.info(
+                    f"Upload status (page {page_no + 1}, {len(data)} entries): {resp.status_code}"
+                )
+                if resp.status_code == 413 and len(data) > 1:
+                    max_entries = len(data) // 2
+                    log.warning(
+                        f"Page of {len(data)} entries too large (413); "
+                        f"retrying with {max_entries}."
+                    )
+                    continue
+                if _rejected(resp.status_code):
+                    if self._reject_page(start, end, data, resp.status_code):
+                        continue
+                    return False
+                if resp.status_code != 200:
+                    log.error(f"Upload failed with status: {resp.status_code}")
+                    return False
+
+                self._rejected = (None, 0)
+                if not self.ack_page(start, end):
+                    return False
+                sent += len(data)
+                REGISTRY.inc("upload_entries_total", len(data))
+            else:
+                log.info(
+                    f"Page limit per run reached ({UPLOAD_MAX_PAGES_PER_RUN}); "
+                    "remaining backlog is sent next run."
+                )
+
+            if sent or sent_segments:
+                log.info(
+                    f"{sent} entries and {sent_segments} sealed segments successfully "
+                    "sent and acknowledged in buffer."
+                )
+            return True
+        except Exception as e:
+            log.error(f"FileBuffer.upload_and_clear failed: {e}")
+            return False
+        finally:
+            self._inflight_end = None
+            self._upload_guard.release()
+
+
+# --------------------
+# Background uploader
+# --------------------
+class BufferUploader(threading.Thread):
+    """
+    Drains a FileBuffer on its own thread whenever triggered, so the scheduler
+    (and aggregation) never waits on the network.
+    """
+
+    def __init__(self, buffer: FileBuffer):
+        super().__init__(daemon=True)
+        self.buffer = buffer
+        self.stop_event = threading.Event()
+        self._wakeup = threading.Event()
+
+    def trigger(self) -> None:
+        """Request an upload run (coalesced if one is already pending)."""
+        self._wakeup.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self.stop_event.is_set():
+                break
+            with REGISTRY.timer("upload_run_seconds"):
+                ok = self.buffer.upload_and_clear()
+            REGISTRY.inc("upload_runs_total", result="ok" if ok else "failed")
+            if ok:
+                log.info("Upload job: success or nothing to upload.")
+            else:
+                log.warning("Upload job: failed, will retry later.")
+
+    def stop(self):
+        self.stop_event.set()
+        self._wakeup.set()
+
+
+# --------------------
+# Helpers
+# --------------------
+def _encode_line(entry: Dict) -> bytes:
+    return (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _rejected(status: int) -> bool:
+    """A 4xx answer about the page itself (see UPLOAD_RETRY_STATUSES)."""
+    return 400 <= status < 500 and status not in UPLOAD_RETRY_STATUSES
+
+
+def _valid_line(raw: bytes) -> bool:
+    """A plain segment line (no newline) that is one JSON object on its own."""
+    try:
+        return isinstance(json.loads(raw), dict)
+    except (ValueError, UnicodeDecodeError):
+        return False
+
+
+def _decode_line(raw: bytes) -> Optional[Dict]:
+    """Decode one segment line (sealed segments end lines with ',')."""
+    try:
+        return json.loads(raw.rstrip(b",\r\n"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _entry_time(entries: List[Dict]) -> Optional[datetime]:
+    """Timestamp of the first entry in the list (aware datetime), if parseable."""
+    if not entries:
+        return None
+    try:
+        ts = datetime.fromisoformat(entries[0].get("timestamp", ""))
+    except (TypeError, ValueError):
+        return None
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+
+
+def _rollup(entries: List[Dict], bucket_seconds: int) -> List[Dict]:
+    """Merge consecutive entries that fall in the same time bucket into one entry."""
+    out: List[Dict] = []
+    group: List[Dict] = []
+    key = None
+    for entry in entries:
+        ts = _entry_time([entry])
+        k = int(ts.timestamp() // bucket_seconds) if ts is not None else None
+        if group and (k is None or k != key):
+            out.append(_merge_entries(group))
+            group = []
+        if k is None:
+            out.append(entry)
+            continue
+        group.append(entry)
+        key = k
+    if group:
+        out.append(_merge_entries(group))
+    return out
+
+
+def _merge_entries(group: List[Dict]) -> Dict:
+    """Rollup of several entries: last-seen values, combined window statistics, and
+    a "rollup" marker with the number of original entries and their time span.
+    """
+    if len(group) == 1:
+        return group[0]
+    first, last = group[0], group[-1]
+    merged: Dict = {"timestamp": last.get("timestamp")}
+    merged["rollup"] = {
+        "entries": sum(e.get("rollup", {}).get("entries", 1) for e in group),
+        "from": first.get("rollup", {}).get("from", first.get("timestamp")),
+        "to": last.get("timestamp"),
+    }
+    keys: List[str] = []
+    for e in group:
+        keys.extend(k for k in e if k not in keys and k not in ("timestamp", "rollup"))
+    for k in keys:
+        values = [e[k] for e in group if k in e]
+        if all(isinstance(v, dict) for v in values):
+            merged[k] = _merge_role(values)
+        else:
+            merged[k] = values[-1]
+    return merged
+
+
+def _merge_role(frames: List[Dict]) -> Dict:
+    merged: Dict = {}
+    for frame in frames:
+        merged.update(frame)
+    stats = [f["stats"] for f in frames if isinstance(f.get("stats"), dict)]
+    if stats:
+        merged["stats"] = _merge_stats(stats)
+    # event counters (e.g. "motion") add up over the rolled-up entries
+    counts = [f["counts"] for f in frames if isinstance(f.get("counts"), dict)]
+    if counts:
+        total: Dict = {}
+        for c in counts:
+            for k, v in c.items():
+                total[k] = total.get(k, 0) + v
+        merged["counts"] = total
+    return merged
+
+
+def _merge_stats(windows: List[Dict]) -> Dict:
+    """Combine WindowStats summaries (see module/vedirect.py) of consecutive windows."""
+    out: Dict = {
+        "window_s": round(sum(w.get("window_s", 0) for w in windows), 1),
+        "frames": sum(w.get("frames", 0) for w in windows),
+    }
+    energy: Dict[str, float] = {}
+    for w in windows:
+        for name, value in w.get("energy", {}).items():
+            energy[name] = round(energy.get(name, 0.0) + value, 4)
+        for k, fs in w.items():
+            if not isinstance(fs, dict) or "n" not in fs:
+                continue
+            acc = out.get(k)
+            if acc is None:
+                out[k] = dict(fs)
+                continue
+            n = acc["n"] + fs["n"]
+            acc["min"] = min(acc["min"], fs["min"])
+            acc["max"] = max(acc["max"], fs["max"])
+            acc["mean"] = round((acc["mean"] * acc["n"] + fs["mean"] * fs["n"]) / n, 2)
+            acc["last"] = fs["last"]
+            acc["n"] = n
+    if energy:
+        out["energy"] = energy
+    return out
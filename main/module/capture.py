@@ -0,0 +1,222 @@
+# capture.py
+# ------------------------------------------------------------
+# Raw serial capture (for offline replay, see replay.py)
+# - With capture on, every reader also writes the raw bytes it reads, with
+#   wall-clock timestamps, to a capture file per port in RAW_CAPTURE_DIR.
+# - File layout (gzip-compressed as a whole):
+#     b"VEDCAP1 " + JSON metadata (port, stable port id, role, baud, start) + b"\n"
+#     records: struct "<dBI" (time.time(), kind, length) + payload
+#   kind KIND_OPEN marks a (re)opened port (the parser starts over there),
+#   KIND_DATA carries the bytes of one serial read.
+# - Files rotate at RAW_CAPTURE_FILE_BYTES (compressed) and on a role change;
+#   only the newest RAW_CAPTURE_MAX_FILES per port are kept.
+# - The gzip stream is flushed every RAW_CAPTURE_FLUSH_SECONDS, so a crash
+#   loses at most that much; a truncated tail is ignored when reading.
+# ------------------------------------------------------------
+
+import glob
+import gzip
+import json
+import os
+import re
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from module.utils.logger import setup_custom_logger
+
+# --------------------
+# Constants (fixed)
+# --------------------
+RAW_CAPTURE_DIR = "/container_storage/raw_capture"
+RAW_CAPTURE_FILE_BYTES = (
+    4 * 1024 * 1024
+)  # compressed bytes per file (~1-2 days at 19200 baud)
+RAW_CAPTURE_MAX_FILES = 16  # per port
+RAW_CAPTURE_FLUSH_SECONDS = 10
+RAW_CAPTURE_GZIP_LEVEL = 6
+
+MAGIC = b"VEDCAP1 "
+RECORD = struct.Struct("<dBI")  # time.time(), kind, payload length
+KIND_DATA = 0
+KIND_OPEN = 1
+
+CAPTURE_PREFIX = "raw-"
+CAPTURE_SUFFIX = ".vedcap.gz"
+
+log = setup_custom_logger("module.capture")
+
+Record = Tuple[float, int, bytes]  # (time.time(), kind, payload)
+
+
+def _file_key(port_id: str) -> str:
+    """File-name safe form of a (stable) port id."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", os.path.basename(port_id))
+
+
+class RawCapture:
+    """Rotating raw capture of one serial port. write() is called from the
+    reader thread; set_role()/close() may come from other threads.
+    """
+
+    def __init__(
+        self,
+        port: str,
+        role: str,
+        port_id: Optional[str] = None,
+        baud: int = 19200,
+        directory: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.port = port
+        self.port_id = port_id or port
+        self.role = role
+        self.baud = baud
+        self.directory = directory or RAW_CAPTURE_DIR
+        self.clock = clock
+        self._key = _file_key(self.port_id)
+        self._lock = threading.Lock()
+        self._raw: Optional[IO[bytes]] = None
+        self._gz: Optional[gzip.GzipFile] = None
+        self._last_flush = 0.0
+        self._failed = False
+
+    # --------------------
+    # Writing
+    # --------------------
+    def opened(self) -> None:
+        """Mark a (re)opened port: replay resets its parser here."""
+        self._record(KIND_OPEN, b"")
+
+    def write(self, data: bytes) -> None:
+        self._record(KIND_DATA, data)
+
+    def _record(self, kind: int, data: bytes) -> None:
+        now = self.clock()
+        with self._lock:
+            if self._failed:
+                return
+            try:
+                if self._gz is None:
+                    self._open(now)
+                self._gz.write(RECORD.pack(now, kind, len(data)))
+                if data:
+                    self._gz.write(data)
+                if now - self._last_flush >= RAW_CAPTURE_FLUSH_SECONDS:
+                    self._gz.flush()
+                    self._last_flush = now
+                    if self._raw.tell() >= RAW_CAPTURE_FILE_BYTES:
+                        self._close_file()
+            except Exception as e:
+                # never let capture break reading; stay off until restart
+                log.error(f"Raw capture of {self.port} failed, disabling it: {e}")
+                self._failed = True
+                self._close_file()
+
+    def _open(self, now: float) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.fromtimestamp(now).strftime("%Y%m%dT%H%M%S_%f")
+        path = os.path.join(
+            self.directory, f"{CAPTURE_PREFIX}{self._key}-{stamp}{CAPTURE_SUFFIX}"
+        )
+        self._raw = open(path, "wb")
+        self._gz = gzip.GzipFile(
+            fileobj=self._raw, mode="wb", compresslevel=RAW_CAPTURE_GZIP_LEVEL
+        )
+        meta = {
+            "port": self.port,
+            "port_id": self.port_id,
+            "role": self.role,
+            "baud": self.baud,
+            "start": now,
+        }
+        self._gz.write(MAGIC + json.dumps(meta).encode("utf-8") + b"\n")
+        self._last_flush = now
+        self._prune()
+        log.info(f"Raw capture of {self.port} ({self.role}) -> {path}")
+
+    def _close_file(self) -> None:
+        for f in (self._gz, self._raw):
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+        self._gz = self._raw = None
+
+    def _prune(self) -> None:
+        pattern = os.path.join(
+            self.directory, f"{CAPTURE_PREFIX}{self._key}-*{CAPTURE_SUFFIX}"
+        )
+        for path in sorted(glob.glob(pattern))[:-RAW_CAPTURE_MAX_FILES]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning(f"Could not delete old capture {path}: {e}")
+
+    def set_role(self, role: str) -> None:
+        """Continue under a new role (starts a new file, so headers stay right)."""
+        with self._lock:
+            if role != self.role:
+                self.role = role
+                self._close_file()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_file()
+
+
+# --------------------
+# Reading
+# --------------------
+def read_capture(path: str) -> Tuple[Dict[str, Any], Iterator[Record]]:
+    """Metadata and the records of one capture file. A truncated tail (crash,
+    capture still being written) ends the iteration quietly.
+    """
+    f = gzip.open(path, "rb")
+    header = f.readline()
+    if not header.startswith(MAGIC):
+        f.close()
+        raise ValueError(f"{path} is not a raw capture file")
+    meta = json.loads(header[len(MAGIC) :])
+
+    def records() -> Iterator[Record]:
+        try:
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                t, kind, length = RECORD.unpack(head)
+                data = f.read(length) if length else b""
+                if len(data) < length:
+                    return
+                yield t, kind, data
+        except (EOFError, OSError) as e:
+            log.warning(f"{path}: capture ends early ({e}).")
+        finally:
+            f.close()
+
+    return meta, records()
+
+
+def capture_files(paths: List[str]) -> Dict[str, List[str]]:
+    """Capture files grouped by port file key, oldest first. Directories are
+    searched for capture files; files are taken as given.
+    """
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                glob.glob(os.path.join(path, f"{CAPTURE_PREFIX}*{CAPTURE_SUFFIX}"))
+            )
+        else:
+            files.append(path)
+    groups: Dict[str, List[str]] = {}
+    for path in sorted(files):
+        name = os.path.basename(path)
+        # raw-<key>-YYYYmmddTHHMMSS_ffffff.vedcap.gz
+        key = name[len(CAPTURE_PREFIX) : -len(CAPTURE_SUFFIX)].rsplit("-", 1)[0]
+        groups.setdefault(key, []).append(path)
+    return groups
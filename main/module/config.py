@@ -1,33 +1,232 @@
+# config.py
+# ------------------------------------------------------------
+# Remote device configuration: GET /device?deviceid=<DEVICE_ID> answers
+# {"config": "<toml>"}.
+# - Startup never waits on the network. The constructor only reads the last
+#   config from the on-disk cache (CONFIG_CACHE_PATH). Fetching runs on
+#   AppConfig's own thread.
+# - The config is revalidated every CONFIG_TTL_SECONDS with If-None-Match
+#   (ETag); a 304 only renews the cache. A jitter keeps a fleet from asking
+#   in the same second. Failures keep the last config and retry after
+#   CONFIG_RETRY_SECONDS, doubling up to the TTL.
+# - Every accepted change bumps .version. main.py checks it in its loop and
+#   applies the [station] values (intervals, freshness, capture time) live.
+# - get() checks type and range and falls back to the built-in default (one
+#   warning), so a bad fleet config never takes a station down.
+# ------------------------------------------------------------
+
+import json
 import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
 
 import toml
 
-from module.aws.apigateway import ApiGatewayConnector
+from module.aws.apigateway import get_connector
 from module.utils.logger import setup_custom_logger
+from module.utils.metrics import REGISTRY, MetricsRegistry
+
+# --------------------
+# Constants (fixed)
+# --------------------
+CONFIG_CACHE_PATH = "/container_storage/device_config.json"
+CONFIG_TTL_SECONDS = 15 * 60  # revalidate the cached config this often
+CONFIG_RETRY_SECONDS = 30  # first retry after a failed fetch (doubles up to the TTL)
+CONFIG_JITTER = 0.1  # +-10% on every wait
+CONFIG_FETCH_TIMEOUT = (10, 30)  # (connect, read) seconds
 
 logger = setup_custom_logger(__name__)
 
 
-class AppConfig:
-    def __init__(self):
+def _jitter(seconds: float) -> float:
+    return seconds * random.uniform(1 - CONFIG_JITTER, 1 + CONFIG_JITTER)
+
+
+class AppConfig(threading.Thread):
+    """
+    Device config from the API Gateway, cached on disk and refreshed on this
+    thread. .config is the parsed TOML of the newest good config ({} until one
+    is known); read single values with get().
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        super().__init__(daemon=True)
         self.base_url = os.getenv("API_GATEWAY_MILJOSTASJON_URL")
         self.api_key = os.getenv("API_GATEWAY_MILJOSTASJON_KEY")
         self.device_id = os.getenv("DEVICE_ID")
-        self.config = self.load_config()
+        self.path = path or CONFIG_CACHE_PATH
+        self.stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._text = ""
+        self._config: Dict[str, Any] = {}
+        self._etag: Optional[str] = None
+        self._fetched_at = 0.0  # time.time() of the last successful (re)validation
+        self._warned = set()
+        self.version = 0  # bumped on every change
+        self._load_cache()
 
-    def load_config(self):
+    # --------------------
+    # Values
+    # --------------------
+    @property
+    def config(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._config
+
+    def get(
+        self,
+        section: str,
+        key: str,
+        default: Any,
+        minimum: Optional[float] = None,
+        maximum: Optional[float] = None,
+        check: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        config[section][key] if it is set and valid: same type as default (an
+        int is fine for a float), within [minimum, maximum] and passing check.
+        Otherwise default.
+        """
+        table = self.config.get(section)
+        value = table.get(key) if isinstance(table, dict) else None
+        if value is None:
+            return default
+
+        expected = (int, float) if isinstance(default, float) else type(default)
+        ok = isinstance(value, expected) and isinstance(value, bool) == isinstance(
+            default, bool
+        )
+        if ok and minimum is not None and value < minimum:
+            ok = False
+        if ok and maximum is not None and value > maximum:
+            ok = False
+        if ok and check is not None and not check(value):
+            ok = False
+        if not ok:
+            if (section, key, repr(value)) not in self._warned:
+                self._warned.add((section, key, repr(value)))
+                logger.warning(
+                    f"Invalid config value {section}.{key} = {value!r}; using {default!r}."
+                )
+            return default
+        return value
+
+    def _set(self, text: str, config: Dict[str, Any], etag: Optional[str]) -> bool:
+        """Take a new config; True if it differs from the current one."""
+        with self._lock:
+            self._etag = etag
+            if text == self._text:
+                return False
+            self._text = text
+            self._config = config
+            self.version += 1
+        logger.info(f"Device config updated (version {self.version}).")
+        return True
+
+    # --------------------
+    # Disk cache
+    # --------------------
+    def _load_cache(self) -> None:
         try:
-            apigateway = ApiGatewayConnector(
-                base_url=self.base_url, api_key=self.api_key
+            with open(self.path, "r") as f:
+                cached = json.load(f)
+            config = toml.loads(cached["config"])
+        except FileNotFoundError:
+            logger.info(
+                "No cached device config; using built-in defaults until fetched."
             )
-            response = apigateway.get_data(
-                endpoint="device", query=f"deviceid={self.device_id}"
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable config cache {self.path}: {e}")
+            return
+        self._set(cached["config"], config, cached.get("etag"))
+        self._fetched_at = float(cached.get("fetched_at", 0.0))
+
+    def _save_cache(self) -> None:
+        with self._lock:
+            cached = {
+                "etag": self._etag,
+                "fetched_at": self._fetched_at,
+                "config": self._text,
+            }
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(cached, f, indent=4)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save config cache {self.path}: {e}")
+
+    # --------------------
+    # Fetching
+    # --------------------
+    def fetch(self) -> bool:
+        """One (conditional) GET of the device config. True if the config is now current."""
+        headers = {"If-None-Match": self._etag} if self._etag else None
+        try:
+            apigateway = get_connector(self.base_url, self.api_key)
+            response = apigateway.get_response(
+                "device",
+                params={"deviceid": self.device_id},
+                headers=headers,
+                timeout=CONFIG_FETCH_TIMEOUT,
             )
-            return toml.loads(response["config"])
+            if response.status_code == 304:
+                self._fetched_at = time.time()
+                self._save_cache()
+                REGISTRY.inc("config_fetches_total", result="not_modified")
+                return True
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            text = response.json()["config"]
+            config = toml.loads(text)
         except Exception as e:
-            logger.error(f"Failed to load config: {e}")
-            raise
+            logger.warning(
+                f"Failed to fetch device config, keeping the current one: {e}"
+            )
+            REGISTRY.inc("config_fetches_total", result="failed")
+            return False
+
+        self._fetched_at = time.time()
+        changed = self._set(text, config, response.headers.get("ETag"))
+        self._save_cache()
+        REGISTRY.inc(
+            "config_fetches_total", result="changed" if changed else "unchanged"
+        )
+        return True
+
+    def refresh(self) -> None:
+        """Revalidate now instead of at the end of the TTL."""
+        self._wakeup.set()
+
+    def run(self):
+        if not (self.base_url and self.device_id):
+            logger.warning(
+                "API Gateway URL or DEVICE_ID not set; using cached/built-in config only."
+            )
+            return
+        # a fresh cached config is trusted until its TTL runs out
+        wait = max(0.0, self._fetched_at + CONFIG_TTL_SECONDS - time.time())
+        retry = CONFIG_RETRY_SECONDS
+        while not self.stop_event.is_set():
+            self._wakeup.wait(_jitter(wait))
+            self._wakeup.clear()
+            if self.stop_event.is_set():
+                break
+            if self.fetch():
+                wait, retry = CONFIG_TTL_SECONDS, CONFIG_RETRY_SECONDS
+            else:
+                wait, retry = retry, min(retry * 2, CONFIG_TTL_SECONDS)
 
+    def stop(self):
+        self.stop_event.set()
+        self._wakeup.set()
 
-# def load_toml_from_string(toml_string):
-#     return toml.loads(toml_string)
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        """Metrics collector: config version and age."""
+        registry.set("config_version", self.version)
+        if self._fetched_at:
+            registry.set("config_age_seconds", round(time.time() - self._fetched_at, 1))
@@ -2,36 +2,55 @@
 # ------------------------------------------------------------
 # Robust VE.Direct device discovery + continuous readers
 # - Detects MPPTs and SmartShunt, classifies roles, and ensures
-#   stable names based on SER# (lowest -> 'charger', next -> 'charger_2').
+#   stable names based on SER# (lowest -> 'charger', next -> 'charger_2',
+#   then 'charger_3', ...).
 #   * SmartShunt is accepted even if SER# is missing (PID/signature).
 #   * Chargers are accepted even if SER# is missing (logged warning).
 #     For ordering, devices without SER# are sorted last (tie-breaker: port).
-# - Each device has its own continuous reader thread.
-# - Frames are parsed using 'Checksum' as the end-of-frame marker.
+# - Each device has its own continuous reader thread, or optionally all
+#   devices share one selector-based SerialReaderEngine thread.
+# - Frames are parsed by VEDirectParser (module/vedirect.py), which validates
+#   the VE.Direct checksum and skips interleaved HEX messages.
 # - Each reader MERGES keys across multiple frames into a rolling snapshot,
 #   so history fields (SmartShunt H17/H18, MPPT H19–H22) are reliably present.
-# - A shared dict holds the latest merged snapshot per role (updated by readers,
-#   consumed by main.py).
-# - File buffer and upload are encapsulated in FileBuffer.
+# - A shared dict holds the latest merged snapshot per role as a typed,
+#   fixed-layout Snapshot, built lazily when main.py reads it.
+# - Optionally every reader also records its raw byte stream to rotating
+#   capture files (module/capture.py) for offline replay (replay.py).
+# - Mergers announce once per role when the required keys are present
+#   (on_ready), which is what main.py's startup gate waits for (module/startup.py).
+# - File buffer and upload are encapsulated in FileBuffer (module/buffer.py).
 # ------------------------------------------------------------
 
 import base64
-import fcntl
 import json
 import os
 import platform
+import selectors
 import threading
 import time
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 import cv2
 from serial import Serial
 from serial.tools import list_ports
-from tzlocal import get_localzone
 
-from module.aws.apigateway import ApiGatewayConnector
+from module.aws.apigateway import get_connector
+from module.capture import RawCapture
 from module.utils.logger import setup_custom_logger
+from module.utils.metrics import REGISTRY, MetricsRegistry
+from module.vedirect import (
+    FIELD_INDEX,
+    FIELD_NAMES,
+    MISSING,
+    STATS_FIELDS,
+    Snapshot,
+    VEDirectParser,
+    WindowStats,
+    parse_value,
+)
 
 # --------------------
 # Environment (kept) & constants (fixed)
@@ -40,22 +59,62 @@ apigateway_url = os.getenv("API_GATEWAY_MILJOSTASJON_URL")
 apigateway_key = os.getenv("API_GATEWAY_MILJOSTASJON_KEY")
 device_id = os.getenv("DEVICE_ID")
 
-BUFFER_PATH = "/container_storage/temporary_device_data.json"  # single persisted file
-
 # Serial defaults (fixed)
 DEFAULT_BAUD = 19200
 DEFAULT_TIMEOUT = 3  # seconds
 
-# Probe window per port at startup (fixed)
+# Upper bound of the probe window per port at startup (fixed). Ports are probed
+# in parallel and a probe ends early once the device is identified.
 PROBE_SECONDS = 30  # increase to 45 if a device needs longer to emit a full frame
 
+# Device identity cache: probe results keyed by stable /dev/serial/by-id path,
+# trusted at startup (no probe) and verified against the readers' first frames
+IDENTITY_CACHE_PATH = "/container_storage/device_identity.json"
+SERIAL_BY_ID_DIR = "/dev/serial/by-id"
+IDENTITY_VERIFY_SECONDS = PROBE_SECONDS  # how long to wait for first frames
+# Sample keys that classify_roles/the signature checks look at
+IDENTITY_KEYS = ("PID", "SER#", "FW", "BMV", "HSDS", "MPPT", "PPV", "SOC", "TTG", "CE")
+
 # Freshness window used by aggregator to include a device into an entry (fixed)
 FRESHNESS_SECONDS = 120  # seconds
 
 # Webcam settings (fixed)
 WEBCAM_PORT = 0
-WARMUP_SECONDS = 10
-TMP_FOLDER = "/tmp"
+WARMUP_SECONDS = 10  # upper bound; warmup ends once exposure/white balance settle
+WEBCAM_WIDTH = 1920
+WEBCAM_HEIGHT = 1080
+WEBCAM_JPEG_QUALITY = 85  # 0-100; 100 roughly triples the size for no visible gain
+
+# Exposure convergence during warmup: every WARMUP_SAMPLE_EVERY-th frame is
+# decoded, downscaled to WARMUP_STATS_SIZE and its mean brightness and colour
+# balance compared with the previous sample. Warmup ends after
+# WARMUP_STABLE_SAMPLES consecutive samples within tolerance.
+WARMUP_MIN_SECONDS = 1.0
+WARMUP_SAMPLE_EVERY = 3  # frames
+WARMUP_STATS_SIZE = (64, 36)  # (w, h)
+WARMUP_STABLE_SAMPLES = 3
+WARMUP_BRIGHTNESS_TOL = 2.0  # mean luma, 0-255
+WARMUP_WB_TOL = 0.02  # B/G and R/G ratio
+
+# Image upload: "json" is the legacy base64-in-JSON body (default); "binary"
+# posts the JPEG bytes as-is (image/jpeg, deviceId and timestamp in the query
+# string) and must only be set once the API accepts that body.
+IMAGE_UPLOAD_MODE = "json"
+IMAGE_UPLOAD_TIMEOUT = (10, 120)  # (connect, read) seconds
+
+# Perceptual-hash (dHash, 64 bit) dedup of webcam uploads. A capture within
+# WEBCAM_DEDUP_DISTANCE bits of the last full upload is not sent in full:
+# "skip" drops it, "thumbnail" sends a WEBCAM_THUMBNAIL_SIZE image plus hash.
+# A full image is always sent once the last one is older than WEBCAM_DEDUP_MAX_AGE.
+# Off by default: every capture is sent in full, in the request body the API
+# has always received (no "phash"/"thumbnail" keys). "thumbnail" needs a
+# backend that keeps thumbnails apart from the daily photo.
+WEBCAM_DEDUP_MODE = "off"  # "off" | "skip" | "thumbnail"
+WEBCAM_DEDUP_DISTANCE = 6  # Hamming distance (bits of 64)
+WEBCAM_DEDUP_MAX_AGE = 7 * 24 * 3600  # seconds
+WEBCAM_THUMBNAIL_SIZE = (320, 180)  # (w, h)
+WEBCAM_HASH_CACHE_PATH = "/container_storage/webcam_hashes.json"
+WEBCAM_HASH_CACHE_SIZE = 30  # most recent uploads kept
 
 # PID hints (informational)
 PID_TO_ROLE = {
@@ -63,8 +122,10 @@ PID_TO_ROLE = {
     "0xA389": "loadlogger",  # SmartShunt
 }
 
+# Must-have keys per role (charger_3, charger_4, ... use the 'charger' set,
+# see required_keys_for)
 REQUIRED_KEYS = {
-    "loadlogger": ("PID", "V", "I", "P", "SOC", "CE", "H17"),
+    "loadlogger": ("PID", "V", "I", "P", "SOC", "CE", "H17"),  # H18 fjernet
     "charger": ("PID", "SER#", "V", "I", "VPV", "PPV", "H22"),
     "charger_2": ("PID", "SER#", "V", "I", "VPV", "PPV", "H22"),
 }
@@ -81,11 +142,105 @@ webcam_logger = setup_custom_logger("webcam")
 # --------------------
 # Webcam
 # --------------------
+# One user of the camera at a time (Webcam captures vs. module/motion.py).
+# A capture sets camera_wanted so the motion detector releases the camera.
+camera_lock = threading.Lock()
+camera_wanted = threading.Event()
+
+
+class ExposureTracker:
+    """Tracks brightness and white balance of downscaled frames during warmup."""
+
+    def __init__(self):
+        self.prev: Optional[Tuple[float, float, float]] = None
+        self.stable = 0
+
+    def update(self, frame) -> bool:
+        """Add a frame; True once the last WARMUP_STABLE_SAMPLES samples agree."""
+        small = cv2.resize(frame, WARMUP_STATS_SIZE, interpolation=cv2.INTER_AREA)
+        b, g, r = cv2.mean(small)[:3]
+        g = max(g, 1.0)
+        stats = (0.114 * b + 0.587 * g + 0.299 * r, b / g, r / g)
+        if self.prev is not None and (
+            abs(stats[0] - self.prev[0]) <= WARMUP_BRIGHTNESS_TOL
+            and abs(stats[1] - self.prev[1]) <= WARMUP_WB_TOL
+            and abs(stats[2] - self.prev[2]) <= WARMUP_WB_TOL
+        ):
+            self.stable += 1
+        else:
+            self.stable = 0
+        self.prev = stats
+        return self.stable >= WARMUP_STABLE_SAMPLES
+
+
+def dhash(frame) -> int:
+    """64-bit difference hash: 9x8 grayscale, one bit per horizontal gradient."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ImageHashCache:
+    """
+    Perceptual hashes of recently uploaded images, persisted as JSON:
+      [{"hash": "<16 hex>", "ts": <epoch seconds>, "kind": "full"|"thumbnail"}, ...]
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or WEBCAM_HASH_CACHE_PATH
+        self.items: List[Dict[str, Any]] = self._load()
+
+    def _load(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path, "r") as f:
+                items = json.load(f)
+            return items if isinstance(items, list) else []
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            webcam_logger.warning(f"Ignoring unreadable hash cache {self.path}: {e}")
+            return []
+
+    def last_full(self) -> Optional[Dict[str, Any]]:
+        for item in reversed(self.items):
+            if item.get("kind") == "full":
+                return item
+        return None
+
+    def add(self, value: int, kind: str) -> None:
+        self.items.append({"hash": f"{value:016x}", "ts": time.time(), "kind": kind})
+        self.items = self.items[-WEBCAM_HASH_CACHE_SIZE:]
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.items, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            webcam_logger.warning(f"Could not save hash cache {self.path}: {e}")
+
+
 class Webcam:
-    def __init__(self, port: int = WEBCAM_PORT, tmp_folder: str = TMP_FOLDER):
+    def __init__(
+        self,
+        port: int = WEBCAM_PORT,
+        width: int = WEBCAM_WIDTH,
+        height: int = WEBCAM_HEIGHT,
+        quality: int = WEBCAM_JPEG_QUALITY,
+    ):
         self.port = port
-        self.tmp_folder = tmp_folder
+        self.width = width
+        self.height = height
+        self.quality = quality
         self.cap = None
+        self.hashes = ImageHashCache()
         webcam_logger.info(f"Webcam initialized with port {self.port}.")
 
     def _init_camera(self) -> bool:
@@ -95,8 +250,8 @@ class Webcam:
             time.sleep(1)
 
         self.cap = cv2.VideoCapture(self.port)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
         self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"JPEG"))
 
         if not self.cap.isOpened():
@@ -105,6 +260,13 @@ class Webcam:
         return True
 
     def trigger(self):
+        camera_wanted.set()
+        with camera_lock:
+            camera_wanted.clear()
+            with REGISTRY.timer("webcam_capture_seconds"):
+                self._capture()
+
+    def _capture(self):
         if not self._init_camera():
             return
         try:
@@ -119,12 +281,33 @@ class Webcam:
                 except Exception:
                     pass
 
+            # Warmup: grab (no decode) every frame, decode and measure every
+            # WARMUP_SAMPLE_EVERY-th, stop once auto exposure/WB have settled
             start = time.monotonic()
+            tracker = ExposureTracker()
             last_frame = None
+            grabbed = 0
             while time.monotonic() - start < WARMUP_SECONDS:
-                ok, frame = self.cap.read()
-                if ok:
-                    last_frame = frame
+                if not self.cap.grab():
+                    continue
+                grabbed += 1
+                if grabbed % WARMUP_SAMPLE_EVERY:
+                    continue
+                ok, frame = self.cap.retrieve()
+                if not ok:
+                    continue
+                last_frame = frame
+                elapsed = time.monotonic() - start
+                if tracker.update(frame) and elapsed >= WARMUP_MIN_SECONDS:
+                    webcam_logger.info(
+                        f"Exposure converged after {elapsed:.1f}s ({grabbed} frames)."
+                    )
+                    break
+            else:
+                webcam_logger.warning(
+                    f"Exposure did not converge within {WARMUP_SECONDS}s "
+                    f"({grabbed} frames); capturing anyway."
+                )
 
             ok, frame = self.cap.read()
             frame = frame if ok else last_frame
@@ -132,8 +315,20 @@ class Webcam:
                 webcam_logger.error("Failed to capture frame after warmup.")
                 return
 
-            path = self._save_image(frame)
-            self._send_image(path)
+            value = dhash(frame)
+            kind = self._dedup_kind(value)
+            if kind is None:
+                return
+
+            if kind == "thumbnail":
+                image = self._encode_image(frame, WEBCAM_THUMBNAIL_SIZE)
+            else:
+                image = self._encode_image(frame)
+            if image is None:
+                return
+            if self._send_image(image, value, thumbnail=(kind == "thumbnail")):
+                self.hashes.add(value, kind)
+                REGISTRY.inc("webcam_uploads_total", kind=kind)
         except Exception as e:
             webcam_logger.exception(f"Webcam error: {e}")
         finally:
@@ -142,120 +337,89 @@ class Webcam:
                 cv2.destroyAllWindows()
                 webcam_logger.info("Webcam resources released.")
 
-    def _save_image(self, image) -> str:
-        if not os.path.exists(self.tmp_folder):
-            os.makedirs(self.tmp_folder, exist_ok=True)
-        ts = time.strftime("%Y%m%d-%H%M%S")
-        path = os.path.join(self.tmp_folder, f"webcam_capture_{ts}.jpg")
-        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 100])
-        webcam_logger.info(f"Image saved to {path}.")
-        return path
-
-    def _send_image(self, image_path: str):
-        try:
-            with open(image_path, "rb") as img_file:
-                b64 = base64.b64encode(img_file.read()).decode("utf-8")
-            resp = ApiGatewayConnector(
-                base_url=apigateway_url, api_key=apigateway_key
-            ).post_dict(
+    def _dedup_kind(self, value: int) -> Optional[str]:
+        """ "full", "thumbnail" or None (skip) for a capture with dHash value."""
+        last = self.hashes.last_full()
+        if WEBCAM_DEDUP_MODE == "off" or last is None:
+            return "full"
+        distance = hamming(value, int(last["hash"], 16))
+        age = time.time() - last.get("ts", 0)
+        if distance >= WEBCAM_DEDUP_DISTANCE or age > WEBCAM_DEDUP_MAX_AGE:
+            webcam_logger.info(
+                f"Scene changed (distance {distance}); sending full image."
+            )
+            return "full"
+        if WEBCAM_DEDUP_MODE == "skip":
+            webcam_logger.info(
+                f"Scene unchanged (distance {distance}); upload skipped."
+            )
+            REGISTRY.inc("webcam_uploads_total", kind="skipped")
+            return None
+        webcam_logger.info(f"Scene unchanged (distance {distance}); sending thumbnail.")
+        return "thumbnail"
+
+    def _encode_image(
+        self, frame, size: Optional[Tuple[int, int]] = None
+    ) -> Optional[memoryview]:
+        """JPEG-encode a frame in memory (no temp file) at size (default: the
+        configured resolution). Returns a view on the encoder's buffer, or None.
+        """
+        width, height = size or (self.width, self.height)
+        h, w = frame.shape[:2]
+        if (w, h) != (width, height):
+            # thumbnail, or camera ignored the requested resolution
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            webcam_logger.error("Failed to encode image.")
+            return None
+        image = memoryview(buf).cast("B")
+        webcam_logger.info(
+            f"Image encoded: {width}x{height}, quality {self.quality}, "
+            f"{image.nbytes} bytes."
+        )
+        return image
+
+    def _send_image(
+        self, image: memoryview, phash: int, thumbnail: bool = False
+    ) -> bool:
+        connector = get_connector(apigateway_url, apigateway_key)
+        meta = {"deviceId": device_id}
+        if WEBCAM_DEDUP_MODE != "off":
+            meta["phash"] = f"{phash:016x}"
+        if thumbnail:
+            meta["thumbnail"] = "1"
+        if IMAGE_UPLOAD_MODE == "json":
+            data: Dict[str, Any] = {"image": base64.b64encode(image).decode("ascii")}
+            if "phash" in meta:
+                data["phash"] = meta["phash"]
+            if thumbnail:
+                data["thumbnail"] = True
+            resp = connector.post_dict(
                 endpoint="image",
                 payload_parent_keys={"deviceId": device_id},
-                data={"image": b64},
+                data=data,
+                timeout=IMAGE_UPLOAD_TIMEOUT,
             )
-            if resp.status_code == 200:
-                webcam_logger.info("Image successfully sent to API.")
-                try:
-                    os.remove(image_path)
-                except OSError:
-                    pass
-            else:
-                webcam_logger.error(f"Failed to send image: status={resp.status_code}")
-        except FileNotFoundError:
-            webcam_logger.error(f"Image not found: {image_path}")
-
-
-# --------------------
-# File buffer manager
-# --------------------
-class FileBuffer:
-    """Manages a JSON list buffer stored on disk with safe locking.
-    Path is typically /container_storage/temporary_device_data.json
-    """
-
-    def __init__(self, path: str):
-        self.path = path
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-
-    def append(self, entry: Dict) -> None:
-        """Append one entry to the buffer file atomically with lock."""
-        try:
-            with open(self.path, "a+b") as f:
-                fcntl.flock(f, fcntl.LOCK_EX)
-                try:
-                    f.seek(0)
-                    raw = f.read().decode("utf-8") or ""
-                    if raw.strip():
-                        data = json.loads(raw)
-                        if not isinstance(data, list):
-                            data = []
-                    else:
-                        data = []
-                except json.JSONDecodeError:
-                    data = []
-
-                data.append(entry)
-
-                f.seek(0)
-                f.truncate(0)
-                f.write(json.dumps(data, indent=4).encode("utf-8"))
-                f.flush()
-        except Exception as e:
-            log.error(f"FileBuffer.append failed: {e}")
-
-    def upload_and_clear(self) -> bool:
-        """Upload the buffer to API and clear it only on success."""
-        try:
-            if not os.path.exists(self.path):
-                log.info("Buffer file not found; nothing to upload.")
-                return True
-
-            with open(self.path, "r+", encoding="utf-8") as f:
-                fcntl.flock(f, fcntl.LOCK_EX)
-                try:
-                    data = json.load(f)
-                except json.JSONDecodeError:
-                    data = []
-
-                if not data:
-                    log.info("No data to send.")
-                    return True
-
-                resp = ApiGatewayConnector(
-                    base_url=apigateway_url, api_key=apigateway_key
-                ).post_dict(
-                    endpoint="power",
-                    payload_parent_keys={"deviceId": device_id},
-                    data=data,
-                )
-                log.info(f"Upload status: {resp.status_code}")
-                if resp.status_code == 200:
-                    f.seek(0)
-                    json.dump([], f, indent=4)
-                    f.truncate()
-                    log.info("Data successfully sent and cleared from buffer.")
-                    return True
-                else:
-                    log.error(f"Upload failed with status: {resp.status_code}")
-                    return False
-        except Exception as e:
-            log.error(f"FileBuffer.upload_and_clear failed: {e}")
-            return False
+        else:
+            resp = connector.post_binary(
+                endpoint="image",
+                data=image,
+                content_type="image/jpeg",
+                query_params=meta,
+                timeout=IMAGE_UPLOAD_TIMEOUT,
+            )
+        if resp.status_code == 200:
+            webcam_logger.info("Image successfully sent to API.")
+            return True
+        webcam_logger.error(f"Failed to send image: status={resp.status_code}")
+        return False
 
 
 # --------------------
 # Device discovery
 # --------------------
-def _list_serial_ports() -> List[str]:
+def list_serial_ports() -> List[str]:
     """Linux: /dev/ttyUSB* and /dev/ttyACM*. Else: enumerate via pyserial."""
     if platform.system() == "Linux":
         import glob
@@ -270,37 +434,47 @@ def _read_probe_frame(
     """Probe a port for up to PROBE_SECONDS, accumulating any key/value pairs seen.
     Does NOT require seeing 'PID' to return data; this is robust for SmartShunt which
     often emits H1..H18 before the PID appears in a subsequent frame.
+    Returns early at the first frame boundary where the sample is conclusive
+    (see _is_conclusive); PROBE_SECONDS is only the upper bound.
     """
+    ser = None
     try:
         ser = Serial(port, baud, timeout=timeout)
         if not ser.isOpen():
             ser.open()
 
+        parser = VEDirectParser()
         sample: Dict[str, str] = {}
         start = time.time()
 
         while time.time() - start < PROBE_SECONDS:
-            line = ser.readline().decode("latin-1", errors="ignore").strip()
-            if not line:
+            data = ser.read(ser.in_waiting or 1)
+            if not data:
                 continue
 
-            # Generic "KEY <space> VALUE" parsing
-            parts = line.split(maxsplit=1)
-            if len(parts) == 2:
-                k, v = parts[0].strip(), parts[1].strip()
-
-                # Treat checksum as a frame boundary, but keep accumulating
-                if k.lower().startswith("checksum"):
-                    continue
-
-                # Accumulate last-seen value per key
-                sample[k] = v
-
-        ser.close()
+            # Accumulate last-seen value per key over checksum-valid frames,
+            # until the sample identifies the device
+            for frame in parser.feed(data):
+                sample.update(frame)
+            if _is_conclusive(sample):
+                log.info(f"{port}: conclusive probe after {time.time() - start:.1f}s.")
+                break
+
+        if parser.frames_rejected:
+            log.warning(
+                f"{port}: {parser.frames_rejected} frame(s) rejected during probe "
+                f"(checksum={parser.checksum_errors}, framing={parser.framing_errors})."
+            )
         return sample
     except Exception as e:
         log.error(f"Probe failed on {port}: {e}")
         return {}
+    finally:
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception:
+                pass
 
 
 def _is_shunt_signature(sample: Dict[str, str]) -> bool:
@@ -317,54 +491,197 @@ def _is_charger_signature(sample: Dict[str, str]) -> bool:
     return pid == "0xA057" or "HSDS" in sample or "MPPT" in sample or "PPV" in sample
 
 
-def discover_devices() -> List[Tuple[str, Dict[str, str]]]:
+def _is_conclusive(sample: Dict[str, str]) -> bool:
+    """Return True once a probe sample identifies the device well enough to stop:
+    a shunt signature, or a charger with both PID and SER#.
+    """
+    if _is_shunt_signature(sample):
+        return True
+    return _is_charger_signature(sample) and "PID" in sample and "SER#" in sample
+
+
+def discover_devices(
+    ports: Optional[List[str]] = None,
+) -> List[Tuple[str, Dict[str, str]]]:
     """Return list of (port, sample_dict) for devices we deem valid.
 
+    All ports (default: every serial port) are probed in parallel, each for at
+    most PROBE_SECONDS.
+
     Rules:
       - Accept SmartShunt even if SER# is missing (PID/signature is enough).
       - Accept chargers even if SER# is missing (logged warning).
         We need SER# for stable ordering; devices without SER# will be placed last.
     """
     found: List[Tuple[str, Dict[str, str]]] = []
-    ports = _list_serial_ports()
+    ports = list_serial_ports() if ports is None else ports
     log.info(f"Probing ports: {ports}")
+    if not ports:
+        return found
+
+    # Probe all ports concurrently; each probe stops as soon as it is conclusive
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        samples = list(pool.map(_read_probe_frame, ports))
+    log.info(f"Probed {len(ports)} port(s) in {time.time() - start:.1f}s.")
+
+    for p, sample in zip(ports, samples):
+        if _accept_sample(p, sample):
+            found.append((p, sample))
+
+    return found
+
 
-    for p in ports:
-        log.info(f"Probing port {p}...")
-        sample = _read_probe_frame(p)
+def _accept_sample(port: str, sample: Dict[str, str]) -> bool:
+    """Whether a probe sample is a device we read (see discover_devices rules)."""
+    if not sample:
+        log.debug(
+            f"Skipping {port} (no data seen during probe). Keys={list(sample.keys())}"
+        )
+        return False
+
+    if _is_shunt_signature(sample):
+        # Accept shunt without PID or SER#
+        return True
 
-        if not sample:
-            log.debug(
-                f"Skipping {p} (no data seen during probe). Keys={list(sample.keys())}"
+    if _is_charger_signature(sample):
+        if "SER#" not in sample:
+            log.warning(
+                f"{port}: Charger detected but SER# missing in probe window; naming may be unstable."
             )
-            continue
+        return True
 
-        if _is_shunt_signature(sample):
-            # Accept shunt without PID or SER#
-            found.append((p, sample))
-            continue
+    # Not recognized as shunt or charger
+    log.debug(f"Skipping {port} (unknown signature). Keys={list(sample.keys())}")
+    return False
 
-        if _is_charger_signature(sample):
-            if "SER#" not in sample:
-                log.warning(
-                    f"{p}: Charger detected but SER# missing in probe window; naming may be unstable."
-                )
-            found.append((p, sample))
-            continue
 
-        # Not recognized as shunt or charger
-        log.debug(f"Skipping {p} (unknown signature). Keys={list(sample.keys())}")
+# --------------------
+# Device identity cache
+# --------------------
+def stable_port_id(port: str) -> str:
+    """The /dev/serial/by-id link pointing at port (stable across reboots and
+    re-enumeration), or the port itself if there is none.
+    """
+    try:
+        real = os.path.realpath(port)
+        for name in sorted(os.listdir(SERIAL_BY_ID_DIR)):
+            link = os.path.join(SERIAL_BY_ID_DIR, name)
+            if os.path.realpath(link) == real:
+                return link
+    except OSError:
+        pass
+    return port
+
 
-    return found
+def _identity(sample: Dict[str, Any]) -> Dict[str, str]:
+    return {k: str(sample[k]) for k in IDENTITY_KEYS if k in sample}
+
+
+def load_identity_cache(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """{stable_id: {"identity": {...}, "role": str}} or {} if missing/unreadable.
+    path defaults to IDENTITY_CACHE_PATH, looked up at call time.
+    """
+    path = path or IDENTITY_CACHE_PATH
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log.warning(f"Ignoring unreadable identity cache {path}: {e}")
+        return {}
+
+
+def save_identity_cache(
+    devices: Dict[str, Dict[str, Any]],
+    roles: Dict[str, str],
+    path: Optional[str] = None,
+) -> None:
+    """Merge the identities of the given ports ({port: sample}, {port: role})
+    into the cache; entries of absent devices are kept.
+    """
+    path = path or IDENTITY_CACHE_PATH
+    cache = load_identity_cache(path)
+    for port, sample in devices.items():
+        cache[stable_port_id(port)] = {
+            "identity": _identity(sample),
+            "role": roles.get(port),
+        }
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=4)
+        os.replace(tmp, path)
+    except Exception as e:
+        log.warning(f"Could not save identity cache {path}: {e}")
+
+
+def forget_identity(port: str, path: Optional[str] = None) -> None:
+    """Drop a port's cache entry, so it is probed again on the next start."""
+    path = path or IDENTITY_CACHE_PATH
+    cache = load_identity_cache(path)
+    if cache.pop(stable_port_id(port), None) is None:
+        return
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=4)
+        os.replace(tmp, path)
+    except Exception as e:
+        log.warning(f"Could not save identity cache {path}: {e}")
+
+
+def cached_devices(
+    path: Optional[str] = None,
+) -> Tuple[List[Tuple[str, Dict[str, str]]], List[str], List[str]]:
+    """Split the present serial ports into
+    - cached devices [(port, identity)],
+    - ports unknown to the cache (to be probed at startup),
+    - ports cached as "no device seen" (empty identity; probed in the background).
+    """
+    cache = load_identity_cache(path)
+    known: List[Tuple[str, Dict[str, str]]] = []
+    unknown: List[str] = []
+    silent: List[str] = []
+    for port in list_serial_ports():
+        entry = cache.get(stable_port_id(port))
+        if entry is None:
+            unknown.append(port)
+        elif entry.get("identity"):
+            known.append((port, dict(entry["identity"])))
+        else:
+            silent.append(port)
+    return known, unknown, silent
+
+
+def probe_port(port: str) -> Optional[Dict[str, str]]:
+    """Probe a single (e.g. hot-plugged) port; the sample if it is a valid device."""
+    sample = _read_probe_frame(port)
+    return sample if _accept_sample(port, sample) else None
+
+
+def charger_role(index: int) -> str:
+    """0 -> 'charger', 1 -> 'charger_2', 2 -> 'charger_3', ..."""
+    return "charger" if index == 0 else f"charger_{index + 1}"
+
+
+def required_keys_for(role: str) -> Tuple[str, ...]:
+    """Must-have keys for a role; 'charger_N' falls back to the 'charger' set."""
+    if role in REQUIRED_KEYS:
+        return REQUIRED_KEYS[role]
+    return REQUIRED_KEYS.get(role.split("_", 1)[0], ())
 
 
 def classify_roles(devices: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, str]]:
     """
     Input: [(port, sample)]
-    Output: [(role, port)] with role ∈ {'charger', 'charger_2', 'loadlogger'}
+    Output: [(role, port)] with role ∈ {'charger', 'charger_2', 'charger_3', ..., 'loadlogger'}
     Rules:
       - Identify SmartShunt by signature and assign 'loadlogger' (first one).
-      - Remaining MPPTs: sort by SER#; lowest -> 'charger', next -> 'charger_2'.
+      - Remaining MPPTs: sort by SER#; lowest -> 'charger', next -> 'charger_2', then
+        'charger_3' and so on for any number of chargers.
         Devices without SER# are sorted last; tie-breaker is port name.
     """
     chargers: List[Tuple[str, str, str]] = []  # (ser or "", port, port_for_tie)
@@ -385,11 +702,9 @@ def classify_roles(devices: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str,
 
     chargers_sorted = sorted(chargers, key=_sort_key)
 
-    roles: List[Tuple[str, str]] = []
-    if len(chargers_sorted) >= 1:
-        roles.append(("charger", chargers_sorted[0][1]))
-    if len(chargers_sorted) >= 2:
-        roles.append(("charger_2", chargers_sorted[1][1]))
+    roles: List[Tuple[str, str]] = [
+        (charger_role(i), port) for i, (_, port, _) in enumerate(chargers_sorted)
+    ]
     if shunt_port:
         roles.append(("loadlogger", shunt_port))
 
@@ -397,6 +712,181 @@ def classify_roles(devices: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str,
     return roles
 
 
+# --------------------
+# Merged snapshot per role (shared by ReaderThread and SerialReaderEngine)
+# --------------------
+class FrameMerger:
+    """
+    Rolling merged snapshot for one role.
+
+      - Each complete frame is converted to typed values (module/vedirect.py FIELDS)
+        and MERGED into the snapshot, so keys that only appear in some frames
+        (history fields) stay present.
+      - Known keys are stored in fixed-layout lists (value + last update,
+        monotonic); unknown keys in a small side dict. A queue of (time, labels)
+        per merged frame keeps updates in time order, so TTL expiry only looks
+        at frames older than the TTL instead of scanning every key.
+      - The hot path only bumps a version; the merger itself is registered in
+        latest_frames[role] and snapshot() builds an immutable Snapshot on read
+        (cached per version). Wall-clock timestamps are left to the aggregator.
+      - Every frame also feeds the role's WindowStats (self.stats), so the
+        aggregator sees min/max/mean and energy over the whole window.
+      - clock (default time.monotonic) is injectable, so replay.py can run
+        captured data on the capture's own time.
+      - on_ready(role) is called once per role, from the merging thread, as
+        soon as the merged snapshot holds the role's required keys.
+    """
+
+    def __init__(
+        self,
+        role: str,
+        latest_frames: Dict[str, "FrameMerger"],
+        window_stats: Optional[Dict[str, WindowStats]] = None,
+        clock=time.monotonic,
+        on_ready: Optional[Callable[[str], None]] = None,
+    ):
+        self.role: Optional[str] = role
+        self.latest_frames = latest_frames
+        self.window_stats = window_stats
+        self.clock = clock
+        self.on_ready = on_ready
+        self._ready = False  # on_ready sent for the current role
+        self._lock = threading.Lock()  # merge vs. snapshot() and role changes
+
+        # per-window statistics, registered for the aggregator if a map is given
+        self.stats = WindowStats(clock)
+        if window_stats is not None:
+            window_stats[role] = self.stats
+
+        # rolling merged snapshot + per-key update times (monotonic);
+        # _expiry: (time, labels) per merged frame, oldest first
+        self._values: List[Any] = [MISSING] * len(FIELD_NAMES)
+        self._key_ts: List[float] = [0.0] * len(FIELD_NAMES)
+        self._extra: Dict[str, Any] = {}
+        self._extra_ts: Dict[str, float] = {}
+        self._expiry: Deque[Tuple[float, Tuple[str, ...]]] = deque()
+        self._count = 0  # number of keys present
+        self._version = 0
+        self._updated = 0.0  # monotonic time of the last merge
+        self._snapshot: Optional[Snapshot] = None
+        self._published = False
+
+        # cache required keys for this role
+        self._required_idx = [
+            FIELD_INDEX[k] for k in required_keys_for(role) if k in FIELD_INDEX
+        ]
+
+    def merge(self, frame: Dict[str, str]):
+        """Merge observed keys from a complete frame into rolling snapshot."""
+        ts = self.clock()
+        values, key_ts = self._values, self._key_ts
+        sample: Dict[str, Any] = {}
+        with self._lock:
+            for k, raw in frame.items():
+                idx = FIELD_INDEX.get(k)
+                if idx is None:
+                    if k not in self._extra:
+                        self._count += 1
+                    self._extra[k] = raw
+                    self._extra_ts[k] = ts
+                    continue
+                if values[idx] is MISSING:
+                    self._count += 1
+                v = values[idx] = parse_value(k, raw)
+                key_ts[idx] = ts
+                if k in STATS_FIELDS:
+                    sample[k] = v
+
+            # optional: expire stale keys, oldest frames first; a key is only
+            # dropped if no later frame refreshed it
+            if MERGE_KEY_TTL_SECONDS > 0:
+                expiry = self._expiry
+                expiry.append((ts, tuple(frame)))
+                cutoff = ts - MERGE_KEY_TTL_SECONDS
+                while expiry[0][0] < cutoff:
+                    for k in expiry.popleft()[1]:
+                        idx = FIELD_INDEX.get(k)
+                        if idx is None:
+                            if self._extra_ts.get(k, ts) < cutoff:
+                                self._extra_ts.pop(k)
+                                self._extra.pop(k, None)
+                                self._count -= 1
+                        elif key_ts[idx] < cutoff and values[idx] is not MISSING:
+                            values[idx] = MISSING
+                            self._count -= 1
+
+            self._version += 1
+            self._updated = ts
+
+        # every frame counts towards frames/s, also those without STATS_FIELDS
+        self.stats.add(sample, ts)
+
+        # register in latest_frames once there is something to read
+        if not self._published:
+            self.publish()
+
+        if not self._ready and self.has_required():
+            self._ready = True
+            role = self.role
+            if self.on_ready is not None and role is not None:
+                self.on_ready(role)
+
+    def snapshot(self) -> Optional[Snapshot]:
+        """Immutable view of the merged values (None if empty), rebuilt only
+        when a frame was merged since the last call.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            snap = self._snapshot
+            if snap is None or snap.version != self._version:
+                snap = self._snapshot = Snapshot(
+                    tuple(self._values),
+                    dict(self._extra) if self._extra else {},
+                    self._updated,
+                    self._version,
+                )
+            return snap
+
+    def publish(self):
+        """Register this merger (if it holds any keys) as latest_frames[role]."""
+        with self._lock:
+            if self._count and self.role is not None:
+                self.latest_frames[self.role] = self
+                self._published = True
+
+    def detach(self) -> None:
+        """Stop publishing and remove this role's snapshot and statistics."""
+        with self._lock:
+            if self.role is None:
+                return
+            self.latest_frames.pop(self.role, None)
+            if (
+                self.window_stats is not None
+                and self.window_stats.get(self.role) is self.stats
+            ):
+                self.window_stats.pop(self.role, None)
+            self.role = None
+            self._published = False
+
+    def attach(self, role: str) -> None:
+        """Publish under a (new) role, keeping the merged snapshot and statistics."""
+        with self._lock:
+            self.role = role
+            if self.window_stats is not None:
+                self.window_stats[role] = self.stats
+        self._required_idx = [
+            FIELD_INDEX[k] for k in required_keys_for(role) if k in FIELD_INDEX
+        ]
+        self._ready = False  # re-announced under the new role on the next merge
+        self.publish()
+
+    def has_required(self) -> bool:
+        """Check if merged snapshot satisfies role's must-have keys."""
+        values = self._values
+        return all(values[idx] is not MISSING for idx in self._required_idx)
+
+
 # --------------------
 # Continuous VE.Direct reader (merged snapshot)
 # --------------------
@@ -405,20 +895,24 @@ class ReaderThread(threading.Thread):
     Continuous VE.Direct reader for a single serial port.
 
     Strategy:
-      - Start collecting when we see 'PID'
-      - A 'Checksum' line marks end-of-frame
-      - Each complete frame is parsed into a dict and then MERGED into a rolling 'merged' snapshot.
-      - For each key, we also store a per-key timestamp (for optional TTL cleanup).
-      - The public output (latest_frames[role]) is the merged snapshot + a transport timestamp '_ts'.
+      - Raw bytes are fed to a VEDirectParser, which validates each frame's checksum
+        and drops interleaved HEX messages (rejections are counted on self.parser)
+      - Each complete frame is MERGED into the role's FrameMerger, which publishes
+        latest_frames[role].
+      - With capture=True the raw bytes also go to a RawCapture file
+        (module/capture.py) for offline replay.
     """
 
     def __init__(
         self,
         role: str,
         port: str,
-        latest_frames: Dict[str, Dict[str, str]],
+        latest_frames: Dict[str, FrameMerger],
         baud: int = DEFAULT_BAUD,
         timeout: int = DEFAULT_TIMEOUT,
+        window_stats: Optional[Dict[str, WindowStats]] = None,
+        capture: bool = False,
+        on_ready: Optional[Callable[[str], None]] = None,
     ):
         super().__init__(daemon=True)
         self.role = role
@@ -428,113 +922,473 @@ class ReaderThread(threading.Thread):
         self.latest_frames = latest_frames
         self.stop_event = threading.Event()
         self.logger = setup_custom_logger(role)
-
-        # rolling merged snapshot + per-key timestamps
-        self._merged: Dict[str, str] = {}
-        self._merged_key_ts: Dict[str, float] = {}
-
-        # cache required keys for this role
-        self._required_keys = set(REQUIRED_KEYS.get(role, ()))
-
-    def _now_iso(self) -> str:
-        return datetime.now(get_localzone()).isoformat()
-
-    def _now_ts(self) -> float:
-        return time.time()
-
-    def _merge_frame(self, frame: Dict[str, str]):
-        """Merge observed keys from a complete frame into rolling snapshot."""
-        ts = self._now_ts()
-        for k, v in frame.items():
-            self._merged[k] = v
-            self._merged_key_ts[k] = ts
-
-        # optional: expire stale keys
-        if MERGE_KEY_TTL_SECONDS > 0:
-            cutoff = ts - MERGE_KEY_TTL_SECONDS
-            stale = [k for k, t in self._merged_key_ts.items() if t < cutoff]
-            for k in stale:
-                self._merged_key_ts.pop(k, None)
-                self._merged.pop(k, None)
-
-        # publish merged snapshot
-        self.latest_frames[self.role] = {**self._merged, "_ts": self._now_iso()}
-
-    def _frame_has_required(self) -> bool:
-        """Check if merged snapshot satisfies role's must-have keys."""
-        if not self._required_keys:
-            return True
-        snap_keys = set(self._merged.keys())
-        return self._required_keys.issubset(snap_keys)
+        self.parser = VEDirectParser()
+        self.merger = FrameMerger(role, latest_frames, window_stats, on_ready=on_ready)
+        self.capture = (
+            RawCapture(port, role, stable_port_id(port), baud) if capture else None
+        )
 
     def run(self):
         backoff = 0.5
+        capture = self.capture
         while not self.stop_event.is_set():
             try:
                 ser = Serial(self.port, self.baud, timeout=self.timeout)
                 if not ser.isOpen():
                     ser.open()
 
-                collecting = False
-                frame: Dict[str, str] = {}
+                # a new session starts mid-frame; drop any partial state
+                self.parser.reset()
+                if capture is not None:
+                    capture.opened()
 
                 # publish any pre-existing merged snapshot (useful after restart)
-                if self._merged:
-                    self.latest_frames[self.role] = {
-                        **self._merged,
-                        "_ts": self._now_iso(),
-                    }
+                self.merger.publish()
 
                 while not self.stop_event.is_set():
-                    raw = ser.readline()
-                    if not raw:
-                        continue
-                    line = raw.decode("latin-1", errors="ignore").strip()
-                    if not line:
+                    data = ser.read(ser.in_waiting or 1)
+                    if not data:
                         continue
+                    if capture is not None:
+                        capture.write(data)
 
-                    # Godta TAB eller SPACE mellom key og value
-                    if "\t" in line:
-                        parts = line.split("\t", maxsplit=1)
-                    else:
-                        parts = line.split(maxsplit=1)
-
-                    # Start en ny frame enten når vi ser PID
-                    # ELLER når vi ser første gyldige key/value (history-frame uten PID)
-                    if line.startswith("PID") or (
-                        not collecting
-                        and len(parts) == 2
-                        and parts[0]
-                        and parts[0].lower() != "checksum"
-                    ):
-                        collecting = True
-                        frame = {}
-
-                    if not collecting:
-                        continue
-
-                    if len(parts) == 2:
-                        k, v = parts[0].strip(), parts[1].strip()
-
-                        # Slutt på frame: Checksum
-                        if k.lower().startswith("checksum"):
-                            collecting = False
-                            if frame:
-                                self._merge_frame(
-                                    frame
-                                )  # MERGE selv om frame ikke har PID
-                            frame = {}
-                            continue
-
-                        # Vanlig key/value
-                        frame[k] = v
+                    # MERGE every checksum-valid frame, også history-frames uten PID
+                    for frame in self.parser.feed(data):
+                        self.merger.merge(frame)
 
                 ser.close()
                 backoff = 0.5  # reset after a successful session
             except Exception as e:
                 self.logger.error(f"I/O error on {self.port}: {e}")
+                REGISTRY.inc("reader_reconnects_total", role=self.role)
                 time.sleep(backoff)
                 backoff = min(backoff * 2, 30.0)
+        if capture is not None:
+            capture.close()
 
     def stop(self):
         self.stop_event.set()
+
+
+# --------------------
+# Single-thread reader engine (all ports in one selector loop)
+# --------------------
+class _EnginePort:
+    """Per-port state inside SerialReaderEngine."""
+
+    def __init__(
+        self,
+        role: str,
+        port: str,
+        latest_frames: Dict[str, FrameMerger],
+        window_stats: Optional[Dict[str, WindowStats]],
+        capture: Optional[RawCapture] = None,
+        on_ready: Optional[Callable[[str], None]] = None,
+    ):
+        self.role = role
+        self.port = port
+        self.ser: Optional[Serial] = None
+        self.parser = VEDirectParser()
+        self.merger = FrameMerger(role, latest_frames, window_stats, on_ready=on_ready)
+        self.capture = capture
+        self.logger = setup_custom_logger(role)
+        self.backoff = 0.5
+        self.next_open = 0.0  # monotonic time of next (re)open attempt
+
+
+class SerialReaderEngine(threading.Thread):
+    """
+    Alternative to one ReaderThread per port: a single thread multiplexes every
+    serial port with a selector and non-blocking reads.
+
+      - Publishes into the same latest_frames map (via FrameMerger) as ReaderThread.
+      - Ports that fail are closed and reopened with exponential backoff,
+        without affecting the others.
+      - Ports can be added/removed while running (applied on the next loop turn).
+    """
+
+    def __init__(
+        self,
+        roles: List[Tuple[str, str]],
+        latest_frames: Dict[str, FrameMerger],
+        baud: int = DEFAULT_BAUD,
+        window_stats: Optional[Dict[str, WindowStats]] = None,
+        capture: bool = False,
+        on_ready: Optional[Callable[[str], None]] = None,
+    ):
+        super().__init__(daemon=True)
+        self.latest_frames = latest_frames
+        self.window_stats = window_stats
+        self.baud = baud
+        self.capture = capture
+        self.on_ready = on_ready
+        self.stop_event = threading.Event()
+        # changed only on the engine thread; other threads read it via port_parsers()
+        self.ports: Dict[str, _EnginePort] = {}
+        self._ports_lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._pending: List[Tuple[str, Any, Optional[str]]] = []
+        self._pending_lock = threading.Lock()
+        for role, port in roles:
+            self.add_port(role, port)
+
+    def add_port(self, role: str, port: str) -> None:
+        with self._pending_lock:
+            self._pending.append(("add", port, role))
+
+    def remove_port(self, port: str) -> None:
+        with self._pending_lock:
+            self._pending.append(("remove", port, None))
+
+    def rename_ports(self, renames: List[Tuple[str, str]]) -> None:
+        """Give ports new roles as one step: [(port, new_role), ...]."""
+        with self._pending_lock:
+            self._pending.append(("rename", renames, None))
+
+    def _apply_pending(self) -> None:
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for op, port, role in pending:
+            if op == "add" and port not in self.ports:
+                capture = (
+                    RawCapture(port, role, stable_port_id(port), self.baud)
+                    if self.capture
+                    else None
+                )
+                st = _EnginePort(
+                    role,
+                    port,
+                    self.latest_frames,
+                    self.window_stats,
+                    capture,
+                    self.on_ready,
+                )
+                with self._ports_lock:
+                    self.ports[port] = st
+            elif op == "remove" and port in self.ports:
+                with self._ports_lock:
+                    st = self.ports.pop(port)
+                self._close(st)
+                st.merger.detach()
+                if st.capture is not None:
+                    st.capture.close()
+            elif op == "rename":
+                # detach all first, so swapped roles never overwrite each other
+                moved = [(self.ports[p], r) for p, r in port if p in self.ports]
+                for st, _ in moved:
+                    st.merger.detach()
+                for st, new_role in moved:
+                    st.merger.attach(new_role)
+                    with self._ports_lock:
+                        st.role = new_role
+                    st.logger = setup_custom_logger(new_role)
+                    if st.capture is not None:
+                        st.capture.set_role(new_role)
+
+    def _open(self, st: _EnginePort) -> None:
+        try:
+            st.ser = Serial(st.port, self.baud, timeout=0)
+            if not st.ser.isOpen():
+                st.ser.open()
+            st.parser.reset()
+            if st.capture is not None:
+                st.capture.opened()
+            st.merger.publish()
+            self._selector.register(st.ser.fileno(), selectors.EVENT_READ, st)
+            st.backoff = 0.5
+        except Exception as e:
+            st.logger.error(f"I/O error on {st.port}: {e}")
+            REGISTRY.inc("reader_reconnects_total", role=st.role)
+            self._close(st)
+            st.next_open = time.monotonic() + st.backoff
+            st.backoff = min(st.backoff * 2, 30.0)
+
+    def _close(self, st: _EnginePort) -> None:
+        if st.ser is None:
+            return
+        try:
+            self._selector.unregister(st.ser.fileno())
+        except (KeyError, ValueError, OSError):
+            pass
+        try:
+            st.ser.close()
+        except Exception:
+            pass
+        st.ser = None
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                self._apply_pending()
+
+                now = time.monotonic()
+                for st in self.ports.values():
+                    if st.ser is None and now >= st.next_open:
+                        self._open(st)
+
+                if not self._selector.get_map():
+                    self.stop_event.wait(0.5)
+                    continue
+
+                for key, _ in self._selector.select(timeout=1.0):
+                    st: _EnginePort = key.data
+                    try:
+                        data = os.read(key.fd, 4096)
+                        if not data:
+                            raise OSError("device disconnected (EOF)")
+                    except OSError as e:
+                        st.logger.error(f"I/O error on {st.port}: {e}")
+                        REGISTRY.inc("reader_reconnects_total", role=st.role)
+                        self._close(st)
+                        st.next_open = time.monotonic() + st.backoff
+                        st.backoff = min(st.backoff * 2, 30.0)
+                        continue
+
+                    if st.capture is not None:
+                        st.capture.write(data)
+                    for frame in st.parser.feed(data):
+                        st.merger.merge(frame)
+        finally:
+            for st in self.ports.values():
+                self._close(st)
+                if st.capture is not None:
+                    st.capture.close()
+            self._selector.close()
+
+    def port_parsers(self) -> List[Tuple[str, VEDirectParser]]:
+        """(role, parser) of every port, snapshotted under the ports lock, so
+        other threads (metrics) never iterate ports while the engine changes it.
+        """
+        with self._ports_lock:
+            return [(st.role, st.parser) for st in self.ports.values()]
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# --------------------
+# Reader lifecycle (startup + hotplug)
+# --------------------
+class ReaderManager:
+    """
+    Owns the running readers (ReaderThreads, or ports of one SerialReaderEngine)
+    and the set of known devices, so devices can come and go at runtime.
+
+      - add_device(): remember a probed device, re-run classify_roles over all
+        present devices, start a reader for the new port, and rename readers
+        whose role changed in place (their snapshot and stats move along).
+      - remove_port(): stop the port's reader; other roles are left as they are,
+        so a reseated cable comes back under the same role.
+      - Identities and roles are saved to the identity cache after every change
+        (persist=True); verify_identities() checks cached identities against
+        the readers' first frames and re-classifies on mismatch.
+      - capture=True makes every reader record its raw bytes (module/capture.py).
+      - on_ready(role) is passed to every reader's FrameMerger ("required keys
+        present" events, see module/startup.py).
+    """
+
+    def __init__(
+        self,
+        latest_frames: Dict[str, FrameMerger],
+        window_stats: Optional[Dict[str, WindowStats]] = None,
+        engine: str = "threads",
+        persist: bool = True,
+        capture: bool = False,
+        on_ready: Optional[Callable[[str], None]] = None,
+    ):
+        self.latest_frames = latest_frames
+        self.window_stats = window_stats
+        self.engine_mode = engine
+        self.persist = persist
+        self.capture = capture
+        self.on_ready = on_ready
+        self.devices: Dict[str, Dict[str, str]] = {}  # port -> probe sample
+        self.roles: Dict[str, str] = {}  # port -> role
+        self.readers: Dict[str, ReaderThread] = {}
+        self.engine: Optional[SerialReaderEngine] = None
+        self._lock = threading.Lock()
+
+    def start(self, devices: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, str]]:
+        """Start readers for the devices found at startup. Returns [(role, port)]."""
+        with self._lock:
+            if self.engine_mode == "selector":
+                self.engine = SerialReaderEngine(
+                    [],
+                    latest_frames=self.latest_frames,
+                    window_stats=self.window_stats,
+                    capture=self.capture,
+                    on_ready=self.on_ready,
+                )
+                self.engine.start()
+            self.devices.update(devices)
+            self._reconcile()
+            return [(role, port) for port, role in self.roles.items()]
+
+    def add_device(self, port: str, sample: Dict[str, str]) -> None:
+        with self._lock:
+            self.devices[port] = sample
+            self._reconcile()
+
+    def remove_port(self, port: str) -> None:
+        with self._lock:
+            self.devices.pop(port, None)
+            role = self.roles.pop(port, None)
+            if role is None:
+                return
+            if self.engine is not None:
+                self.engine.remove_port(port)
+            else:
+                reader = self.readers.pop(port)
+                reader.stop()
+                reader.merger.detach()
+            log.info(f"Stopped reader for {role} on {port} (device removed).")
+
+    def has_port(self, port: str) -> bool:
+        with self._lock:
+            return port in self.roles
+
+    def _reconcile(self) -> None:
+        wanted = {
+            port: role for role, port in classify_roles(list(self.devices.items()))
+        }
+
+        # 1) rename running readers whose role changed (detach all first, so
+        #    swapped roles never overwrite each other)
+        renamed = [
+            (port, role)
+            for port, role in wanted.items()
+            if port in self.roles and self.roles[port] != role
+        ]
+        for port, role in renamed:
+            log.info(f"Renaming reader on {port}: {self.roles[port]} -> {role}")
+            self.roles[port] = role
+        if renamed and self.engine is not None:
+            self.engine.rename_ports(renamed)
+        elif renamed:
+            for port, _ in renamed:
+                self.readers[port].merger.detach()
+            for port, role in renamed:
+                reader = self.readers[port]
+                reader.merger.attach(role)
+                reader.role = role
+                reader.logger = setup_custom_logger(role)
+                if reader.capture is not None:
+                    reader.capture.set_role(role)
+
+        # 2) start readers for new ports
+        for port, role in wanted.items():
+            if port in self.roles:
+                continue
+            if self.engine is not None:
+                self.engine.add_port(role, port)
+            else:
+                reader = ReaderThread(
+                    role=role,
+                    port=port,
+                    latest_frames=self.latest_frames,
+                    window_stats=self.window_stats,
+                    capture=self.capture,
+                    on_ready=self.on_ready,
+                )
+                reader.start()
+                self.readers[port] = reader
+            self.roles[port] = role
+            log.info(f"Started reader for {role} on {port}")
+
+        if self.persist:
+            save_identity_cache({p: self.devices[p] for p in wanted}, self.roles)
+
+    def probe_in_background(self, ports: List[str]) -> None:
+        """Probe ports without blocking; devices found are added as on hotplug."""
+        for port in ports:
+            threading.Thread(
+                target=self._probe_and_add, args=(port,), daemon=True
+            ).start()
+
+    def _probe_and_add(self, port: str) -> None:
+        sample = probe_port(port)
+        if sample is not None and not self.has_port(port):
+            self.add_device(port, sample)
+
+    def verify_identities(
+        self, ports: List[str], timeout: float = IDENTITY_VERIFY_SECONDS
+    ) -> None:
+        """In the background, compare the cached identity of each port with the
+        PID/SER# its reader actually sees; re-classify ports that differ.
+        """
+        threading.Thread(
+            target=self._verify, args=(list(ports), timeout), daemon=True
+        ).start()
+
+    def _verify(self, ports: List[str], timeout: float) -> None:
+        pending = set(ports)
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            time.sleep(1.0)
+            for port in sorted(pending):
+                with self._lock:
+                    role = self.roles.get(port)
+                    expected = self.devices.get(port)
+                if role is None or expected is None:
+                    pending.discard(port)  # removed meanwhile
+                    continue
+                source = self.latest_frames.get(role)
+                frame = source.snapshot() if source is not None else None
+                observed = frame.to_dict() if frame is not None else {}
+                if not _is_conclusive(observed):
+                    continue
+                pending.discard(port)
+                changed = [
+                    k
+                    for k in ("PID", "SER#")
+                    if k in observed and str(observed[k]) != expected.get(k)
+                ]
+                if not changed:
+                    log.info(f"{port}: cached identity of {role} confirmed.")
+                    continue
+                log.warning(
+                    f"{port}: identity differs from cache ({changed}); re-classifying."
+                )
+                self.add_device(port, _identity(observed))
+
+        for port in sorted(pending):
+            log.warning(
+                f"{port}: no identifying frames within {timeout:.0f}s; "
+                "cache entry dropped, port is probed on next start."
+            )
+            forget_identity(port)
+
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        """Metrics collector: parser counters and snapshot age per role."""
+        with self._lock:
+            if self.engine is not None:
+                ports = self.engine.port_parsers()
+            else:
+                ports = [(r.role, r.parser) for r in self.readers.values()]
+        for name in (
+            "parser_frames_ok",
+            "parser_checksum_errors",
+            "parser_framing_errors",
+            "parser_hex_messages",
+            "snapshot_age_seconds",
+        ):
+            registry.remove_gauges(name)
+        now = time.monotonic()
+        for role, parser in ports:
+            registry.set("parser_frames_ok", parser.frames_ok, role=role)
+            registry.set("parser_checksum_errors", parser.checksum_errors, role=role)
+            registry.set("parser_framing_errors", parser.framing_errors, role=role)
+            registry.set("parser_hex_messages", parser.hex_messages, role=role)
+            source = self.latest_frames.get(role)
+            frame = source.snapshot() if source is not None else None
+            if frame is not None:
+                registry.set(
+                    "snapshot_age_seconds", round(frame.age(now), 1), role=role
+                )
+
+    def stop(self) -> None:
+        with self._lock:
+            for reader in self.readers.values():
+                reader.stop()
+            if self.engine is not None:
+                self.engine.stop()
@@ -0,0 +1,219 @@
+# encoding.py
+# ------------------------------------------------------------
+# Compact payload format for 'power' uploads ("columnar-delta/1")
+# - A batch of buffered entries is turned into columns: one timestamp
+#   column (steps between entries) and, per role, one column per key.
+#   A top-level key is a role if it holds a dict in every entry that has it;
+#   any other key is one plain column of whole values.
+# - Columns are delta encoded: only changes are sent, as [row, value] pairs
+#   ([row] alone means "key absent from this row on").
+# - Keys that never change within the batch (PID, SER#, FW, ...) are sent
+#   once under "static".
+# - decode_power_batch is the reference decoder: it expands a payload back
+#   into the exact list of entries that was encoded (after a JSON round trip).
+#
+# Layout:
+#   {
+#     "format": "columnar-delta/1",
+#     "count": 3,
+#     "t0": "2025-06-01T12:00:00.123456+02:00",
+#     "dt_us": [0, 30000000, 30000000],          # steps from previous entry
+#     "tz": [[0, 7200]],                         # UTC offset changes (seconds)
+#     "columns": {...},                          # other top-level keys
+#     "roles": {
+#       "charger": {
+#         "rows": [0, 2],                        # omitted if present in all rows
+#         "static": {"PID": "0xA057", "SER#": "HQ2211ABCDE"},
+#         "changes": {"V": [[0, 13250], [1, 13260]], "ERR": [[0, 0]]}
+#       }
+#     }
+#   }
+# ------------------------------------------------------------
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+FORMAT_ENTRIES = "entries"  # legacy: plain list of entry dicts
+FORMAT_COLUMNAR = "columnar-delta/1"
+
+TIMESTAMP_KEY = "timestamp"
+
+_ABSENT = object()
+
+
+# --------------------
+# Column helpers
+# --------------------
+def _encode_column(values: List[Any]) -> List[List[Any]]:
+    """Delta-encode one column: [[row, value], ...] on change, [row] when absent."""
+    changes: List[List[Any]] = []
+    prev: Any = _ABSENT
+    for i, v in enumerate(values):
+        if i == 0 and v is _ABSENT:
+            continue
+        if v is _ABSENT:
+            if prev is not _ABSENT:
+                changes.append([i])
+        elif prev is _ABSENT or v != prev or type(v) is not type(prev):
+            changes.append([i, v])
+        prev = v
+    return changes
+
+
+def _decode_column(changes: List[List[Any]], n: int) -> List[Any]:
+    values: List[Any] = [_ABSENT] * n
+    current: Any = _ABSENT
+    it = iter(changes)
+    nxt = next(it, None)
+    for i in range(n):
+        while nxt is not None and nxt[0] == i:
+            current = nxt[1] if len(nxt) > 1 else _ABSENT
+            nxt = next(it, None)
+        values[i] = current
+    return values
+
+
+def _encode_group(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    keys: List[str] = []
+    seen = set()
+    for row in rows:
+        for k in row:
+            if k not in seen:
+                seen.add(k)
+                keys.append(k)
+
+    static: Dict[str, Any] = {}
+    changes: Dict[str, List[List[Any]]] = {}
+    for k in keys:
+        col = _encode_column([row.get(k, _ABSENT) for row in rows])
+        if len(col) == 1 and col[0][0] == 0 and len(col[0]) == 2:
+            static[k] = col[0][1]
+        else:
+            changes[k] = col
+    out: Dict[str, Any] = {}
+    if static:
+        out["static"] = static
+    if changes:
+        out["changes"] = changes
+    return out
+
+
+def _decode_group(group: Dict[str, Any], n: int) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = [{} for _ in range(n)]
+    static = group.get("static", {})
+    changes = group.get("changes", {})
+    for k, v in static.items():
+        for row in rows:
+            row[k] = v
+    for k, col in changes.items():
+        for row, v in zip(rows, _decode_column(col, n)):
+            if v is not _ABSENT:
+                row[k] = v
+    return rows
+
+
+# --------------------
+# Timestamps
+# --------------------
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # must round-trip exactly, otherwise fall back to the raw column
+    if dt.tzinfo is None or dt.isoformat() != value:
+        return None
+    return dt
+
+
+def _encode_timestamps(values: List[Any]) -> Dict[str, Any]:
+    parsed = [_parse_ts(v) for v in values]
+    if not parsed or any(p is None for p in parsed):
+        return {"columns_ts": _encode_column(values)}
+    us = timedelta(microseconds=1)
+    dt_us = [0] + [(b - a) // us for a, b in zip(parsed, parsed[1:])]
+    offsets = [int(p.utcoffset().total_seconds()) for p in parsed]
+    return {"t0": values[0], "dt_us": dt_us, "tz": _encode_column(offsets)}
+
+
+def _decode_timestamps(payload: Dict[str, Any], n: int) -> List[Any]:
+    if "columns_ts" in payload:
+        return _decode_column(payload["columns_ts"], n)
+    t = datetime.fromisoformat(payload["t0"])
+    offsets = _decode_column(payload.get("tz", []), n)
+    out = []
+    for dt_us, off in zip(payload["dt_us"], offsets):
+        t = t + timedelta(microseconds=dt_us)
+        if off is not _ABSENT:
+            t = t.astimezone(timezone(timedelta(seconds=off)))
+        out.append(t.isoformat())
+    return out
+
+
+# --------------------
+# Public API
+# --------------------
+def encode_power_batch(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Encode buffered entries ({"timestamp": iso, role: {...}, ...}) as columnar-delta/1."""
+    n = len(entries)
+    payload: Dict[str, Any] = {"format": FORMAT_COLUMNAR, "count": n}
+    if n == 0:
+        return payload
+
+    payload.update(_encode_timestamps([e.get(TIMESTAMP_KEY, _ABSENT) for e in entries]))
+
+    # a key is a role only if it holds a dict in every entry that has it; a key
+    # mixing dicts and scalars is sent as a plain column (whole values)
+    names: Dict[str, bool] = {}
+    for e in entries:
+        for k, v in e.items():
+            if k != TIMESTAMP_KEY:
+                names[k] = names.get(k, True) and isinstance(v, dict)
+    role_names = [k for k, is_role in names.items() if is_role]
+    scalar_names = [k for k, is_role in names.items() if not is_role]
+
+    roles: Dict[str, Any] = {}
+    for role in role_names:
+        idx = [i for i, e in enumerate(entries) if isinstance(e.get(role), dict)]
+        group = _encode_group([entries[i][role] for i in idx])
+        if len(idx) != n:
+            group["rows"] = idx
+        roles[role] = group
+    if roles:
+        payload["roles"] = roles
+
+    if scalar_names:
+        payload["columns"] = {
+            k: _encode_column([e.get(k, _ABSENT) for e in entries])
+            for k in scalar_names
+        }
+    return payload
+
+
+def decode_power_batch(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Reference decoder: expand a columnar-delta/1 payload back into entries."""
+    fmt = payload.get("format")
+    if fmt != FORMAT_COLUMNAR:
+        raise ValueError(f"Unsupported power payload format: {fmt!r}")
+
+    n = int(payload.get("count", 0))
+    if n == 0:
+        return []
+
+    entries: List[Dict[str, Any]] = [{} for _ in range(n)]
+    for e, ts in zip(entries, _decode_timestamps(payload, n)):
+        if ts is not _ABSENT:
+            e[TIMESTAMP_KEY] = ts
+
+    for role, group in payload.get("roles", {}).items():
+        idx = group.get("rows", list(range(n)))
+        for i, row in zip(idx, _decode_group(group, len(idx))):
+            entries[i][role] = row
+
+    for k, col in payload.get("columns", {}).items():
+        for e, v in zip(entries, _decode_column(col, n)):
+            if v is not _ABSENT:
+                e[k] = v
+    return entries
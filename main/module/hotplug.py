@@ -0,0 +1,145 @@
+# hotplug.py
+# ------------------------------------------------------------
+# Hotplug of VE.Direct USB adapters without a container restart
+# - Polls the serial port list (device.list_serial_ports, i.e. /dev) every
+#   HOTPLUG_POLL_SECONDS. This always runs: in the container a netlink monitor
+#   can start fine and still never see an event (own network namespace, no
+#   udevd), so udev is only used to notice changes sooner.
+# - Listens for udev "tty" add/remove events (pyudev netlink monitor) where
+#   available; a change found by polling that udev did not report is logged.
+# - On add: waits HOTPLUG_SETTLE_SECONDS, probes only the new port
+#   (device.probe_port) and hands a valid device to ReaderManager, which
+#   starts its reader and re-runs role classification.
+# - On remove: stops the reader of that port.
+# - New device nodes only show up inside the container if the host's /dev
+#   is bind-mounted (docker-compose.yml).
+# ------------------------------------------------------------
+
+import os
+import threading
+import time
+from typing import Optional, Set
+
+import pyudev
+
+from module.device import ReaderManager, list_serial_ports, probe_port
+from module.utils.logger import setup_custom_logger
+
+# --------------------
+# Constants (fixed)
+# --------------------
+HOTPLUG_SETTLE_SECONDS = 1.0  # let the adapter/driver settle before probing
+HOTPLUG_POLL_SECONDS = 5.0  # port list polling interval (safety net for udev)
+TTY_PREFIXES = ("/dev/ttyUSB", "/dev/ttyACM")
+
+log = setup_custom_logger("module.hotplug")
+
+
+class HotplugMonitor(threading.Thread):
+    """Keeps ReaderManager in sync with plugged/unplugged serial adapters."""
+
+    def __init__(self, manager: ReaderManager):
+        super().__init__(daemon=True)
+        self.manager = manager
+        self.stop_event = threading.Event()
+        self._probing: Set[str] = set()
+        self._probing_lock = threading.Lock()
+        self._known: Set[str] = set()  # port list as of the last poll/udev event
+
+    def run(self):
+        monitor = self._udev_monitor()
+        self._known = set(list_serial_ports())
+        next_poll = time.monotonic() + HOTPLUG_POLL_SECONDS
+        while not self.stop_event.is_set():
+            timeout = max(next_poll - time.monotonic(), 0.0)
+            if monitor is not None:
+                self._udev_event(monitor.poll(timeout=min(timeout, 1.0)))
+            else:
+                self.stop_event.wait(timeout)
+            if time.monotonic() >= next_poll:
+                self._poll(udev=monitor is not None)
+                next_poll = time.monotonic() + HOTPLUG_POLL_SECONDS
+
+    def _udev_monitor(self) -> Optional["pyudev.Monitor"]:
+        try:
+            context = pyudev.Context()
+            monitor = pyudev.Monitor.from_netlink(context)
+            monitor.filter_by(subsystem="tty")
+            monitor.start()
+        except Exception as e:
+            log.warning(
+                f"udev monitor unavailable ({e}); polling serial ports every "
+                f"{HOTPLUG_POLL_SECONDS}s."
+            )
+            return None
+        log.info(
+            "Hotplug monitor listening for udev tty events, polling serial ports "
+            f"every {HOTPLUG_POLL_SECONDS}s as well."
+        )
+        return monitor
+
+    def _udev_event(self, device) -> None:
+        if device is None:
+            return
+        node = device.device_node
+        if not node or not node.startswith(TTY_PREFIXES):
+            return
+        if device.action == "add":
+            self._known.add(node)
+            self._on_add(node)
+        elif device.action == "remove":
+            self._known.discard(node)
+            self._on_remove(node)
+
+    def _poll(self, udev: bool) -> None:
+        """Handle ports that appeared or disappeared since the last poll/udev event."""
+        current = set(list_serial_ports())
+        added = sorted(current - self._known)
+        removed = sorted(self._known - current)
+        self._known = current
+        if udev and (added or removed):
+            log.warning(
+                f"Polling found port changes udev did not report "
+                f"(added {added}, removed {removed})."
+            )
+        for node in added:
+            self._on_add(node)
+        for node in removed:
+            self._on_remove(node)
+
+    def _on_add(self, node: str) -> None:
+        if self.manager.has_port(node):
+            return
+        with self._probing_lock:
+            if node in self._probing:
+                return
+            self._probing.add(node)
+        log.info(f"Serial device added: {node}; probing.")
+        threading.Thread(target=self._probe, args=(node,), daemon=True).start()
+
+    def _probe(self, node: str) -> None:
+        try:
+            if self.stop_event.wait(HOTPLUG_SETTLE_SECONDS):
+                return
+            if not os.path.exists(node):
+                log.warning(
+                    f"{node} is not in /dev (host /dev not mounted?); ignoring."
+                )
+                return
+            sample = probe_port(node)
+            if sample is None:
+                log.info(f"{node}: no VE.Direct device recognised; ignoring.")
+                return
+            self.manager.add_device(node, sample)
+        except Exception as e:
+            log.error(f"Hotplug probe of {node} failed: {e}")
+        finally:
+            with self._probing_lock:
+                self._probing.discard(node)
+
+    def _on_remove(self, node: str) -> None:
+        log.info(f"Serial device removed: {node}.")
+        self.manager.remove_port(node)
+
+    def stop(self):
+        self.stop_event.set()
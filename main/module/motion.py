@@ -0,0 +1,324 @@
+# motion.py
+# ------------------------------------------------------------
+# Headless motion/activity detection on the webcam
+# - Same running-average background subtraction as webcam_calibrate.py
+#   (accumulateWeighted -> absdiff -> grayscale -> threshold), shared through
+#   MotionPipeline so the calibrated threshold means the same in both.
+# - Runs at low resolution: frames are captured at MOTION_CAPTURE_SIZE,
+#   only every MOTION_FRAME_SKIP-th frame is decoded, and it is downscaled to
+#   MOTION_PROCESS_SIZE before any processing.
+# - Motion is measured per region of interest (ROI, normalised x/y/w/h) as the
+#   fraction of changed pixels.
+# - CPU use of the detector thread (time.thread_time) is kept below
+#   MOTION_CPU_BUDGET of one core by stretching the sleep between frames.
+# - Activity counts are rolled into every aggregated entry ("motion"), and a
+#   motion event can trigger an event capture (rate-limited).
+# - The camera is shared with Webcam: when a capture wants the camera
+#   (camera_wanted), the detector releases it and resumes afterwards.
+# ------------------------------------------------------------
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from tzlocal import get_localzone
+
+from module.device import WEBCAM_PORT, camera_lock, camera_wanted
+from module.utils.logger import setup_custom_logger
+
+# --------------------
+# Constants (fixed)
+# --------------------
+MOTION_CAPTURE_SIZE = (640, 360)  # requested camera resolution (w, h)
+MOTION_PROCESS_SIZE = (160, 90)  # resolution the pipeline works on (w, h)
+MOTION_FPS = 2.0  # processed frames per second (upper bound)
+MOTION_FRAME_SKIP = 3  # frames grabbed per processed frame (others not decoded)
+MOTION_ALPHA = 0.01  # background running-average weight (as webcam_calibrate.py)
+MOTION_THRESHOLD = 25  # default pixel threshold, overridden by calibration
+MOTION_MIN_FRACTION = 0.01  # changed-pixel fraction of an ROI that counts as motion
+MOTION_CONFIRM_FRAMES = 2  # consecutive motion frames before an event is counted
+MOTION_CPU_BUDGET = 0.15  # fraction of one core for the detector thread
+
+# Regions of interest as normalised (x, y, w, h); default is the whole frame
+MOTION_ROIS: List[Tuple[float, float, float, float]] = [(0.0, 0.0, 1.0, 1.0)]
+
+# Event captures (full Webcam.trigger) on motion, at most one per cooldown;
+# opt-in, each one is an extra image upload
+MOTION_EVENT_CAPTURE = False
+MOTION_EVENT_COOLDOWN_SECONDS = 1800
+
+# Written by webcam_calibrate.py (press 's'), read at startup
+MOTION_CALIBRATION_PATH = "/container_storage/motion_calibration.json"
+
+# Backoff when the camera cannot be opened (seconds)
+MOTION_RETRY_MIN = 5
+MOTION_RETRY_MAX = 300
+
+log = setup_custom_logger("module.motion")
+
+
+# --------------------
+# Calibration
+# --------------------
+def load_calibrated_threshold(path: str = MOTION_CALIBRATION_PATH) -> int:
+    """Threshold saved by webcam_calibrate.py, or MOTION_THRESHOLD if none."""
+    try:
+        with open(path, "r") as f:
+            threshold = int(json.load(f)["threshold"])
+        log.info(f"Using calibrated motion threshold {threshold} from {path}.")
+        return threshold
+    except FileNotFoundError:
+        return MOTION_THRESHOLD
+    except Exception as e:
+        log.warning(f"Ignoring motion calibration {path}: {e}")
+        return MOTION_THRESHOLD
+
+
+def save_calibrated_threshold(
+    threshold: int, path: str = MOTION_CALIBRATION_PATH
+) -> None:
+    data = {
+        "threshold": int(threshold),
+        "process_size": list(MOTION_PROCESS_SIZE),
+        "alpha": MOTION_ALPHA,
+        "calibrated_at": datetime.now(get_localzone()).isoformat(),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp, path)
+
+
+# --------------------
+# Pipeline
+# --------------------
+class MotionPipeline:
+    """
+    Background subtraction on downscaled frames. process() returns the
+    changed-pixel fraction per ROI; the intermediate images are kept on the
+    instance (background, mask) for the calibration tool to display.
+    """
+
+    def __init__(
+        self,
+        threshold: int = MOTION_THRESHOLD,
+        alpha: float = MOTION_ALPHA,
+        size: Tuple[int, int] = MOTION_PROCESS_SIZE,
+        rois: Optional[List[Tuple[float, float, float, float]]] = None,
+    ):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.size = size
+        self.rois = rois or MOTION_ROIS
+        self._slices = [self._roi_slice(r) for r in self.rois]
+        self._average: Optional[np.ndarray] = None
+        self.background: Optional[np.ndarray] = None
+        self.mask: Optional[np.ndarray] = None
+
+    def _roi_slice(self, roi: Tuple[float, float, float, float]) -> Tuple[slice, slice]:
+        w, h = self.size
+        x, y, rw, rh = roi
+        x0, y0 = int(x * w), int(y * h)
+        x1, y1 = max(x0 + 1, int((x + rw) * w)), max(y0 + 1, int((y + rh) * h))
+        return slice(y0, min(y1, h)), slice(x0, min(x1, w))
+
+    def reset(self) -> None:
+        """Forget the background model (e.g. after the camera was reopened)."""
+        self._average = None
+
+    def process(self, frame: np.ndarray) -> List[float]:
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if self._average is None:
+            self._average = np.float32(small)
+        cv2.accumulateWeighted(small, self._average, self.alpha)
+        self.background = cv2.convertScaleAbs(self._average)
+        gray_diff = cv2.cvtColor(
+            cv2.absdiff(small, self.background), cv2.COLOR_BGR2GRAY
+        )
+        _, self.mask = cv2.threshold(gray_diff, self.threshold, 255, cv2.THRESH_BINARY)
+        return [
+            cv2.countNonZero(self.mask[ys, xs]) / float(self.mask[ys, xs].size)
+            for ys, xs in self._slices
+        ]
+
+
+# --------------------
+# Detector thread
+# --------------------
+class MotionDetector(threading.Thread):
+    """
+    Runs MotionPipeline on the webcam beside the serial readers.
+    roll() returns the activity counts since the previous call (aggregator tick).
+    """
+
+    def __init__(
+        self,
+        port: int = WEBCAM_PORT,
+        rois: Optional[List[Tuple[float, float, float, float]]] = None,
+        threshold: Optional[int] = None,
+        on_event: Optional[Callable[[], None]] = None,
+    ):
+        super().__init__(daemon=True)
+        self.port = port
+        self.pipeline = MotionPipeline(
+            threshold=load_calibrated_threshold() if threshold is None else threshold,
+            rois=rois,
+        )
+        self.on_event = on_event
+        self.stop_event = threading.Event()
+        self.cap = None
+
+        self._lock = threading.Lock()
+        self._streak = 0
+        self._last_event_callback: Optional[float] = None
+        self._cpu = 0.0
+        self._start = time.monotonic()
+        self._reset_counts()
+
+    def _reset_counts(self) -> None:
+        self._frames = 0
+        self._motion_frames = 0
+        self._events = 0
+        self._roi_frames = [0] * len(self.pipeline.rois)
+        self._cpu = 0.0
+
+    def roll(self) -> Dict[str, Any]:
+        """Activity since the previous roll: counts are summed when entries are rolled up."""
+        now = time.monotonic()
+        with self._lock:
+            wall = max(now - self._start, 1e-6)
+            counts = {
+                "frames": self._frames,
+                "motion_frames": self._motion_frames,
+                "events": self._events,
+            }
+            for i, n in enumerate(self._roi_frames):
+                counts[f"roi_{i}"] = n
+            out = {"counts": counts, "cpu": round(self._cpu / wall, 3)}
+            self._reset_counts()
+            self._start = now
+        return out
+
+    # --------------------
+    # Camera handling
+    # --------------------
+    def _open(self) -> bool:
+        self.cap = cv2.VideoCapture(self.port)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, MOTION_CAPTURE_SIZE[0])
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, MOTION_CAPTURE_SIZE[1])
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not self.cap.isOpened():
+            self._close()
+            return False
+        self.pipeline.reset()
+        return True
+
+    def _close(self) -> None:
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _yield_camera(self) -> None:
+        """Hand the camera to a waiting Webcam capture and wait until it is done."""
+        self._close()
+        camera_lock.release()
+        log.info("Motion detector paused for webcam capture.")
+        while camera_wanted.is_set() and not self.stop_event.is_set():
+            time.sleep(0.5)
+        camera_lock.acquire()
+        log.info("Motion detector resumed.")
+
+    # --------------------
+    # Main loop
+    # --------------------
+    def run(self):
+        backoff = MOTION_RETRY_MIN
+        camera_lock.acquire()
+        try:
+            while not self.stop_event.is_set():
+                if camera_wanted.is_set():
+                    self._yield_camera()
+                    continue
+
+                if self.cap is None and not self._open():
+                    log.warning(
+                        f"Motion detector: camera not available; retry in {backoff}s."
+                    )
+                    camera_lock.release()
+                    self.stop_event.wait(backoff)
+                    camera_lock.acquire()
+                    backoff = min(backoff * 2, MOTION_RETRY_MAX)
+                    continue
+                backoff = MOTION_RETRY_MIN
+
+                t_wall = time.monotonic()
+                t_cpu = time.thread_time()
+                if not self._step():
+                    log.warning("Motion detector: frame grab failed; reopening camera.")
+                    self._close()
+                    continue
+                cpu = time.thread_time() - t_cpu
+
+                # Sleep long enough for both the frame rate and the CPU budget
+                busy = time.monotonic() - t_wall
+                pause = max(1.0 / MOTION_FPS, cpu / MOTION_CPU_BUDGET) - busy
+                with self._lock:
+                    self._cpu += cpu
+                if pause > 0:
+                    self.stop_event.wait(pause)
+        except Exception as e:
+            log.exception(f"Motion detector stopped: {e}")
+        finally:
+            self._close()
+            camera_lock.release()
+
+    def _step(self) -> bool:
+        """Grab MOTION_FRAME_SKIP frames, decode and process the last one."""
+        for _ in range(MOTION_FRAME_SKIP):
+            if not self.cap.grab():
+                return False
+        ok, frame = self.cap.retrieve()
+        if not ok:
+            return False
+
+        fractions = self.pipeline.process(frame)
+        hits = [f >= MOTION_MIN_FRACTION for f in fractions]
+        moving = any(hits)
+        self._streak = self._streak + 1 if moving else 0
+
+        with self._lock:
+            self._frames += 1
+            if moving:
+                self._motion_frames += 1
+                for i, hit in enumerate(hits):
+                    if hit:
+                        self._roi_frames[i] += 1
+            event = self._streak == MOTION_CONFIRM_FRAMES
+            if event:
+                self._events += 1
+
+        if event:
+            log.info(
+                f"Motion event (ROI fractions {[round(f, 3) for f in fractions]})."
+            )
+            self._fire_event()
+        return True
+
+    def _fire_event(self) -> None:
+        now = time.monotonic()
+        if self.on_event is None or (
+            self._last_event_callback is not None
+            and now - self._last_event_callback < MOTION_EVENT_COOLDOWN_SECONDS
+        ):
+            return
+        self._last_event_callback = now
+        # own thread: the capture needs the camera this thread is holding
+        threading.Thread(target=self.on_event, daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
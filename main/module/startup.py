@@ -0,0 +1,143 @@
+# startup.py
+# ------------------------------------------------------------
+# Readiness-driven startup: decides when main.py may start aggregating,
+# instead of a fixed sleep (STARTUP_DELAY) plus a fixed warmup
+# (AGGREGATOR_WARMUP_SECONDS), which are now only upper bounds.
+# - Clock: ready once the kernel reports the clock as NTP-synchronized
+#   (adjtimex, read only). Where that cannot be read, a wall clock past
+#   SANE_WALL_CLOCK counts as ready. After clock_timeout it is taken as is.
+# - Roles: every reader's FrameMerger reports when its role's required keys
+#   are present (role_ready, from the reader threads). Once main.py has told
+#   which roles were discovered (expect), the gate opens as soon as all of
+#   them are ready, or after clock_timeout + roles_timeout with whatever is
+#   ready then (late roles are included once ready, as before).
+# - main.py waits on the gate in its loop (wait) and aggregates the moment
+#   check() first returns True.
+# ------------------------------------------------------------
+
+import ctypes
+import ctypes.util
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional, Set
+
+from module.utils.logger import setup_custom_logger
+from module.utils.metrics import REGISTRY
+
+# --------------------
+# Constants (fixed)
+# --------------------
+# Earliest believable wall clock when the sync state is unknown (the Pi has no
+# RTC and boots at the last saved time, or 1970)
+SANE_WALL_CLOCK = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+TIME_ERROR = 5  # adjtimex() clock state: not synchronized (STA_UNSYNC set)
+
+log = setup_custom_logger("module.startup")
+
+
+def clock_synchronized() -> Optional[bool]:
+    """Kernel NTP sync state from adjtimex(2) (modes=0 only reads, no
+    privileges needed). None if it cannot be read.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        state = libc.adjtimex(ctypes.create_string_buffer(512))  # zeroed struct timex
+    except (OSError, AttributeError):
+        return None
+    if state < 0:
+        return None
+    return state != TIME_ERROR
+
+
+def clock_ready() -> bool:
+    synced = clock_synchronized()
+    if synced is None:
+        return time.time() >= SANE_WALL_CLOCK
+    return synced
+
+
+class StartupGate:
+    """
+    Opens once the clock and every discovered role are ready (or the upper
+    bounds have passed). role_ready() may be called from any thread;
+    expect(), check() and wait() belong to the main loop.
+    """
+
+    def __init__(
+        self,
+        clock_timeout: float,
+        roles_timeout: float,
+        clock_check: Callable[[], bool] = clock_ready,
+    ):
+        self.clock_timeout = clock_timeout
+        self.roles_timeout = roles_timeout
+        self.clock_check = clock_check
+        self.opened = False
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._clock_ok = False
+        self._expected: Optional[Set[str]] = None  # None until discovery is done
+        self._ready_roles: Set[str] = set()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def role_ready(self, role: str) -> None:
+        """FrameMerger on_ready callback: role's required keys are present."""
+        with self._lock:
+            if role in self._ready_roles:
+                return
+            self._ready_roles.add(role)
+        elapsed = self.elapsed()
+        REGISTRY.set("role_ready_seconds", round(elapsed, 1), role=role)
+        log.info(f"Role '{role}' ready (required keys present) after {elapsed:.1f}s.")
+        self._changed.set()
+
+    def expect(self, roles: Iterable[str]) -> None:
+        """The roles discovered at startup; the gate waits for these."""
+        with self._lock:
+            self._expected = set(roles)
+        self._changed.set()
+
+    def wait(self, timeout: float) -> None:
+        """Sleep up to timeout, waking early when a role or the role list changes."""
+        self._changed.wait(timeout)
+        self._changed.clear()
+
+    def check(self) -> bool:
+        """True once aggregation may start (and from then on)."""
+        if self.opened:
+            return True
+        elapsed = self.elapsed()
+
+        if not self._clock_ok:
+            now = datetime.now().astimezone().isoformat(timespec="seconds")
+            if self.clock_check():
+                log.info(f"Wall clock ready after {elapsed:.1f}s ({now}).")
+            elif elapsed >= self.clock_timeout:
+                log.warning(
+                    f"Wall clock not confirmed synchronized after {self.clock_timeout}s; "
+                    f"continuing with {now}."
+                )
+            else:
+                return False
+            self._clock_ok = True
+
+        with self._lock:
+            if self._expected is None:
+                return False
+            waiting = sorted(self._expected - self._ready_roles)
+        if waiting:
+            if elapsed < self.clock_timeout + self.roles_timeout:
+                return False
+            log.warning(
+                f"Starting aggregation after {elapsed:.1f}s; roles {waiting} are not ready "
+                f"yet and will be included once they are."
+            )
+        else:
+            log.info(f"Startup ready after {elapsed:.1f}s; starting aggregation.")
+        self.opened = True
+        REGISTRY.set("startup_ready_seconds", round(elapsed, 1))
+        return True
@@ -0,0 +1,238 @@
+# metrics.py
+# ------------------------------------------------------------
+# In-process metrics registry for the device pipeline
+# - Counters (monotonic totals), gauges (last value) and latency/size
+#   summaries (count/sum/min/max/last), each optionally labelled, e.g.
+#   inc("reader_reconnects_total", role="charger").
+# - Collectors are callbacks run at export time that set gauges from live
+#   objects (parser counters, snapshot age, buffer size), so the hot paths
+#   pay nothing for them.
+# - Exported as JSON (snapshot()), over a small HTTP endpoint
+#   (GET /metrics: Prometheus text, GET /metrics.json: JSON) and/or written
+#   periodically to a file.
+# ------------------------------------------------------------
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from tzlocal import get_localzone
+
+from module.utils.logger import setup_custom_logger
+
+# --------------------
+# Constants (fixed)
+# --------------------
+# all interfaces of the container by default; the host address it is published
+# on (loopback unless METRICS_PUBLISH_ADDRESS is set) is in docker-compose.yml.
+# METRICS_HOST is only needed when running outside the container.
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = 9108
+METRICS_FILE_PATH = "/container_storage/metrics.json"
+METRICS_FILE_SECONDS = 60
+
+log = setup_custom_logger("module.metrics")
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _label_str(key: Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class _Summary:
+    __slots__ = ("count", "sum", "min", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, value: float) -> None:
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if self.count == 0 or value > self.max:
+            self.max = value
+        self.count += 1
+        self.sum += value
+        self.last = value
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6),
+            "max": round(self.max, 6),
+            "last": round(self.last, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters, gauges and summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Key, float] = {}
+        self._gauges: Dict[Key, float] = {}
+        self._summaries: Dict[Key, _Summary] = {}
+        self._collectors: List[Callable[["MetricsRegistry"], None]] = []
+        self._start = time.monotonic()
+
+    # --------------------
+    # Recording
+    # --------------------
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary()
+            summary.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Observe the duration (seconds) of the with-block as summary name."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]) -> None:
+        """Register a callback that updates gauges right before every export."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_gauges(self, name: str) -> None:
+        """Drop all label sets of a gauge (e.g. before a collector re-sets them)."""
+        with self._lock:
+            for key in [k for k in self._gauges if k[0] == name]:
+                del self._gauges[key]
+
+    # --------------------
+    # Export
+    # --------------------
+    def _collect(self) -> None:
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                log.warning(f"Metrics collector {collector} failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._collect()
+        with self._lock:
+            return {
+                "timestamp": datetime.now(get_localzone()).isoformat(),
+                "uptime_s": round(time.monotonic() - self._start, 1),
+                "counters": {
+                    _label_str(k): v for k, v in sorted(self._counters.items())
+                },
+                "gauges": {_label_str(k): v for k, v in sorted(self._gauges.items())},
+                "summaries": {
+                    _label_str(k): s.to_dict()
+                    for k, s in sorted(self._summaries.items())
+                },
+            }
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition of the current values."""
+        self._collect()
+        lines: List[str] = []
+        with self._lock:
+            for key, v in sorted(self._counters.items()):
+                lines.append(f"{_label_str(key)} {v}")
+            for key, v in sorted(self._gauges.items()):
+                lines.append(f"{_label_str(key)} {v}")
+            for key, s in sorted(self._summaries.items()):
+                name, labels = key
+                for suffix, v in (
+                    ("_count", s.count),
+                    ("_sum", s.sum),
+                    ("_max", s.max),
+                ):
+                    lines.append(f"{_label_str((name + suffix, labels))} {v}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str = METRICS_FILE_PATH) -> bool:
+        try:
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(tmp, path)
+            return True
+        except Exception as e:
+            log.error(f"Could not write metrics file {path}: {e}")
+            return False
+
+
+# Process-wide registry used by all modules
+REGISTRY = MetricsRegistry()
+
+
+# --------------------
+# Local HTTP endpoint
+# --------------------
+class _Handler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.registry.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(self.registry.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the logs
+
+
+def start_http_server(
+    host: str = METRICS_HOST, port: int = METRICS_PORT
+) -> Optional[ThreadingHTTPServer]:
+    """Serve REGISTRY on host:port from a daemon thread. Returns None on failure."""
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        log.error(f"Could not start metrics endpoint on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,434 @@
+# vedirect.py
+# ------------------------------------------------------------
+# VE.Direct text protocol parsing
+# - VEDirectParser is an incremental, byte-level parser: feed it whatever
+#   the serial port returned and it hands back completed frames.
+# - A frame is a series of "\r\n<label>\t<value>" fields terminated by
+#   "\r\nChecksum\t<byte>"; the byte sum of the whole block must be 0 mod 256.
+#   Frames failing that check are discarded and counted.
+# - HEX-protocol messages (":...\n") may be interleaved anywhere except
+#   inside the checksum byte; they are skipped and not part of the sum.
+# - FIELDS is the typed schema for known labels (type + unit); Snapshot is
+#   the compact, fixed-layout merged view of one device built on it.
+# - WindowStats accumulates min/max/mean/last and energy integrals per
+#   aggregation window from every frame a reader sees.
+# ------------------------------------------------------------
+
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Parser states
+_WAIT_HEADER = 0  # waiting for "\n" that starts the next field
+_IN_KEY = 1
+_IN_VALUE = 2
+_IN_CHECKSUM = 3  # next byte is the checksum value
+_IN_HEX = 4
+
+_CR = 0x0D
+_LF = 0x0A
+_TAB = 0x09
+_HEX_START = 0x3A  # ':'
+
+CHECKSUM_LABEL = b"Checksum"
+
+# Guard against garbage (e.g. wrong baud rate) growing a field forever
+MAX_FIELD_BYTES = 64
+MAX_FRAME_FIELDS = 64
+
+
+class VEDirectParser:
+    """
+    Incremental VE.Direct text-protocol parser with checksum validation.
+
+    Usage:
+        frames = parser.feed(ser.read(ser.in_waiting or 1))
+
+    Counters (cumulative):
+      - frames_ok:        frames that passed the checksum and were emitted
+      - checksum_errors:  frames discarded because the checksum did not match
+      - framing_errors:   frames discarded because of oversized/garbled fields
+      - hex_messages:     HEX-protocol messages skipped
+    The very first frame after start/reset is usually partial (we joined the
+    stream mid-frame); it is dropped silently and not counted as an error.
+    """
+
+    def __init__(self):
+        self.frames_ok = 0
+        self.checksum_errors = 0
+        self.framing_errors = 0
+        self.hex_messages = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget any partial frame (e.g. after reopening the port)."""
+        self._state = _WAIT_HEADER
+        self._hex_return = _WAIT_HEADER
+        self._sum = 0
+        self._key = bytearray()
+        self._value = bytearray()
+        self._fields: Dict[str, str] = {}
+        self._bad = False
+        self._synced = False
+
+    def feed(self, data: bytes) -> List[Dict[str, str]]:
+        """Consume raw bytes and return the frames completed by them (possibly none)."""
+        frames: List[Dict[str, str]] = []
+        for b in data:
+            state = self._state
+
+            if state == _IN_HEX:
+                if b == _LF:
+                    self._state = self._hex_return
+                continue
+
+            if b == _HEX_START and state != _IN_CHECKSUM:
+                self._hex_return = state
+                self._state = _IN_HEX
+                self.hex_messages += 1
+                continue
+
+            self._sum = (self._sum + b) & 0xFF
+
+            if state == _WAIT_HEADER:
+                if b == _LF:
+                    self._state = _IN_KEY
+                elif b != _CR:
+                    self._bad = True
+            elif state == _IN_KEY:
+                if b == _TAB:
+                    if self._key == CHECKSUM_LABEL:
+                        self._state = _IN_CHECKSUM
+                    else:
+                        self._state = _IN_VALUE
+                elif b == _CR or b == _LF:
+                    self._bad = True
+                    self._key.clear()
+                    self._state = _IN_KEY if b == _LF else _WAIT_HEADER
+                else:
+                    self._key.append(b)
+                    if len(self._key) > MAX_FIELD_BYTES:
+                        self._bad = True
+                        self._key.clear()
+                        self._state = _WAIT_HEADER
+            elif state == _IN_VALUE:
+                if b == _CR or b == _LF:
+                    self._store_field()
+                    self._state = _IN_KEY if b == _LF else _WAIT_HEADER
+                else:
+                    self._value.append(b)
+                    if len(self._value) > MAX_FIELD_BYTES:
+                        self._bad = True
+                        self._key.clear()
+                        self._value.clear()
+                        self._state = _WAIT_HEADER
+            else:  # _IN_CHECKSUM
+                frame = self._end_frame()
+                if frame is not None:
+                    frames.append(frame)
+        return frames
+
+    def _store_field(self) -> None:
+        if len(self._fields) < MAX_FRAME_FIELDS:
+            key = self._key.decode("latin-1")
+            self._fields[key] = self._value.decode("latin-1").strip()
+        else:
+            self._bad = True
+        self._key.clear()
+        self._value.clear()
+
+    def _end_frame(self):
+        """Checksum byte consumed: validate, emit or reject, and start over."""
+        fields = self._fields
+        valid = self._sum == 0
+        synced = self._synced
+
+        self._fields = {}
+        self._key.clear()
+        self._value.clear()
+        self._sum = 0
+        self._state = _WAIT_HEADER
+        self._synced = True
+        bad, self._bad = self._bad, False
+
+        if not synced:
+            return None  # joined mid-frame; never counted
+        if not valid:
+            self.checksum_errors += 1
+            return None
+        if bad:
+            self.framing_errors += 1
+            return None
+        if not fields:
+            return None
+        self.frames_ok += 1
+        return fields
+
+    @property
+    def frames_rejected(self) -> int:
+        return self.checksum_errors + self.framing_errors
+
+
+# --------------------
+# Field schema (typed values)
+# --------------------
+# (label, type, unit) for known VE.Direct text-protocol fields. Numeric values
+# are kept in the protocol's native integer units (mV, mA, W, 0.01 kWh, ...),
+# so conversion is exact; "---" (value not available) becomes None.
+FIELDS: Tuple[Tuple[str, type, str], ...] = (
+    # identity / status
+    ("PID", str, ""),
+    ("SER#", str, ""),
+    ("FW", str, ""),
+    ("FWE", str, ""),
+    ("BMV", str, ""),
+    ("CS", int, ""),
+    ("ERR", int, ""),
+    ("MPPT", int, ""),
+    ("OR", str, ""),
+    ("MODE", int, ""),
+    ("HSDS", int, "day"),
+    ("MON", int, ""),
+    ("AR", int, ""),
+    ("WARN", int, ""),
+    ("Alarm", str, ""),
+    ("Relay", str, ""),
+    ("LOAD", str, ""),
+    # instantaneous values
+    ("V", int, "mV"),
+    ("V2", int, "mV"),
+    ("V3", int, "mV"),
+    ("VS", int, "mV"),
+    ("VM", int, "mV"),
+    ("DM", int, "‰"),
+    ("VPV", int, "mV"),
+    ("PPV", int, "W"),
+    ("I", int, "mA"),
+    ("I2", int, "mA"),
+    ("I3", int, "mA"),
+    ("IL", int, "mA"),
+    ("P", int, "W"),
+    ("T", int, "°C"),
+    ("CE", int, "mAh"),
+    ("SOC", int, "‰"),
+    ("TTG", int, "min"),
+    ("AC_OUT_V", int, "0.01 V"),
+    ("AC_OUT_I", int, "0.1 A"),
+    ("AC_OUT_S", int, "VA"),
+    # history (BMV/SmartShunt)
+    ("H1", int, "mAh"),
+    ("H2", int, "mAh"),
+    ("H3", int, "mAh"),
+    ("H4", int, ""),
+    ("H5", int, ""),
+    ("H6", int, "mAh"),
+    ("H7", int, "mV"),
+    ("H8", int, "mV"),
+    ("H9", int, "s"),
+    ("H10", int, ""),
+    ("H11", int, ""),
+    ("H12", int, ""),
+    ("H13", int, ""),
+    ("H14", int, ""),
+    ("H15", int, "mV"),
+    ("H16", int, "mV"),
+    ("H17", int, "0.01 kWh"),
+    ("H18", int, "0.01 kWh"),
+    # history (MPPT)
+    ("H19", int, "0.01 kWh"),
+    ("H20", int, "0.01 kWh"),
+    ("H21", int, "W"),
+    ("H22", int, "0.01 kWh"),
+    ("H23", int, "W"),
+)
+
+FIELD_NAMES: Tuple[str, ...] = tuple(name for name, _, _ in FIELDS)
+FIELD_INDEX: Dict[str, int] = {name: i for i, name in enumerate(FIELD_NAMES)}
+FIELD_TYPES: Tuple[type, ...] = tuple(typ for _, typ, _ in FIELDS)
+# label -> unit, sent with every upload page as payload key "units" (module/buffer.py)
+FIELD_UNITS: Dict[str, str] = {name: unit for name, _, unit in FIELDS if unit}
+
+NOT_AVAILABLE = "---"
+
+# Marks an empty slot in a fixed-layout value array
+MISSING = object()
+
+
+def parse_value(key: str, raw: str) -> Any:
+    """Convert a raw VE.Direct value to its schema type.
+    Unknown keys and values that do not parse are kept as strings.
+    """
+    idx = FIELD_INDEX.get(key)
+    if idx is None or FIELD_TYPES[idx] is str:
+        return raw
+    if raw == NOT_AVAILABLE:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
+class Snapshot:
+    """
+    Immutable merged snapshot for one role (FrameMerger.snapshot()).
+
+    Known fields live in a fixed-layout tuple indexed by FIELD_INDEX (MISSING
+    for absent keys); unknown labels go to a small dict. Supports the read-only
+    mapping operations main.py needs (get, in, keys, items) plus to_dict().
+    """
+
+    __slots__ = ("values", "extra", "mono", "version")
+
+    def __init__(
+        self,
+        values: Tuple[Any, ...],
+        extra: Dict[str, Any],
+        mono: float,
+        version: int = 0,
+    ):
+        self.values = values
+        self.extra = extra
+        self.mono = mono  # time.monotonic() of the last merged frame
+        self.version = version  # merge counter of the source FrameMerger
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Seconds since the last merged frame."""
+        return (time.monotonic() if now is None else now) - self.mono
+
+    def get(self, key: str, default: Any = None) -> Any:
+        idx = FIELD_INDEX.get(key)
+        if idx is None:
+            return self.extra.get(key, default)
+        v = self.values[idx]
+        return default if v is MISSING else v
+
+    def __contains__(self, key: str) -> bool:
+        idx = FIELD_INDEX.get(key)
+        if idx is None:
+            return key in self.extra
+        return self.values[idx] is not MISSING
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for name, v in zip(FIELD_NAMES, self.values):
+            if v is not MISSING:
+                yield name, v
+        yield from self.extra.items()
+
+    def keys(self) -> Iterator[str]:
+        for name, _ in self.items():
+            yield name
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+
+# --------------------
+# Windowed statistics
+# --------------------
+# Fields summarised per aggregation window (min/max/mean/last/n)
+STATS_FIELDS: Tuple[str, ...] = ("V", "I", "P", "VPV", "PPV", "SOC", "T")
+
+# Energy integrals: field -> (output name, factor from field unit * hours)
+# I [mA] -> Ah, P [W] -> Wh, PPV [W] -> Wh_pv
+ENERGY_FIELDS: Dict[str, Tuple[str, float]] = {
+    "I": ("Ah", 0.001),
+    "P": ("Wh", 1.0),
+    "PPV": ("Wh_pv", 1.0),
+}
+
+# Gaps between samples longer than this are not integrated (reader outage)
+MAX_INTEGRATION_GAP_SECONDS = 10.0
+
+
+class _FieldStats:
+    __slots__ = ("n", "min", "max", "sum", "last", "last_t", "energy")
+
+    def __init__(self):
+        self.n = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.last = None
+        self.last_t = None
+        self.energy = 0.0
+
+
+class WindowStats:
+    """
+    Streaming per-role accumulator over one aggregation window.
+
+    Readers call add() for every frame; the aggregator calls roll() once per
+    window, which returns the summary and starts a new window. Energy integrals
+    use the trapezoidal rule between consecutive samples of the same field.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._fields: Dict[str, _FieldStats] = {}
+        self._frames = 0
+        self._start = clock()
+
+    def add(self, sample: Dict[str, Any], t: Optional[float] = None) -> None:
+        """Count one frame and add its numeric STATS_FIELDS values (if any)."""
+        t = self._clock() if t is None else t
+        with self._lock:
+            self._frames += 1
+            for k, v in sample.items():
+                if not isinstance(v, (int, float)):
+                    continue
+                fs = self._fields.get(k)
+                if fs is None:
+                    fs = self._fields[k] = _FieldStats()
+                if fs.n == 0 or v < fs.min:
+                    fs.min = v
+                if fs.n == 0 or v > fs.max:
+                    fs.max = v
+                fs.n += 1
+                fs.sum += v
+                if k in ENERGY_FIELDS and fs.last_t is not None:
+                    dt = t - fs.last_t
+                    if 0 < dt <= MAX_INTEGRATION_GAP_SECONDS:
+                        fs.energy += (fs.last + v) * 0.5 * dt / 3600.0
+                fs.last = v
+                fs.last_t = t
+
+    def roll(self) -> Dict[str, Any]:
+        """Return the current window's summary and start a new window.
+        The last sample of each field carries over, so integration continues
+        seamlessly across window boundaries.
+        """
+        now = self._clock()
+        with self._lock:
+            out: Dict[str, Any] = {
+                "window_s": round(now - self._start, 1),
+                "frames": self._frames,
+            }
+            energy: Dict[str, float] = {}
+            for k, fs in self._fields.items():
+                if fs.n == 0:
+                    continue
+                out[k] = {
+                    "min": fs.min,
+                    "max": fs.max,
+                    "mean": round(fs.sum / fs.n, 2),
+                    "last": fs.last,
+                    "n": fs.n,
+                }
+                if k in ENERGY_FIELDS:
+                    name, factor = ENERGY_FIELDS[k]
+                    energy[name] = round(fs.energy * factor, 4)
+            if energy:
+                out["energy"] = energy
+
+            carry: Dict[str, _FieldStats] = {}
+            for k, fs in self._fields.items():
+                if fs.last_t is not None:
+                    nfs = carry[k] = _FieldStats()
+                    nfs.last = fs.last
+                    nfs.last_t = fs.last_t
+            self._fields = carry
+            self._frames = 0
+            self._start = now
+            return out
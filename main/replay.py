@@ -0,0 +1,212 @@
+# replay.py
+# ------------------------------------------------------------
+# Offline replay of raw serial captures (module/capture.py)
+# - Pushes the captured bytes of every port through the same VEDirectParser,
+#   FrameMerger and aggregation (main.roll_window_stats / main.build_entry)
+#   as the station, on the capture's own clock: every AGGREGATE_SECONDS of
+#   capture time one entry is built, as aggregate_once would have.
+# - Ports are replayed together in timestamp order; role changes and port
+#   reopens recorded in the capture are applied as they happened.
+# - --pace fast (default) runs as fast as possible; --pace original keeps
+#   the recorded timing (scaled by --speed).
+# - Entries go out as JSON lines (--out, default stdout); a summary with
+#   parser counters and throughput goes to stderr. --profile writes cProfile
+#   stats for e.g. snakeviz / pstats.
+# Run from main/: python replay.py /container_storage/raw_capture --out entries.jsonl
+# ------------------------------------------------------------
+
+import argparse
+import cProfile
+import heapq
+import json
+import sys
+import time
+from datetime import datetime
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from tzlocal import get_localzone
+
+import main as station
+from module.capture import KIND_DATA, KIND_OPEN, capture_files, read_capture
+from module.device import FrameMerger
+from module.vedirect import VEDirectParser, WindowStats
+
+KIND_FILE = -1  # pseudo record: a new capture file starts (payload: its metadata)
+
+
+class ReplayClock:
+    """Capture time, used as the mergers' monotonic clock. Never goes back
+    (wall-clock steps in the capture are flattened).
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, t: float) -> None:
+        if t > self.now:
+            self.now = t
+
+
+class _Port:
+    """Parser + merger of one captured port."""
+
+    def __init__(
+        self,
+        key: str,
+        files: List[str],
+        clock: ReplayClock,
+        latest_frames: Dict[str, FrameMerger],
+        window_stats: Dict[str, WindowStats],
+    ):
+        self.key = key
+        self.files = files
+        self.clock = clock
+        self.latest_frames = latest_frames
+        self.window_stats = window_stats
+        self.parser = VEDirectParser()
+        self.merger: Optional[FrameMerger] = None
+        self.role: Optional[str] = None
+        self.records = 0
+        self.bytes = 0
+
+    def stream(self) -> Iterator[Tuple[float, str, int, Any]]:
+        """(time, port key, kind, payload) of all files, in time order."""
+        last = 0.0
+        for path in self.files:
+            meta, records = read_capture(path)
+            last = max(last, meta.get("start", last))
+            yield last, self.key, KIND_FILE, meta
+            for t, kind, data in records:
+                last = max(last, t)
+                yield last, self.key, kind, data
+
+    def apply(self, kind: int, payload: Any) -> None:
+        if kind == KIND_DATA:
+            self.records += 1
+            self.bytes += len(payload)
+            for frame in self.parser.feed(payload):
+                self.merger.merge(frame)
+        elif kind == KIND_OPEN:
+            self.parser.reset()
+        elif kind == KIND_FILE:
+            self._set_role(payload.get("role") or self.key)
+
+    def _set_role(self, role: str) -> None:
+        if self.merger is None:
+            self.merger = FrameMerger(
+                role, self.latest_frames, self.window_stats, clock=self.clock.monotonic
+            )
+        elif role != self.role:
+            self.merger.detach()
+            self.merger.attach(role)
+        self.role = role
+
+
+def replay(
+    paths: List[str],
+    out: IO[str],
+    pace: str = "fast",
+    speed: float = 1.0,
+    aggregate_seconds: float = station.AGGREGATE_SECONDS,
+) -> Dict[str, Any]:
+    """Replay the captures under paths (files or directories), writing one
+    JSON entry per line to out. Returns a summary.
+    """
+    clock = ReplayClock()
+    latest_frames: Dict[str, FrameMerger] = {}
+    window_stats: Dict[str, WindowStats] = {}
+    ports = [
+        _Port(key, files, clock, latest_frames, window_stats)
+        for key, files in capture_files(paths).items()
+    ]
+    by_key = {p.key: p for p in ports}
+    tz = get_localzone()
+
+    entries = 0
+    first: Optional[float] = None
+    next_tick = 0.0
+    start = time.monotonic()
+
+    def tick(t: float) -> None:
+        nonlocal entries
+        clock.advance(t)
+        stats = station.roll_window_stats(window_stats)
+        entry, included, _ = station.build_entry(
+            latest_frames, stats, datetime.fromtimestamp(t, tz), t
+        )
+        if included:
+            out.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            entries += 1
+
+    for t, key, kind, payload in heapq.merge(
+        *(p.stream() for p in ports), key=lambda r: r[0]
+    ):
+        if first is None:
+            first, next_tick = t, t + aggregate_seconds
+        while t >= next_tick:
+            tick(next_tick)
+            next_tick += aggregate_seconds
+        if pace == "original":
+            delay = start + (t - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        clock.advance(t)
+        by_key[key].apply(kind, payload)
+
+    elapsed = time.monotonic() - start
+    span = clock.now - first if first is not None else 0.0
+    total_bytes = sum(p.bytes for p in ports)
+    frames = sum(p.parser.frames_ok for p in ports)
+    return {
+        "ports": {
+            p.key: {
+                "role": p.role,
+                "files": len(p.files),
+                "records": p.records,
+                "bytes": p.bytes,
+                "frames_ok": p.parser.frames_ok,
+                "checksum_errors": p.parser.checksum_errors,
+                "framing_errors": p.parser.framing_errors,
+                "hex_messages": p.parser.hex_messages,
+            }
+            for p in ports
+        },
+        "entries": entries,
+        "capture_seconds": round(span, 1),
+        "elapsed_seconds": round(elapsed, 3),
+        "speedup": round(span / elapsed, 1) if elapsed > 0 else None,
+        "frames_per_second": round(frames / elapsed, 1) if elapsed > 0 else None,
+        "bytes_per_second": round(total_bytes / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="Replay raw VE.Direct captures")
+    p.add_argument("paths", nargs="+", help="capture files or directories")
+    p.add_argument("--out", help="entries as JSON lines (default: stdout)")
+    p.add_argument("--pace", choices=("fast", "original"), default="fast")
+    p.add_argument("--speed", type=float, default=1.0, help="with --pace original")
+    p.add_argument("--aggregate-seconds", type=float, default=station.AGGREGATE_SECONDS)
+    p.add_argument("--profile", help="write cProfile stats to this file")
+    args = p.parse_args(argv)
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        summary = replay(args.paths, out, args.pace, args.speed, args.aggregate_seconds)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,72 @@
+# webcam_calibrate.py
+# ------------------------------------------------------------
+# Interactive threshold calibration for the motion detector (module/motion.py).
+# Uses the same MotionPipeline (resolution, background model, threshold) as
+# the headless detector, so the value picked here means the same there.
+#   - Adjust "Threshold" until only real movement shows in the mask
+#   - 's' saves the threshold (default /container_storage/motion_calibration.json,
+#     or the path given as first argument), 'q' quits
+# Run from main/: python webcam_calibrate.py [path]
+# ------------------------------------------------------------
+
+import sys
+
 import cv2
-import numpy as np
+
+from module.motion import (
+    MOTION_CALIBRATION_PATH,
+    MOTION_CAPTURE_SIZE,
+    MotionPipeline,
+    load_calibrated_threshold,
+    save_calibrated_threshold,
+)
 
 
 def nothing(x):
     pass
 
 
-# Initialize the video capture
+path = sys.argv[1] if len(sys.argv) > 1 else MOTION_CALIBRATION_PATH
+
+# Initialize the video capture (same resolution as the detector)
 cap = cv2.VideoCapture(0)
+cap.set(cv2.CAP_PROP_FRAME_WIDTH, MOTION_CAPTURE_SIZE[0])
+cap.set(cv2.CAP_PROP_FRAME_HEIGHT, MOTION_CAPTURE_SIZE[1])
+
 # Create a window for the calibration
 cv2.namedWindow("Calibration")
 
-# Create trackbars for threshold adjustment
-cv2.createTrackbar("Threshold", "Calibration", 25, 255, nothing)
-
-# Read the first frame and set up the average
-ret, frame = cap.read()
-if not ret:
-    print("Failed to capture from webcam")
-    exit()
+# Create trackbars for threshold adjustment (starts at the saved value)
+cv2.createTrackbar(
+    "Threshold", "Calibration", load_calibrated_threshold(path), 255, nothing
+)
 
-average_frame = np.float32(frame)
+pipeline = MotionPipeline()
 
 while True:
     ret, frame = cap.read()
     if not ret:
+        print("Failed to capture from webcam")
         break
 
-    # Apply running average to update the background model
-    cv2.accumulateWeighted(frame, average_frame, 0.01)
-    background = cv2.convertScaleAbs(average_frame)
-
-    # Calculate the difference between current frame and background
-    frame_diff = cv2.absdiff(frame, background)
-
-    # Convert difference to grayscale
-    gray_diff = cv2.cvtColor(frame_diff, cv2.COLOR_BGR2GRAY)
-
     # Get current threshold value from the trackbar
-    threshold_value = cv2.getTrackbarPos("Threshold", "Calibration")
-
-    # Apply threshold to detect movement
-    _, thresh = cv2.threshold(gray_diff, threshold_value, 255, cv2.THRESH_BINARY)
+    pipeline.threshold = cv2.getTrackbarPos("Threshold", "Calibration")
+    fractions = pipeline.process(frame)
 
     # Display the frames to help visualize calibration
     cv2.imshow("Frame", frame)
-    cv2.imshow("Background", background)
-    cv2.imshow("Thresholded Difference", thresh)
-
+    cv2.imshow("Background", pipeline.background)
+    cv2.imshow("Thresholded Difference", pipeline.mask)
+    cv2.setWindowTitle(
+        "Calibration", f"Calibration - changed: {[round(f, 3) for f in fractions]}"
+    )
+
+    key = cv2.waitKey(30) & 0xFF
+    if key == ord("s"):
+        save_calibrated_threshold(pipeline.threshold, path)
+        print(f"Saved threshold {pipeline.threshold} to {path}")
     # Exit loop when 'q' is pressed
-    if cv2.waitKey(30) & 0xFF == ord("q"):
+    if key == ord("q"):
         break
 
 cap.release()
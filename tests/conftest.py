@@ -0,0 +1,227 @@
+# conftest.py
+# ------------------------------------------------------------
+# Benchmark harness for the device pipeline
+# - Puts main/ on sys.path so tests import module.* like main.py does.
+# - The `bench` fixture measures a block (wall time, process CPU, peak RSS
+#   and, with --bench-tracemalloc, the Python heap peak) and records named
+#   metrics per benchmark.
+# - At the end of the run all results are printed; --bench-save writes them
+#   as JSON and --bench-baseline compares against such a file. Metrics named
+#   *_per_s are "higher is better", all others "lower is better"; a change
+#   worse than --bench-tolerance fails the session.
+#
+#   python -m pytest -q tests --bench-save bench-pi4.json
+#   python -m pytest -q tests --bench-baseline bench-pi4.json --bench-scale 5
+# ------------------------------------------------------------
+
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main")
+)
+
+_results_key = pytest.StashKey[Dict[str, Dict[str, Any]]]()
+_regressions_key = pytest.StashKey[List[str]]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bench", "device pipeline benchmarks")
+    group.addoption(
+        "--bench-scale",
+        type=float,
+        default=1.0,
+        help="multiply benchmark sizes (frames, backlog entries) by this factor",
+    )
+    group.addoption("--bench-save", metavar="PATH", help="write results to a JSON file")
+    group.addoption(
+        "--bench-baseline", metavar="PATH", help="compare with a saved results file"
+    )
+    group.addoption(
+        "--bench-tolerance",
+        type=float,
+        default=0.2,
+        help="relative change counted as a regression (default 0.2 = 20%%)",
+    )
+    group.addoption(
+        "--bench-tracemalloc",
+        action="store_true",
+        help="also record the Python heap peak (slows the benchmarks down)",
+    )
+
+
+def pytest_configure(config):
+    config.stash[_results_key] = {}
+    config.stash[_regressions_key] = []
+
+
+# --------------------
+# Measurement
+# --------------------
+class Measurement:
+    """Filled in by Bench.measure() when its block exits."""
+
+    wall_s = 0.0
+    cpu_s = 0.0
+    peak_rss_kib = 0
+    py_peak_kib: Optional[float] = None
+
+
+class Bench:
+    def __init__(self, config, name: str):
+        self.config = config
+        self.name = name
+        self.scale = config.getoption("--bench-scale")
+        self._tracemalloc = config.getoption("--bench-tracemalloc")
+
+    def n(self, base: int) -> int:
+        """A benchmark size scaled by --bench-scale."""
+        return max(1, int(base * self.scale))
+
+    @contextmanager
+    def measure(self) -> Iterator[Measurement]:
+        m = Measurement()
+        if self._tracemalloc:
+            tracemalloc.start()
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        try:
+            yield m
+        finally:
+            m.wall_s = time.perf_counter() - t0
+            m.cpu_s = time.process_time() - cpu0
+            # ru_maxrss is in KiB on Linux
+            m.peak_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if self._tracemalloc:
+                m.py_peak_kib = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+
+    def record(
+        self,
+        case: str,
+        metrics: Dict[str, float],
+        m: Optional[Measurement] = None,
+        info: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Store the metrics of one benchmark case (compared with the baseline)
+        and informational values (sizes, counts; not compared).
+        """
+        metrics = dict(metrics)
+        if m is not None:
+            metrics.setdefault("wall_s", m.wall_s)
+            metrics.setdefault("cpu_s", m.cpu_s)
+            metrics.setdefault("peak_rss_kib", m.peak_rss_kib)
+            if m.py_peak_kib is not None:
+                metrics.setdefault("py_peak_kib", m.py_peak_kib)
+        results = self.config.stash[_results_key]
+        results[f"{self.name}[{case}]"] = {
+            "metrics": {k: round(float(v), 6) for k, v in metrics.items()},
+            "info": info or {},
+        }
+
+
+@pytest.fixture
+def bench(request) -> Bench:
+    return Bench(request.config, request.node.originalname or request.node.name)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+# --------------------
+# Report / baseline
+# --------------------
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+
+def _compare(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    tolerance: float,
+) -> List[str]:
+    regressions = []
+    for case, result in results.items():
+        base = baseline.get(case, {}).get("metrics", {})
+        for metric, value in result["metrics"].items():
+            ref = base.get(metric)
+            if not ref:
+                continue
+            change = (value - ref) / ref
+            worse = -change if _higher_is_better(metric) else change
+            result.setdefault("baseline", {})[metric] = ref
+            if worse > tolerance:
+                regressions.append(
+                    f"{case} {metric}: {ref:g} -> {value:g} ({change:+.0%})"
+                )
+    return regressions
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    results = config.stash.get(_results_key, {})
+    if not results:
+        return
+
+    baseline_path = config.getoption("--bench-baseline")
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f).get("results", {})
+        regressions = _compare(results, baseline, config.getoption("--bench-tolerance"))
+        config.stash[_regressions_key] = regressions
+        if regressions and session.exitstatus == 0:
+            session.exitstatus = 1
+
+    save_path = config.getoption("--bench-save")
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(
+                {
+                    "machine": platform.machine(),
+                    "python": platform.python_version(),
+                    "scale": config.getoption("--bench-scale"),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "results": {
+                        k: {"metrics": v["metrics"], "info": v["info"]}
+                        for k, v in results.items()
+                    },
+                },
+                f,
+                indent=2,
+            )
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    results = config.stash.get(_results_key, {})
+    if not results:
+        return
+    tr = terminalreporter
+    tr.section("benchmarks")
+    for case, result in results.items():
+        tr.write_line(case)
+        base = result.get("baseline", {})
+        for metric, value in result["metrics"].items():
+            line = f"    {metric:<24} {value:>14.6g}"
+            if metric in base:
+                line += f"   baseline {base[metric]:>12.6g} ({(value - base[metric]) / base[metric]:+.0%})"
+            tr.write_line(line)
+        if result["info"]:
+            tr.write_line(f"    info: {result['info']}")
+
+    regressions = config.stash.get(_regressions_key, [])
+    if regressions:
+        tr.section("benchmark regressions")
+        for line in regressions:
+            tr.write_line(line, red=True)
@@ -0,0 +1,348 @@
+# soak.py
+# ------------------------------------------------------------
+# Outage soak test: the full station against the API Gateway stub
+# - Starts StubApiGateway (tests/stub_apigateway.py), two simulated VE.Direct
+#   devices on ptys (MPPT + SmartShunt, tests/vedirect_sim.py) and the
+#   station in a subprocess (tests/soak_station.py -> main.main()).
+# - Phases: healthy (optional background faults), outage (every request
+#   answered 503 or dropped), recovery (until everything buffered before
+#   the recovery has been accepted, or a timeout).
+# - Samples the station's metrics endpoint and /proc/<pid>/status and reports:
+#   backlog growth during the outage (entries and bytes per minute), drain
+#   time after recovery, peak RSS, and lost / duplicated / unsent entries
+#   (by comparing the station's journal of appended entries with what the
+#   stub accepted and what is still in the buffer after shutdown).
+#
+#   python tests/soak.py --healthy 60 --outage 1800 --recovery 900 \
+#       --aggregate-seconds 1 --upload-seconds 10 --error-rate 0.02 --report soak.json
+# Exit status 1 if entries were lost or the backlog did not drain.
+# ------------------------------------------------------------
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if TESTS_DIR not in sys.path:
+    sys.path.insert(0, TESTS_DIR)
+
+from soak_station import JOURNAL_NAME  # noqa: E402
+from stub_apigateway import Faults, StubApiGateway  # noqa: E402
+from vedirect_sim import Feeder, PtyPort, VEDirectSimulator  # noqa: E402
+
+import module.buffer as buffer_mod  # noqa: E402  (main/ is on sys.path via soak_station)
+from module.buffer import FileBuffer  # noqa: E402
+
+STATION_START_TIMEOUT = 60.0  # s until the metrics endpoint must answer
+STATION_STOP_TIMEOUT = 30.0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid: int) -> Dict[str, int]:
+    """VmRSS / VmHWM (peak RSS) of a process in KiB."""
+    out = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    out[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return out
+
+
+def _metrics(port: int) -> Optional[Dict[str, Any]]:
+    try:
+        with urllib.request.urlopen(
+            f"http://127.0.0.1:{port}/metrics.json", timeout=5
+        ) as r:
+            return json.load(r)
+    except OSError:
+        return None
+
+
+def _journal(workdir: str) -> List[str]:
+    try:
+        with open(os.path.join(workdir, JOURNAL_NAME)) as f:
+            return [line.strip() for line in f if line.strip()]
+    except OSError:
+        return []
+
+
+class _Capture:
+    """Connector that accepts every page; used to read what is left in the buffer."""
+
+    class _Response:
+        status_code = 200
+
+    def __init__(self):
+        self.timestamps: List[str] = []
+
+    def post_gzip_data(self, endpoint, data_gz, payload_parent_keys={}, timeout=None):
+        import gzip
+
+        self.timestamps.extend(
+            e["timestamp"] for e in json.loads(gzip.decompress(data_gz))
+        )
+        return self._Response()
+
+    def post_dict(
+        self, endpoint, data, payload_parent_keys={}, timeout=None, compress=False
+    ):
+        self.timestamps.extend(e["timestamp"] for e in data)
+        return self._Response()
+
+
+def _unsent(workdir: str) -> List[str]:
+    """Timestamps still in the station's buffer (after it has stopped)."""
+    capture = _Capture()
+    get_connector = buffer_mod.get_connector
+    buffer_mod.get_connector = lambda url, key: capture
+    try:
+        buf = FileBuffer(os.path.join(workdir, "temporary_device_data.json"))
+        while True:
+            n = len(capture.timestamps)
+            buf.upload_and_clear()
+            if len(capture.timestamps) == n:
+                break
+    finally:
+        buffer_mod.get_connector = get_connector
+    return capture.timestamps
+
+
+def _rate_per_min(samples: List[Dict[str, Any]], key: str) -> float:
+    if len(samples) < 2 or samples[-1]["t"] <= samples[0]["t"]:
+        return 0.0
+    return (
+        (samples[-1][key] - samples[0][key]) / (samples[-1]["t"] - samples[0]["t"]) * 60
+    )
+
+
+def run_soak(
+    workdir: str,
+    healthy: float = 30.0,
+    outage: float = 300.0,
+    recovery: float = 300.0,
+    outage_mode: str = "503",
+    faults: Optional[Dict[str, Any]] = None,
+    aggregate_seconds: int = 1,
+    upload_seconds: int = 5,
+    upload_timeout: float = 5.0,
+    block_interval: float = 0.1,
+    sample_seconds: float = 1.0,
+    log=print,
+) -> Dict[str, Any]:
+    """Run one healthy -> outage -> recovery cycle and return the report."""
+    os.makedirs(workdir, exist_ok=True)
+    stub = StubApiGateway(faults=Faults(**(faults or {}))).start()
+
+    ports, feeders = [], []
+    for kind, seed in (("mppt", 11), ("shunt", 12)):
+        port = PtyPort()
+        sim = VEDirectSimulator(
+            kind, seed=seed, checksum_error_rate=0.01, hex_rate=0.05
+        )
+        feeder = Feeder(port, list(sim.blocks(200)), interval=block_interval, loop=True)
+        feeder.start()
+        ports.append(port)
+        feeders.append(feeder)
+
+    metrics_port = _free_port()
+    env = dict(
+        os.environ,
+        API_GATEWAY_MILJOSTASJON_URL=stub.url,
+        API_GATEWAY_MILJOSTASJON_KEY="soak",
+        DEVICE_ID="soak-station",
+    )
+    cmd = [
+        sys.executable,
+        os.path.join(TESTS_DIR, "soak_station.py"),
+        "--workdir", workdir,
+        "--ports", ",".join(p.name for p in ports),
+        "--metrics-port", str(metrics_port),
+        "--aggregate-seconds", str(aggregate_seconds),
+        "--upload-seconds", str(upload_seconds),
+        "--upload-timeout", str(upload_timeout),
+    ]  # fmt: skip
+    station_log = open(os.path.join(workdir, "station.log"), "ab")
+    proc = subprocess.Popen(cmd, env=env, stdout=station_log, stderr=subprocess.STDOUT)
+
+    samples: List[Dict[str, Any]] = []
+    t0 = time.monotonic()
+    peak_rss = 0
+
+    def sample(phase: str) -> Dict[str, Any]:
+        nonlocal peak_rss
+        m = _metrics(metrics_port) or {}
+        gauges = m.get("gauges", {})
+        status = _proc_status(proc.pid)
+        peak_rss = max(peak_rss, status.get("VmHWM", 0))
+        row = {
+            "t": round(time.monotonic() - t0, 2),
+            "phase": phase,
+            "pending_entries": gauges.get("buffer_pending_entries", 0),
+            "buffer_bytes": gauges.get("buffer_bytes", 0),
+            "rss_kib": status.get("VmRSS", 0),
+            "accepted": stub.stats()["power_unique_entries"],
+        }
+        samples.append(row)
+        return row
+
+    def run_phase(phase: str, seconds: float, until=None) -> float:
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            if proc.poll() is not None:
+                raise RuntimeError(
+                    f"station exited with {proc.returncode} during {phase}"
+                )
+            row = sample(phase)
+            if until is not None and until():
+                break
+            if int(row["t"]) % 10 == 0:
+                log(f"[{phase}] {row}")
+            time.sleep(sample_seconds)
+        return time.monotonic() - start
+
+    report: Dict[str, Any] = {}
+    try:
+        deadline = time.monotonic() + STATION_START_TIMEOUT
+        while _metrics(metrics_port) is None:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("station did not start (see station.log)")
+            time.sleep(0.5)
+        log(f"Station running (pid {proc.pid}), stub on {stub.url}")
+
+        run_phase("healthy", healthy)
+
+        stub.faults.update(outage=outage_mode)
+        run_phase("outage", outage)
+        outage_samples = [s for s in samples if s["phase"] == "outage"]
+
+        stub.faults.update(outage="off")
+        recovered_at = datetime.now().astimezone()
+
+        def drained() -> bool:
+            before = [
+                ts
+                for ts in _journal(workdir)
+                if datetime.fromisoformat(ts) < recovered_at
+            ]
+            received = stub.received()
+            return all(ts in received for ts in before)
+
+        drain_s = run_phase("recovery", recovery, until=drained)
+        report["drained"] = drained()
+        report["drain_s"] = round(drain_s, 1) if report["drained"] else None
+        report["backlog_growth_entries_per_min"] = round(
+            _rate_per_min(outage_samples, "pending_entries"), 2
+        )
+        report["backlog_growth_bytes_per_min"] = round(
+            _rate_per_min(outage_samples, "buffer_bytes"), 1
+        )
+        report["backlog_peak_entries"] = max(
+            (s["pending_entries"] for s in samples), default=0
+        )
+        report["backlog_peak_bytes"] = max(
+            (s["buffer_bytes"] for s in samples), default=0
+        )
+    finally:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(STATION_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        station_log.close()
+        for feeder in feeders:
+            feeder.stop()
+        for feeder in feeders:
+            feeder.join()
+        for port in ports:
+            port.close()
+        stub.stop()
+
+    appended = _journal(workdir)
+    received = stub.received()
+    unsent = _unsent(workdir)
+    accounted = set(received) | set(unsent)
+    report.update(
+        {
+            "station_exit_code": proc.returncode,
+            "peak_rss_kib": peak_rss,
+            "entries_appended": len(appended),
+            "entries_accepted": len(received),
+            "entries_unsent": len(unsent),
+            "lost": sorted(set(appended) - accounted),
+            "duplicates": sum(n - 1 for n in received.values())
+            + len(set(received) & set(unsent))
+            + sum(n - 1 for n in Counter(unsent).values()),
+            "unexpected": sorted(accounted - set(appended)),
+            "stub": stub.stats(),
+            "samples": samples,
+        }
+    )
+    return report
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(
+        description="Station outage soak test against the API Gateway stub"
+    )
+    p.add_argument("--workdir", help="default: a new temporary directory")
+    p.add_argument("--healthy", type=float, default=30.0, help="seconds")
+    p.add_argument("--outage", type=float, default=300.0, help="seconds")
+    p.add_argument("--recovery", type=float, default=300.0, help="max seconds to drain")
+    p.add_argument("--outage-mode", choices=("503", "drop"), default="503")
+    p.add_argument("--aggregate-seconds", type=int, default=1)
+    p.add_argument("--upload-seconds", type=int, default=5)
+    p.add_argument("--upload-timeout", type=float, default=5.0)
+    p.add_argument("--block-interval", type=float, default=0.1)
+    p.add_argument("--report", help="write the full report (with samples) as JSON")
+    defaults = Faults().to_dict()
+    defaults.pop("outage")
+    for key, value in defaults.items():
+        p.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    args = p.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="soak-")
+    report = run_soak(
+        workdir,
+        healthy=args.healthy,
+        outage=args.outage,
+        recovery=args.recovery,
+        outage_mode=args.outage_mode,
+        faults={k: getattr(args, k) for k in defaults},
+        aggregate_seconds=args.aggregate_seconds,
+        upload_seconds=args.upload_seconds,
+        upload_timeout=args.upload_timeout,
+        block_interval=args.block_interval,
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    summary = {k: v for k, v in report.items() if k != "samples"}
+    summary["lost"] = len(report["lost"])
+    print(json.dumps(summary, indent=2))
+    print(f"workdir: {workdir}")
+    sys.exit(1 if report["lost"] or not report["drained"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# soak_station.py
+# ------------------------------------------------------------
+# Runs the real station (main.main()) for the soak harness (tests/soak.py)
+# - Same code path as the container, with time compressed and every
+#   /container_storage path moved into --workdir.
+# - Serial ports are the given (pty) paths instead of /dev/ttyUSB*.
+# - Motion detection and the metrics file are off; the metrics endpoint
+#   listens on --metrics-port, which is how the harness watches the backlog.
+# - Every buffered entry's timestamp is appended to <workdir>/appended.log,
+#   so the harness can tell lost from duplicated entries.
+# The API Gateway URL/key/device id come from the usual environment variables.
+#
+#   python tests/soak_station.py --workdir /tmp/soak --ports /dev/pts/3,/dev/pts/4
+# ------------------------------------------------------------
+
+import argparse
+import os
+import sys
+from functools import partial
+
+MAIN_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main"
+)
+if MAIN_DIR not in sys.path:
+    sys.path.insert(0, MAIN_DIR)
+
+import main as station  # noqa: E402
+import module.buffer as buffer_mod  # noqa: E402
+import module.config as config_mod  # noqa: E402
+import module.device as device  # noqa: E402
+import module.hotplug as hotplug  # noqa: E402
+from module.buffer import FileBuffer  # noqa: E402
+
+JOURNAL_NAME = "appended.log"
+
+
+def configure(args) -> None:
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    ports = [p for p in args.ports.split(",") if p]
+
+    # paths
+    station.BUFFER_PATH = os.path.join(workdir, "temporary_device_data.json")
+    device.IDENTITY_CACHE_PATH = os.path.join(workdir, "device_identity.json")
+    device.WEBCAM_HASH_CACHE_PATH = os.path.join(workdir, "webcam_hashes.json")
+    config_mod.CONFIG_CACHE_PATH = os.path.join(workdir, "device_config.json")
+
+    # serial ports
+    device.list_serial_ports = hotplug.list_serial_ports = lambda: list(ports)
+
+    # time compression
+    station.STARTUP_DELAY = 0
+    station.AGGREGATOR_WARMUP_SECONDS = args.warmup_seconds
+    station.AGGREGATE_SECONDS = args.aggregate_seconds
+    station.SCHEDULE_SECONDS = args.upload_seconds
+    station.FIRST_UPLOAD_DELAY = args.upload_seconds
+    buffer_mod.UPLOAD_TIMEOUT = (args.upload_timeout, args.upload_timeout)
+
+    # optional parts
+    station.MOTION_ENABLED = False
+    station.METRICS_FILE_ENABLED = False
+    station.start_http_server = partial(
+        station.start_http_server, port=args.metrics_port
+    )
+
+    # journal of every appended entry
+    journal = open(os.path.join(workdir, JOURNAL_NAME), "a", buffering=1)
+    append = FileBuffer.append
+
+    def journaled_append(self, entry):
+        append(self, entry)
+        journal.write(f"{entry['timestamp']}\n")
+
+    FileBuffer.append = journaled_append
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(
+        description="Run the station against a stub API Gateway"
+    )
+    p.add_argument("--workdir", required=True)
+    p.add_argument("--ports", required=True, help="comma-separated serial port paths")
+    p.add_argument("--metrics-port", type=int, default=9108)
+    p.add_argument("--aggregate-seconds", type=int, default=1)
+    p.add_argument("--upload-seconds", type=int, default=5)
+    p.add_argument("--upload-timeout", type=float, default=5.0)
+    p.add_argument("--warmup-seconds", type=int, default=0)
+    args = p.parse_args()
+
+    configure(args)
+    station.main()
+
+
+if __name__ == "__main__":
+    main()
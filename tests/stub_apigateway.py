@@ -0,0 +1,357 @@
+# stub_apigateway.py
+# ------------------------------------------------------------
+# Local stand-in for the miljøstasjon API Gateway, with fault injection
+# - Endpoints as used by ApiGatewayConnector:
+#     POST /power   JSON payload {"deviceId", "timestamp", "data": [...]}, plain
+#                   or gzip (also spliced multi-member gzip), "format":
+#                   "columnar-delta/1" is decoded with module/encoding.py
+#     POST /image   raw JPEG body (metadata in the query string) or JSON
+#                   {"data": {"image": base64, ...}}
+#     GET  /device  {"config": "<toml>"}, with ETag / If-None-Match (304)
+# - Faults (changeable while running, also via POST /_faults):
+#     latency (+ jitter), 5xx and 429 rates, "hang" (the request is
+#     processed but the answer only comes after hang_seconds, like a backend
+#     that stored the data but timed out towards the client), request size
+#     limit (413) and outage mode: "503" for every request or "drop" (close
+#     the connection without an answer).
+# - Everything accepted is recorded: power entry timestamps (in arrival
+#   order, so duplicates show), images, and per-endpoint status counts
+#   (GET /_stats).
+#
+#   python tests/stub_apigateway.py --port 8089 --error-rate 0.05 --latency 0.3
+# ------------------------------------------------------------
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+MAIN_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main"
+)
+if MAIN_DIR not in sys.path:
+    sys.path.insert(0, MAIN_DIR)
+
+from module.encoding import FORMAT_COLUMNAR, decode_power_batch  # noqa: E402
+
+DEFAULT_MAX_BODY_BYTES = 10 * 1024 * 1024  # API Gateway payload limit
+DEFAULT_DEVICE_CONFIG = '[station]\nname = "soak"\n'
+OUTAGE_MODES = ("off", "503", "drop")
+
+
+class Faults:
+    """Fault settings; every attribute can be changed while the stub runs."""
+
+    def __init__(self, **settings: Any):
+        self.latency = 0.0  # seconds added to every request
+        self.latency_jitter = 0.0  # + uniform(0, jitter)
+        self.error_rate = 0.0  # share of requests answered 500/502/503
+        self.throttle_rate = 0.0  # share of requests answered 429
+        self.hang_rate = 0.0  # share of requests answered only after hang_seconds
+        self.hang_seconds = 120.0
+        self.outage = "off"  # "off" | "503" | "drop"
+        self.max_body_bytes = DEFAULT_MAX_BODY_BYTES
+        self.update(**settings)
+
+    def update(self, **settings: Any) -> None:
+        for key, value in settings.items():
+            if not hasattr(self, key):
+                raise ValueError(f"Unknown fault setting: {key}")
+            if key == "outage" and value not in OUTAGE_MODES:
+                raise ValueError(f"outage must be one of {OUTAGE_MODES}")
+            setattr(self, key, type(getattr(self, key))(value))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class StubApiGateway:
+    """Threaded HTTP stub; start() serves from a daemon thread."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        faults: Optional[Faults] = None,
+        device_config: str = DEFAULT_DEVICE_CONFIG,
+        seed: Optional[int] = None,
+    ):
+        self.faults = faults or Faults()
+        self.device_config = device_config
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        # records (under _lock)
+        self.power_timestamps: List[str] = []
+        self.power_requests = 0
+        self.images: List[Dict[str, Any]] = []
+        self.statuses: Dict[str, Counter] = {}
+        self.bytes_received: Counter = Counter()
+
+        stub = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.stub = stub
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StubApiGateway":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --------------------
+    # Fault decisions / records
+    # --------------------
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._rng.random() < rate
+
+    def _delay(self) -> float:
+        f = self.faults
+        with self._lock:
+            return f.latency + (
+                self._rng.uniform(0, f.latency_jitter) if f.latency_jitter else 0.0
+            )
+
+    def _count(self, endpoint: str, status: int, size: int) -> None:
+        with self._lock:
+            self.statuses.setdefault(endpoint, Counter())[str(status)] += 1
+            self.bytes_received[endpoint] += size
+
+    def received(self) -> Counter:
+        """How often each power entry (by timestamp) was accepted."""
+        with self._lock:
+            return Counter(self.power_timestamps)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = Counter(self.power_timestamps)
+            return {
+                "faults": self.faults.to_dict(),
+                "statuses": {k: dict(v) for k, v in self.statuses.items()},
+                "bytes_received": dict(self.bytes_received),
+                "power_requests": self.power_requests,
+                "power_entries": len(self.power_timestamps),
+                "power_unique_entries": len(counts),
+                "power_duplicates": sum(n - 1 for n in counts.values()),
+                "images": len(self.images),
+            }
+
+    # --------------------
+    # Endpoint logic (raises _HttpError for 4xx)
+    # --------------------
+    def handle_power(self, headers, body: bytes) -> Dict[str, Any]:
+        payload = _json_body(headers, body)
+        data = payload.get("data")
+        if payload.get("format") == FORMAT_COLUMNAR:
+            data = decode_power_batch(data)
+        if not isinstance(data, list):
+            raise _HttpError(400, "data must be a list of entries")
+        with self._lock:
+            self.power_requests += 1
+            self.power_timestamps.extend(str(e.get("timestamp")) for e in data)
+        return {"message": "ok", "entries": len(data)}
+
+    def handle_image(
+        self, headers, body: bytes, query: Dict[str, List[str]]
+    ) -> Dict[str, Any]:
+        if headers.get("Content-Type", "").startswith("application/json"):
+            data = _json_body(headers, body).get("data") or {}
+            image = base64.b64decode(data.get("image", ""))
+            meta = {k: v for k, v in data.items() if k != "image"}
+        else:
+            image = body
+            meta = {k: v[0] for k, v in query.items()}
+        if not image.startswith(b"\xff\xd8"):
+            raise _HttpError(400, "not a JPEG")
+        with self._lock:
+            self.images.append({"bytes": len(image), **meta})
+        return {"message": "ok"}
+
+    def device_etag(self) -> str:
+        return '"' + hashlib.sha1(self.device_config.encode("utf-8")).hexdigest() + '"'
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _json_body(headers, body: bytes) -> Dict[str, Any]:
+    try:
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)  # also handles concatenated members
+        return json.loads(body)
+    except (OSError, ValueError) as e:
+        raise _HttpError(400, f"invalid body: {e}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real gateway
+    stub: StubApiGateway
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(
+        self, status: int, obj: Optional[Dict[str, Any]] = None, headers=None
+    ) -> None:
+        body = b"" if obj is None else json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if obj is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # the client gave up (e.g. after a hang)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _inject(self, endpoint: str, size: int) -> bool:
+        """Apply faults that answer before the request is processed.
+        Returns True if the request was answered (or dropped) here.
+        """
+        stub, f = self.stub, self.stub.faults
+        delay = stub._delay()
+        if delay:
+            time.sleep(delay)
+        if f.outage == "drop":
+            stub._count(endpoint, 0, size)
+            self.close_connection = True
+            return True
+        if f.outage == "503":
+            stub._count(endpoint, 503, size)
+            self._reply(503, {"message": "Service Unavailable"})
+            return True
+        if size > f.max_body_bytes:
+            stub._count(endpoint, 413, size)
+            self._reply(413, {"message": "Request Entity Too Large"})
+            return True
+        if stub._roll(f.throttle_rate):
+            stub._count(endpoint, 429, size)
+            self._reply(429, {"message": "Too Many Requests"})
+            return True
+        if stub._roll(f.error_rate):
+            status = stub._rng.choice((500, 502, 503))
+            stub._count(endpoint, status, size)
+            self._reply(status, {"message": "Internal server error"})
+            return True
+        return False
+
+    def _respond(
+        self, endpoint: str, size: int, status: int, obj, headers=None
+    ) -> None:
+        # a hang happens after processing: the data is stored, the answer is late
+        if status == 200 and self.stub._roll(self.stub.faults.hang_rate):
+            time.sleep(self.stub.faults.hang_seconds)
+        self.stub._count(endpoint, status, size)
+        self._reply(status, obj, headers)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip("/")
+        body = self._read_body()
+
+        if endpoint == "_faults":
+            try:
+                self.stub.faults.update(**json.loads(body or b"{}"))
+            except (ValueError, TypeError) as e:
+                self._reply(400, {"message": str(e)})
+                return
+            self._reply(200, self.stub.faults.to_dict())
+            return
+        if endpoint not in ("power", "image"):
+            self._reply(404, {"message": "Not Found"})
+            return
+        if self.headers.get("x-api-key") is None:
+            self._reply(403, {"message": "Forbidden"})
+            return
+        if self._inject(endpoint, len(body)):
+            return
+        try:
+            if endpoint == "power":
+                result = self.stub.handle_power(self.headers, body)
+            else:
+                result = self.stub.handle_image(self.headers, body, parse_qs(url.query))
+        except _HttpError as e:
+            self._respond(endpoint, len(body), e.status, {"message": e.message})
+            return
+        self._respond(endpoint, len(body), 200, result)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip("/")
+        if endpoint == "_stats":
+            self._reply(200, self.stub.stats())
+            return
+        if endpoint != "device":
+            self._reply(404, {"message": "Not Found"})
+            return
+        if self._inject(endpoint, 0):
+            return
+        etag = self.stub.device_etag()
+        if self.headers.get("If-None-Match") == etag:
+            self._respond(endpoint, 0, 304, None, {"ETag": etag})
+            return
+        self._respond(
+            endpoint, 0, 200, {"config": self.stub.device_config}, {"ETag": etag}
+        )
+
+
+# --------------------
+# CLI
+# --------------------
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="Fault-injecting API Gateway stub")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8089)
+    p.add_argument("--config", help="TOML file served by GET /device")
+    p.add_argument("--seed", type=int)
+    defaults = Faults()
+    for key, value in defaults.to_dict().items():
+        p.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    args = p.parse_args(argv)
+
+    faults = Faults(**{k: getattr(args, k) for k in defaults.to_dict()})
+    config = DEFAULT_DEVICE_CONFIG
+    if args.config:
+        with open(args.config) as f:
+            config = f.read()
+    stub = StubApiGateway(args.host, args.port, faults, config, args.seed)
+    print(f"API Gateway stub on {stub.url} (faults: {faults.to_dict()})", flush=True)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(stub.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# test_bench_buffer.py
+# ------------------------------------------------------------
+# Benchmarks of the persistent telemetry buffer (module/buffer.py)
+# - append: per-entry latency of FileBuffer.append (group commit + fsync as
+#   configured) on top of an existing backlog of different sizes.
+# - drain: FileBuffer.upload_and_clear until the backlog is empty, against
+#   an in-process connector that acknowledges every page with 200, so the
+#   numbers are the device-side cost (sealing, reading, splicing, cursor).
+# Entries are built like main.aggregate_once builds them: merged snapshots
+# and window statistics from simulated MPPT and SmartShunt streams.
+# ------------------------------------------------------------
+
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pytest
+
+from vedirect_sim import VEDirectSimulator
+from conftest import percentile
+
+import module.buffer as buffer_mod
+from module.buffer import FileBuffer
+from module.device import FrameMerger
+from module.vedirect import VEDirectParser
+
+BACKLOG_SIZES = (0, 1_000, 5_000)  # entries already buffered (x --bench-scale)
+APPEND_ENTRIES = 500
+AGGREGATE_SECONDS = 30  # spacing of entry timestamps, as in main.py
+DISTINCT_ENTRIES = 50  # distinct entry bodies cycled through
+
+
+def _entries(n: int) -> List[Dict]:
+    """DISTINCT_ENTRIES realistic aggregate entries (charger + loadlogger)."""
+    roles = {
+        "charger": VEDirectSimulator("mppt", seed=2),
+        "loadlogger": VEDirectSimulator("shunt", seed=3),
+    }
+    state = {}
+    for role, sim in roles.items():
+        parser, merger = VEDirectParser(), FrameMerger(role, {}, {})
+        state[role] = (sim, parser, merger)
+        for frame in parser.feed(b"".join(raw for raw, _ in sim.blocks(4))):
+            merger.merge(frame)
+
+    out = []
+    for _ in range(n):
+        entry = {}
+        for role, (sim, parser, merger) in state.items():
+            # ~30 blocks per window, like a device sending one per second
+            for frame in parser.feed(b"".join(raw for raw, _ in sim.blocks(30))):
+                merger.merge(frame)
+            entry[role] = merger.snapshot().to_dict()
+            entry[role]["stats"] = merger.stats.roll()
+        entry["motion"] = {
+            "counts": {"frames": 30, "motion_frames": 2, "events": 0},
+            "cpu": 0.04,
+        }
+        out.append(entry)
+    return out
+
+
+def _timestamps(n: int, start: datetime) -> List[str]:
+    return [
+        (start + timedelta(seconds=AGGREGATE_SECONDS * i)).isoformat() for i in range(n)
+    ]
+
+
+def _fill(buf: FileBuffer, bodies: List[Dict], stamps: List[str], monkeypatch) -> None:
+    """Write a backlog quickly (no fsync, one flush at the end)."""
+    with monkeypatch.context() as m:
+        m.setattr(buffer_mod, "FSYNC_ON_FLUSH", False)
+        m.setattr(buffer_mod, "FLUSH_EVERY_ENTRIES", 10**9)
+        for i, ts in enumerate(stamps):
+            buf.append({"timestamp": ts, **bodies[i % len(bodies)]})
+        buf.flush()
+
+
+class _Response:
+    status_code = 200
+
+
+class _AckConnector:
+    """Stands in for ApiGatewayConnector: acknowledges everything, keeps bodies."""
+
+    def __init__(self):
+        self.bodies: List[bytes] = []
+        self.pages: List[list] = []
+        self.bytes = 0
+
+    def post_gzip_data(self, endpoint, data_gz, payload_parent_keys={}, timeout=None):
+        self.bodies.append(data_gz)
+        self.bytes += len(data_gz)
+        return _Response()
+
+    def post_dict(
+        self, endpoint, data, payload_parent_keys={}, timeout=None, compress=False
+    ):
+        self.pages.append(data)
+        self.bytes += len(json.dumps(data, separators=(",", ":")))
+        return _Response()
+
+    def entries(self) -> List[Dict]:
+        out = []
+        for body in self.bodies:
+            out.extend(json.loads(gzip.decompress(body)))
+        for page in self.pages:
+            out.extend(page)
+        return out
+
+
+@pytest.fixture(scope="module")
+def bodies():
+    return _entries(DISTINCT_ENTRIES)
+
+
+# --------------------
+# Benchmarks
+# --------------------
+@pytest.mark.parametrize("backlog", BACKLOG_SIZES)
+def test_append(bench, tmp_path, monkeypatch, bodies, backlog):
+    backlog = bench.n(backlog) if backlog else 0
+    n = bench.n(APPEND_ENTRIES)
+    stamps = _timestamps(
+        backlog + n,
+        datetime.now().astimezone()
+        - timedelta(seconds=AGGREGATE_SECONDS * (backlog + n)),
+    )
+
+    buf = FileBuffer(str(tmp_path / "buffer.json"))
+    _fill(buf, bodies, stamps[:backlog], monkeypatch)
+
+    latencies: List[float] = []
+    with bench.measure() as m:
+        for i, ts in enumerate(stamps[backlog:]):
+            entry = {"timestamp": ts, **bodies[i % len(bodies)]}
+            t0 = time.perf_counter()
+            buf.append(entry)
+            latencies.append((time.perf_counter() - t0) * 1e6)
+        buf.flush()
+
+    stats = buf.stats()
+    assert stats["pending_entries"] == backlog + n
+    bench.record(
+        f"backlog={backlog}",
+        {
+            "appends_per_s": n / m.wall_s,
+            "append_us_p50": percentile(latencies, 0.5),
+            "append_us_p99": percentile(latencies, 0.99),
+            "append_us_max": max(latencies),
+            "cpu_us_per_append": m.cpu_s / n * 1e6,
+        },
+        m,
+        info={"entries": n, "segments": stats["segments"], "bytes": stats["bytes"]},
+    )
+
+
+@pytest.mark.parametrize("backlog", [b for b in BACKLOG_SIZES if b])
+def test_drain(bench, tmp_path, monkeypatch, bodies, backlog):
+    backlog = bench.n(backlog)
+    stamps = _timestamps(
+        backlog,
+        datetime.now().astimezone() - timedelta(seconds=AGGREGATE_SECONDS * backlog),
+    )
+
+    buf = FileBuffer(str(tmp_path / "buffer.json"))
+    _fill(buf, bodies, stamps, monkeypatch)
+    disk_bytes = buf.stats()["bytes"]
+
+    connector = _AckConnector()
+    monkeypatch.setattr(buffer_mod, "get_connector", lambda url, key: connector)
+
+    runs = 0
+    with bench.measure() as m:
+        while True:
+            before = len(connector.bodies) + len(connector.pages)
+            assert buf.upload_and_clear()
+            runs += 1
+            if len(connector.bodies) + len(connector.pages) == before:
+                break
+
+    received = [e["timestamp"] for e in connector.entries()]
+    assert received == stamps, "entries lost, duplicated or reordered"
+    assert buf.stats()["pending_entries"] == 0
+    bench.record(
+        f"backlog={backlog}",
+        {
+            "entries_per_s": backlog / m.wall_s,
+            "cpu_us_per_entry": m.cpu_s / backlog * 1e6,
+            "sent_bytes_per_entry": connector.bytes / backlog,
+        },
+        m,
+        info={
+            "runs": runs,
+            "requests": len(connector.bodies) + len(connector.pages),
+            "spliced_segments": len(connector.bodies),
+            "disk_bytes": disk_bytes,
+        },
+    )
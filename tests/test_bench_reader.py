@@ -0,0 +1,271 @@
+# test_bench_reader.py
+# ------------------------------------------------------------
+# Benchmarks of the VE.Direct read path over pty-backed serial ports
+# - parser: VEDirectParser.feed + FrameMerger.merge in-process (no I/O),
+#   the floor for everything else.
+# - reader throughput: simulated MPPT/SmartShunt streams (with checksum
+#   errors and HEX noise) written as fast as the reader drains them, through
+#   ReaderThread and SerialReaderEngine -> frames/s and CPU per frame.
+# - reader latency: paced blocks, time from writing a block to
+#   FrameMerger.merge returning for it.
+# - probe: _read_probe_frame against a device emitting a block every
+#   PROBE_BLOCK_INTERVAL seconds (time-compressed; real devices send ~1/s).
+# ------------------------------------------------------------
+
+import os
+import time
+from typing import Dict, List, Tuple
+
+import pytest
+
+from vedirect_sim import Feeder, PtyPort, VEDirectSimulator, count_valid
+from conftest import percentile
+
+import module.device as device
+from module.device import (
+    FrameMerger,
+    ReaderThread,
+    SerialReaderEngine,
+    _read_probe_frame,
+)
+from module.vedirect import VEDirectParser, WindowStats
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "openpty"), reason="needs pseudo-terminals"
+)
+
+FLOOD_BLOCKS = 2_000  # per throughput case (x --bench-scale)
+LATENCY_BLOCKS = 300
+LATENCY_INTERVAL = 0.002  # s between paced blocks
+PROBE_RUNS = 5
+PROBE_BLOCK_INTERVAL = 0.02
+READ_TIMEOUT = 60.0  # give up waiting for frames after this many seconds
+
+NOISE = {
+    "clean": {},
+    "noisy": {"checksum_error_rate": 0.02, "hex_rate": 0.1},
+}
+
+
+def _sim(kind: str, noise: str, seed: int = 1) -> VEDirectSimulator:
+    return VEDirectSimulator(kind=kind, seed=seed, **NOISE[noise])
+
+
+# --------------------
+# Reader plumbing
+# --------------------
+class _Reader:
+    """Runs a ReaderThread or a SerialReaderEngine on one port and exposes the
+    port's parser and merger.
+    """
+
+    def __init__(self, engine: str, port: str):
+        self.latest_frames: Dict[str, FrameMerger] = {}
+        self.window_stats: Dict[str, WindowStats] = {}
+        if engine == "threads":
+            self.thread = ReaderThread(
+                "charger", port, self.latest_frames, window_stats=self.window_stats
+            )
+            self.thread.start()
+            self.parser, self.merger = self.thread.parser, self.thread.merger
+        else:
+            self.thread = SerialReaderEngine(
+                [("charger", port)], self.latest_frames, window_stats=self.window_stats
+            )
+            self.thread.start()
+            deadline = time.monotonic() + 5
+            while port not in self.thread.ports and time.monotonic() < deadline:
+                time.sleep(0.01)
+            st = self.thread.ports[port]
+            self.parser, self.merger = st.parser, st.merger
+
+    def counters(self) -> Tuple[int, int, int]:
+        p = self.parser
+        return p.frames_ok, p.checksum_errors, p.hex_messages
+
+    def stop(self) -> None:
+        self.thread.stop()
+
+
+def _wait(predicate, timeout: float = READ_TIMEOUT, step: float = 0.001) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(step)
+    return True
+
+
+def _warm_up(port: PtyPort, reader: _Reader, sim: VEDirectSimulator) -> None:
+    """Feed paced blocks until the reader has the port open and is in sync,
+    then let it drain, so measurements start on a quiet, block-aligned stream.
+    """
+    feeder = Feeder(
+        port, [sim.next_block() for _ in range(5)], interval=0.01, loop=True
+    )
+    feeder.start()
+    assert _wait(lambda: reader.parser.frames_ok > 0, timeout=10), "reader never synced"
+    feeder.stop()
+    feeder.join()
+    last = -1
+    while last != reader.parser.frames_ok:
+        last = reader.parser.frames_ok
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pty_port():
+    port = PtyPort()
+    yield port
+    port.close()
+
+
+# --------------------
+# Benchmarks
+# --------------------
+@pytest.mark.parametrize("kind", ["mppt", "shunt"])
+def test_parser_merge(bench, kind):
+    blocks = list(_sim(kind, "noisy").blocks(bench.n(10 * FLOOD_BLOCKS)))
+    counts = count_valid(blocks)
+    data = b"".join(raw for raw, _ in blocks)
+    parser = VEDirectParser()
+    merger = FrameMerger("charger", {}, {})
+
+    with bench.measure() as m:
+        # feed in chunks like serial reads of a few hundred bytes
+        for i in range(0, len(data), 256):
+            for frame in parser.feed(data[i : i + 256]):
+                merger.merge(frame)
+
+    # the first block only syncs the parser
+    assert parser.frames_ok + parser.checksum_errors == counts["blocks"] - 1
+    bench.record(
+        kind,
+        {
+            "frames_per_s": parser.frames_ok / m.wall_s,
+            "bytes_per_s": len(data) / m.wall_s,
+            "cpu_us_per_frame": m.cpu_s / parser.frames_ok * 1e6,
+        },
+        m,
+        info={
+            **counts,
+            "checksum_errors": parser.checksum_errors,
+            "hex": parser.hex_messages,
+        },
+    )
+
+
+@pytest.mark.parametrize("engine", ["threads", "selector"])
+@pytest.mark.parametrize(
+    "kind,noise", [("mppt", "clean"), ("mppt", "noisy"), ("shunt", "noisy")]
+)
+def test_reader_throughput(bench, pty_port, engine, kind, noise):
+    sim = _sim(kind, noise)
+    reader = _Reader(engine, pty_port.name)
+    try:
+        _warm_up(pty_port, reader, sim)
+        blocks = list(sim.blocks(bench.n(FLOOD_BLOCKS)))
+        counts = count_valid(blocks)
+        ok0, err0, hex0 = reader.counters()
+
+        feeder = Feeder(pty_port, blocks)
+        with bench.measure() as m:
+            feeder.start()
+            done = _wait(lambda: reader.parser.frames_ok - ok0 >= counts["valid"])
+        assert (
+            done
+        ), f"only {reader.parser.frames_ok - ok0}/{counts['valid']} frames arrived"
+        feeder.join()
+
+        ok, err, hexes = reader.counters()
+        assert ok - ok0 == counts["valid"]
+        assert err - err0 == counts["corrupt"]
+        bench.record(
+            f"{engine}-{kind}-{noise}",
+            {
+                "frames_per_s": (ok - ok0) / m.wall_s,
+                "cpu_us_per_frame": m.cpu_s / (ok - ok0) * 1e6,
+            },
+            m,
+            info={**counts, "hex": hexes - hex0},
+        )
+    finally:
+        reader.stop()
+
+
+@pytest.mark.parametrize("engine", ["threads", "selector"])
+def test_reader_latency(bench, pty_port, engine):
+    sim = _sim("mppt", "clean")
+    sim.hex_rate = NOISE["noisy"]["hex_rate"]  # HEX noise does not drop frames
+    reader = _Reader(engine, pty_port.name)
+    try:
+        _warm_up(pty_port, reader, sim)
+
+        merged: List[float] = []
+        merge = reader.merger.merge
+
+        def timed_merge(frame):
+            merge(frame)
+            merged.append(time.perf_counter())
+
+        # instance attribute shadows the method the reader calls
+        reader.merger.merge = timed_merge
+
+        blocks = list(sim.blocks(bench.n(LATENCY_BLOCKS)))
+        feeder = Feeder(pty_port, blocks, interval=LATENCY_INTERVAL)
+        with bench.measure() as m:
+            feeder.start()
+            assert _wait(
+                lambda: len(merged) >= len(blocks)
+            ), f"{len(merged)}/{len(blocks)} frames"
+            feeder.join()
+
+        latencies = [
+            (t_merged - t_written) * 1e6
+            for t_written, t_merged in zip(feeder.write_times, merged)
+        ]
+        bench.record(
+            engine,
+            {
+                "latency_us_mean": sum(latencies) / len(latencies),
+                "latency_us_p50": percentile(latencies, 0.5),
+                "latency_us_p99": percentile(latencies, 0.99),
+                "latency_us_max": max(latencies),
+                "cpu_us_per_frame": m.cpu_s / len(merged) * 1e6,
+            },
+            m,
+            info={"frames": len(merged), "interval_s": LATENCY_INTERVAL},
+        )
+    finally:
+        reader.stop()
+
+
+@pytest.mark.parametrize("kind", ["mppt", "shunt"])
+def test_probe(bench, pty_port, kind):
+    sim = _sim(kind, "noisy")
+    feeder = Feeder(
+        pty_port, list(sim.blocks(50)), interval=PROBE_BLOCK_INTERVAL, loop=True
+    )
+    feeder.start()
+    durations: List[float] = []
+    try:
+        with bench.measure() as m:
+            for _ in range(bench.n(PROBE_RUNS)):
+                t0 = time.perf_counter()
+                sample = _read_probe_frame(pty_port.name)
+                durations.append(time.perf_counter() - t0)
+                assert device._is_conclusive(sample), sample
+    finally:
+        feeder.stop()
+        feeder.join()
+
+    bench.record(
+        kind,
+        {
+            "probe_s_mean": sum(durations) / len(durations),
+            "probe_s_max": max(durations),
+            "probe_blocks_mean": sum(durations) / len(durations) / PROBE_BLOCK_INTERVAL,
+        },
+        m,
+        info={"runs": len(durations), "block_interval_s": PROBE_BLOCK_INTERVAL},
+    )
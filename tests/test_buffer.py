@@ -0,0 +1,396 @@
+# test_buffer.py
+# ------------------------------------------------------------
+# Persistent telemetry buffer (module/buffer.py): the segmented log
+# (append, rotation, sealing, restart, legacy migration) and paged reads
+# with the persisted upload cursor, what an upload run sends (413 halving,
+# quarantine of rejected pages), and retention (rollups before eviction).
+# ------------------------------------------------------------
+
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import pytest
+
+import module.buffer as buffer_mod
+from module.buffer import FileBuffer
+
+# recent enough not to hit the age budget
+T0 = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=1)
+
+
+def _entries(n: int, start: int = 0, step: int = 30) -> List[Dict]:
+    return [
+        {
+            "timestamp": (T0 + timedelta(seconds=step * i)).isoformat(),
+            "charger": {"V": 12800 + i, "I": 1500},
+        }
+        for i in range(start, start + n)
+    ]
+
+
+def _drain(buf: FileBuffer) -> List[Dict]:
+    """Read and acknowledge every page (what a successful upload run does)."""
+    out: List[Dict] = []
+    while True:
+        start, entries, end = buf.seal_page()
+        if not entries:
+            if end != start:
+                buf.ack_page(start, end)
+            return out
+        out.extend(entries)
+        assert buf.ack_page(start, end)
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    monkeypatch.setattr(buffer_mod, "FSYNC_ON_FLUSH", False)
+    monkeypatch.setattr(buffer_mod, "FLUSH_EVERY_ENTRIES", 1)
+    monkeypatch.setattr(buffer_mod, "SEGMENT_MAX_ENTRIES", 5)
+    monkeypatch.setattr(buffer_mod, "PAGE_MAX_ENTRIES", 5)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "temporary_device_data.json")
+
+
+# --------------------
+# Segmented log
+# --------------------
+def test_append_rotates_and_seals(path):
+    buf = FileBuffer(path)
+    entries = _entries(12)
+    for e in entries:
+        buf.append(e)
+    names = sorted(os.listdir(buf.dir))
+    assert "seg-00000001.jsonl.gz" in names and "seg-00000002.jsonl.gz" in names
+    assert "seg-00000003.jsonl" in names  # active segment, 2 entries
+    assert buf.stats()["pending_entries"] == 12
+    assert _drain(buf) == entries
+    assert buf.stats()["pending_entries"] == 0
+
+
+def test_restart_keeps_entries_and_appends_after_them(path, monkeypatch):
+    monkeypatch.setattr(buffer_mod, "FLUSH_EVERY_ENTRIES", 3)
+    buf = FileBuffer(path)
+    entries = _entries(7)
+    for e in entries:
+        buf.append(e)
+    buf.flush()  # what atexit does on shutdown
+
+    restarted = FileBuffer(path)
+    restarted.append(_entries(1, start=7)[0])
+    restarted.flush()
+    assert _drain(restarted) == entries + _entries(1, start=7)
+
+
+def test_torn_last_line_is_dropped_on_restart(path):
+    buf = FileBuffer(path)
+    entries = _entries(3)
+    for e in entries:
+        buf.append(e)
+    with open(buf._plain_path(buf._active_seq), "ab") as f:
+        f.write(b'{"timestamp":"2025-06-01T12:')  # power cut mid-write
+
+    restarted = FileBuffer(path)
+    restarted.append(_entries(1, start=3)[0])
+    restarted.flush()
+    assert _drain(restarted) == entries + _entries(1, start=3)
+
+
+def test_legacy_buffer_is_migrated_once(path):
+    legacy = _entries(8)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+
+    buf = FileBuffer(path)
+    assert not os.path.exists(path)
+    assert buf.stats()["pending_entries"] == 8
+    buf.append(_entries(1, start=8)[0])
+    assert _drain(buf) == legacy + _entries(1, start=8)
+
+
+def test_stats_does_not_read_sealed_segments(path, monkeypatch):
+    buf = FileBuffer(path)
+    for e in _entries(12):
+        buf.append(e)
+    start, entries, end = buf.seal_page(max_entries=3)
+    assert buf.ack_page(start, end)
+
+    def no_reads(seq):
+        raise AssertionError(f"segment {seq} read by stats()")
+
+    monkeypatch.setattr(buf, "_open_segment", no_reads)
+    assert buf.stats() == {
+        "pending_entries": 9,
+        "segments": 3,
+        "bytes": sum(os.path.getsize(buf._segment_path(s)) for s in buf._segments()),
+    }
+
+
+def test_line_counts_are_recorded_on_start(path):
+    buf = FileBuffer(path)
+    for e in _entries(12):
+        buf.append(e)
+    with open(buf._state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["lines"] == {"1": 5, "2": 5}
+    del state["lines"]  # state.json of an older version
+    with open(buf._state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+    restarted = FileBuffer(path)
+    assert restarted._load_state()["lines"] == {"1": 5, "2": 5}
+    assert restarted.stats()["pending_entries"] == 12
+
+
+# --------------------
+# Paging / cursor
+# --------------------
+def test_pages_are_bounded(path, monkeypatch):
+    monkeypatch.setattr(buffer_mod, "SEGMENT_MAX_ENTRIES", 50)
+    monkeypatch.setattr(buffer_mod, "PAGE_MAX_BYTES", 400)
+    buf = FileBuffer(path)
+    for e in _entries(20):
+        buf.append(e)
+    sizes = []
+    while True:
+        start, entries, end = buf.seal_page()
+        if not entries:
+            break
+        assert len(entries) <= 5
+        assert sum(len(buffer_mod._encode_line(e)) for e in entries) <= 400
+        sizes.append(len(entries))
+        buf.ack_page(start, end)
+    assert sum(sizes) == 20
+
+
+def test_cursor_survives_restart_mid_page(path):
+    buf = FileBuffer(path)
+    entries = _entries(12)
+    for e in entries:
+        buf.append(e)
+    start, first, end = buf.seal_page()
+    assert buf.ack_page(start, end)
+    start, second, end = buf.seal_page()  # sent, but the process dies before the ack
+
+    restarted = FileBuffer(path)
+    resent_start, resent, resent_end = restarted.seal_page()
+    assert (resent_start, resent, resent_end) == (start, second, end)
+    assert restarted.ack_page(resent_start, resent_end)
+    assert first + second + _drain(restarted) == entries
+
+
+def test_stale_ack_is_ignored(path):
+    buf = FileBuffer(path)
+    for e in _entries(8):
+        buf.append(e)
+    start, _, end = buf.seal_page()
+    assert buf.ack_page(start, end)
+    assert not buf.ack_page(start, end)  # duplicate ack must not skip a page
+    assert len(_drain(buf)) == 3
+
+
+def test_corrupt_line_is_skipped(path):
+    buf = FileBuffer(path)
+    entries = _entries(3)
+    buf.append(entries[0])
+    with open(buf._plain_path(buf._active_seq), "ab") as f:
+        f.write(b"not json\n")
+    buf._active_entries += 1
+    buf.append(entries[1])
+    buf.append(entries[2])
+    assert _drain(buf) == entries
+
+
+# --------------------
+# Upload
+# --------------------
+class _Response:
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+
+
+class _RecordingConnector:
+    """Stands in for ApiGatewayConnector: keeps the payloads it accepts.
+    status(entries) picks the answer per request (default: always 200).
+    """
+
+    def __init__(self, status=lambda entries: 200):
+        self.status = status
+        self.payloads: List[Dict] = []
+        self.requests = 0
+
+    def _post(self, data, payload_parent_keys) -> _Response:
+        self.requests += 1
+        status = self.status(data)
+        if status == 200:
+            self.payloads.append({**payload_parent_keys, "data": data})
+        return _Response(status)
+
+    def post_dict(
+        self, endpoint, data, payload_parent_keys={}, timeout=None, compress=False
+    ):
+        return self._post(data, payload_parent_keys)
+
+    def post_gzip_data(self, endpoint, data_gz, payload_parent_keys={}, timeout=None):
+        return self._post(json.loads(gzip.decompress(data_gz)), payload_parent_keys)
+
+    def entries(self) -> List[Dict]:
+        return [e for p in self.payloads for e in p["data"]]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_upload_sends_units(path, monkeypatch, compress):
+    connector = _RecordingConnector()
+    monkeypatch.setattr(buffer_mod, "get_connector", lambda url, key: connector)
+    monkeypatch.setattr(buffer_mod, "UPLOAD_GZIP", compress)
+    buf = FileBuffer(path)
+    entries = _entries(7)
+    for e in entries:
+        buf.append(e)
+
+    assert buf.upload_and_clear()
+    assert connector.entries() == entries
+    for payload in connector.payloads:
+        assert payload["units"]["V"] == "mV" and payload["units"]["I"] == "mA"
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_too_large_page_is_halved(path, monkeypatch, compress):
+    connector = _RecordingConnector(lambda entries: 413 if len(entries) > 2 else 200)
+    monkeypatch.setattr(buffer_mod, "get_connector", lambda url, key: connector)
+    monkeypatch.setattr(buffer_mod, "UPLOAD_GZIP", compress)
+    monkeypatch.setattr(buffer_mod, "UPLOAD_MAX_PAGES_PER_RUN", 100)
+    buf = FileBuffer(path)
+    entries = _entries(12)
+    for e in entries:
+        buf.append(e)
+
+    assert buf.upload_and_clear()
+    assert connector.entries() == entries
+    assert all(len(p["data"]) <= 2 for p in connector.payloads)
+
+
+def test_rejected_page_is_quarantined(path, monkeypatch):
+    def status(entries):
+        return 400 if any(e["charger"]["V"] == 12803 for e in entries) else 200
+
+    connector = _RecordingConnector(status)
+    monkeypatch.setattr(buffer_mod, "get_connector", lambda url, key: connector)
+    buf = FileBuffer(path)
+    entries = _entries(12)
+    for e in entries:
+        buf.append(e)
+
+    for _ in range(buffer_mod.UPLOAD_REJECT_MAX_RUNS - 1):
+        assert not buf.upload_and_clear()  # retried: may be a passing backend bug
+    assert connector.entries() == []
+    assert buf.upload_and_clear()
+    assert connector.entries() == entries[5:]  # the page with the bad entry is skipped
+    with open(os.path.join(buf.dir, buffer_mod.DEAD_LETTER_NAME)) as f:
+        quarantined = [json.loads(line) for line in f]
+    assert [q["entry"] for q in quarantined] == entries[:5]
+    assert {q["status"] for q in quarantined} == {400}
+
+
+def test_auth_errors_are_never_quarantined(path, monkeypatch):
+    connector = _RecordingConnector(lambda entries: 403)
+    monkeypatch.setattr(buffer_mod, "get_connector", lambda url, key: connector)
+    buf = FileBuffer(path)
+    for e in _entries(3):
+        buf.append(e)
+    for _ in range(buffer_mod.UPLOAD_REJECT_MAX_RUNS + 1):
+        assert not buf.upload_and_clear()
+    assert buf.stats()["pending_entries"] == 3
+    assert not os.path.exists(os.path.join(buf.dir, buffer_mod.DEAD_LETTER_NAME))
+
+
+# --------------------
+# Retention
+# --------------------
+def _covered(entries: List[Dict]) -> int:
+    """Number of original entries behind a list of (possibly rolled-up) entries."""
+    return sum(e.get("rollup", {}).get("entries", 1) for e in entries)
+
+
+@pytest.fixture
+def backlog(path, monkeypatch):
+    """A buffer with 8 sealed segments of 20 entries (10 minutes each)."""
+    monkeypatch.setattr(buffer_mod, "SEGMENT_MAX_ENTRIES", 20)
+    monkeypatch.setattr(buffer_mod, "PAGE_MAX_ENTRIES", 20)
+    monkeypatch.setattr(buffer_mod, "COMPACT_MAX_PER_PASS", 100)
+    buf = FileBuffer(path)
+    for i, e in enumerate(_entries(161)):
+        e["charger"]["stats"] = {
+            "window_s": 30.0,
+            "frames": 30,
+            "V": {"n": 30, "min": 12790, "max": 12810, "mean": 12800.0 + i, "last": i},
+        }
+        buf.append(e)
+    return buf
+
+
+def test_retention_rolls_up_before_evicting(backlog, monkeypatch, caplog):
+    total = backlog.stats()["bytes"]
+    monkeypatch.setattr(buffer_mod, "BUFFER_MAX_BYTES", int(total * 0.9))
+    backlog.enforce_retention()
+
+    assert "Retention (" not in caplog.text  # nothing evicted
+    assert backlog.stats()["bytes"] <= 0.8 * 0.9 * total
+    pending = backlog.stats()["pending_entries"]
+    drained = _drain(backlog)
+    assert pending == len(drained)  # counts of compacted segments are updated
+    assert _covered(drained) == 161
+    assert "rollup" in drained[0] and "rollup" not in drained[-1]
+    assert drained[0]["charger"]["stats"]["frames"] > 30
+
+
+def test_retention_evicts_oldest_when_rollups_are_not_enough(
+    backlog, monkeypatch, caplog
+):
+    monkeypatch.setattr(buffer_mod, "BUFFER_MAX_BYTES", 1500)
+    backlog.enforce_retention()
+
+    compacted = caplog.text.index("compacted segment 1 ")
+    assert compacted < caplog.text.index("Retention (size): dropped segment 1 ")
+    assert backlog.stats()["bytes"] <= 1500
+    drained = _drain(backlog)
+    assert 0 < _covered(drained) < 161
+    assert drained[-1]["timestamp"] == _entries(1, start=160)[0]["timestamp"]
+
+
+def test_retention_evicts_by_age(path, monkeypatch, caplog):
+    buf = FileBuffer(path)
+    for e in _entries(12):
+        buf.append(e)
+    monkeypatch.setattr(buffer_mod, "BUFFER_MAX_AGE_SECONDS", 6 * 3600)
+    buf.enforce_retention()
+
+    assert "Retention (age): dropped segment 1 " in caplog.text
+    assert buf.stats()["pending_entries"] == 2  # only the active segment is kept
+
+
+def test_only_clean_segments_are_spliced(path, monkeypatch):
+    connector = _RecordingConnector()
+    monkeypatch.setattr(buffer_mod, "get_connector", lambda url, key: connector)
+    monkeypatch.setattr(buffer_mod, "UPLOAD_GZIP", True)
+    buf = FileBuffer(path)
+    entries = _entries(12)
+    for e in entries[:2]:
+        buf.append(e)
+    with open(buf._plain_path(buf._active_seq), "ab") as f:
+        f.write(b'{"timestamp": 1, "x": \n')  # corrupt line inside segment 1
+    buf._active_entries += 1
+    for e in entries[2:]:
+        buf.append(e)
+
+    state = buf._load_state()
+    assert 1 not in state["clean"] and 2 in state["clean"]
+    assert buf.seal_segment_page() is None  # segment 1: paged, not spliced
+
+    assert buf.upload_and_clear()
+    assert connector.entries() == entries
@@ -0,0 +1,165 @@
+# test_config.py
+# ------------------------------------------------------------
+# Remote device config (module/config.py) against the API Gateway stub:
+# background fetch, disk cache, ETag revalidation, network-down startup,
+# invalid values, and main.apply_config rescheduling jobs live.
+# ------------------------------------------------------------
+
+import json
+import time
+
+import pytest
+import schedule
+
+import main as station
+import module.config as config_mod
+from module.config import AppConfig
+from stub_apigateway import StubApiGateway
+
+STATION_CONFIG = """
+[station]
+aggregate_seconds = 10
+upload_seconds = 120
+freshness_seconds = 90
+capture_time = "06:30"
+"""
+
+
+@pytest.fixture
+def stub():
+    stub = StubApiGateway(device_config=STATION_CONFIG).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def env(stub, monkeypatch):
+    monkeypatch.setenv("API_GATEWAY_MILJOSTASJON_URL", stub.url)
+    monkeypatch.setenv("API_GATEWAY_MILJOSTASJON_KEY", "test")
+    monkeypatch.setenv("DEVICE_ID", "test-station")
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "device_config.json")
+
+
+def _wait(predicate, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_fetch_in_background_and_cache(env, stub, cache_path):
+    config = AppConfig(cache_path)
+    assert (
+        config.version == 0 and config.config == {}
+    )  # nothing cached, nothing fetched
+    config.start()
+    try:
+        assert _wait(lambda: config.version == 1)
+    finally:
+        config.stop()
+    assert config.get("station", "aggregate_seconds", 30) == 10
+    with open(cache_path) as f:
+        cached = json.load(f)
+    assert cached["config"] == STATION_CONFIG and cached["etag"] == stub.device_etag()
+
+    # restart: the cache is there at once, and still fresh, so no request
+    requests_before = stub.stats()["statuses"]["device"]
+    restarted = AppConfig(cache_path)
+    assert restarted.version == 1
+    assert restarted.get("station", "capture_time", "07:25") == "06:30"
+    restarted.start()
+    time.sleep(0.2)
+    restarted.stop()
+    assert stub.stats()["statuses"]["device"] == requests_before
+
+
+def test_revalidation_with_etag(env, stub, cache_path):
+    config = AppConfig(cache_path)
+    assert config.fetch() and config.version == 1
+    assert config.fetch() and config.version == 1  # 304
+    assert stub.stats()["statuses"]["device"] == {"200": 1, "304": 1}
+
+    stub.device_config = STATION_CONFIG.replace(
+        "aggregate_seconds = 10", "aggregate_seconds = 20"
+    )
+    assert config.fetch() and config.version == 2
+    assert config.get("station", "aggregate_seconds", 30) == 20
+
+
+def test_network_down_keeps_cache(stub, cache_path, monkeypatch):
+    monkeypatch.setenv("API_GATEWAY_MILJOSTASJON_URL", stub.url)
+    monkeypatch.setenv("DEVICE_ID", "test-station")
+    good = AppConfig(cache_path)
+    assert good.fetch()
+
+    stub.faults.update(outage="drop")
+    monkeypatch.setattr(
+        config_mod, "CONFIG_TTL_SECONDS", 0
+    )  # cache is stale, fetch at once
+    monkeypatch.setattr(config_mod, "CONFIG_FETCH_TIMEOUT", (1, 1))
+    start = time.monotonic()
+    config = AppConfig(cache_path)
+    config.start()
+    assert time.monotonic() - start < 0.5  # never waits on the network
+    assert not config.fetch()
+    config.stop()
+    assert config.version == 1
+    assert config.get("station", "upload_seconds", 300) == 120
+
+
+def test_invalid_values_fall_back(env, stub, cache_path):
+    stub.device_config = """
+[station]
+aggregate_seconds = 0
+upload_seconds = "often"
+freshness_seconds = 90.5
+capture_time = "25:00"
+"""
+    config = AppConfig(cache_path)
+    assert config.fetch()
+    assert config.get("station", "aggregate_seconds", 30, minimum=5) == 30
+    assert config.get("station", "upload_seconds", 300) == 300
+    assert config.get("station", "freshness_seconds", 120) == 120
+    assert config.get("station", "freshness_seconds", 120.0) == 90.5
+    assert (
+        config.get("station", "capture_time", "07:25", check=station._is_hhmm)
+        == "07:25"
+    )
+    assert config.get("missing", "key", 1) == 1
+
+    stub.device_config = "[station\nbroken"
+    assert not config.fetch()  # unparsable: keep the last good config
+    assert config.get("station", "freshness_seconds", 120.0) == 90.5
+
+
+def test_apply_config_reschedules_live(env, stub, cache_path, monkeypatch):
+    monkeypatch.setattr(station, "_jobs", {})
+    monkeypatch.setattr(station, "freshness_seconds", station.FRESHNESS_SECONDS)
+    jobs_before = list(schedule.jobs)
+    config = AppConfig(cache_path)
+    try:
+        station.apply_config(config)  # built-in defaults
+        assert station._jobs["aggregate"][1].interval == station.AGGREGATE_SECONDS
+        upload_job = station._jobs["upload"][1]
+
+        assert config.fetch()
+        station.apply_config(config)
+        assert station._jobs["aggregate"][1].interval == 10
+        assert station._jobs["upload"][1].interval == 120
+        assert station._jobs["webcam"][1].at_time.strftime("%H:%M") == "06:30"
+        assert station.freshness_seconds == 90
+        assert upload_job not in schedule.jobs  # replaced, not duplicated
+        assert len(schedule.jobs) == len(jobs_before) + 3
+
+        aggregate_job = station._jobs["aggregate"][1]
+        station.apply_config(config)  # unchanged settings keep their jobs
+        assert station._jobs["aggregate"][1] is aggregate_job
+    finally:
+        for _, job in station._jobs.values():
+            schedule.cancel_job(job)
@@ -0,0 +1,77 @@
+# test_encoding.py
+# ------------------------------------------------------------
+# Compact power payload (module/encoding.py): encode_power_batch followed by
+# a JSON round trip and decode_power_batch gives back the exact entries.
+# ------------------------------------------------------------
+
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import pytest
+
+from module.encoding import FORMAT_COLUMNAR, decode_power_batch, encode_power_batch
+
+T0 = datetime(2025, 6, 1, 12, 0, tzinfo=timezone(timedelta(hours=2)))
+
+
+def _roundtrip(entries: List[Dict]) -> List[Dict]:
+    payload = json.loads(json.dumps(encode_power_batch(entries)))
+    return decode_power_batch(payload)
+
+
+def _entries(n: int) -> List[Dict]:
+    out = []
+    for i in range(n):
+        out.append(
+            {
+                "timestamp": (T0 + timedelta(seconds=30 * i)).isoformat(),
+                "charger": {
+                    "PID": "0xA057",
+                    "SER#": "HQ2211ABCDE",
+                    "V": 13250 + (i // 3) * 10,
+                    "PPV": None if i == 4 else 20 + i,
+                    "stats": {"frames": 30, "V": {"n": 30, "mean": 13250.5}},
+                },
+                "loadlogger": {"V": 12800, "SOC": 995 - i},
+            }
+        )
+    return out
+
+
+def test_roundtrip_is_exact():
+    entries = _entries(10)
+    payload = encode_power_batch(entries)
+    assert payload["format"] == FORMAT_COLUMNAR and payload["count"] == 10
+    assert payload["roles"]["charger"]["static"]["PID"] == "0xA057"
+    assert _roundtrip(entries) == entries
+
+
+def test_roundtrip_with_gaps_and_odd_timestamps():
+    entries = _entries(6)
+    del entries[1]["loadlogger"]  # role missing from some rows
+    del entries[2]["charger"]["V"]  # key absent mid-column
+    entries[3]["motion"] = 3  # scalar top-level key
+    entries[4]["timestamp"] = (
+        (T0 + timedelta(hours=3)).astimezone(timezone.utc).isoformat()
+    )  # UTC offset change
+    assert _roundtrip(entries) == entries
+
+    entries[5]["timestamp"] = "not a timestamp"  # falls back to a raw column
+    assert _roundtrip(entries) == entries
+
+
+@pytest.mark.parametrize("first", ["dict", "scalar"])
+def test_roundtrip_key_mixing_dict_and_scalar(first):
+    entries = _entries(4)
+    value = {"counts": {"events": 1}}
+    for i, e in enumerate(entries):
+        is_dict = (i % 2 == 0) == (first == "dict")
+        e["motion"] = value if is_dict else None
+    assert _roundtrip(entries) == entries
+
+
+def test_empty_batch_and_unknown_format():
+    assert _roundtrip([]) == []
+    with pytest.raises(ValueError):
+        decode_power_batch({"format": "entries"})
@@ -0,0 +1,116 @@
+# test_hotplug.py
+# ------------------------------------------------------------
+# Hotplug of serial adapters (module/hotplug.py): the port list is polled
+# even when the udev monitor starts but never delivers an event (as in the
+# container), and udev events are not handled twice by the poll.
+# ------------------------------------------------------------
+
+import threading
+import time
+from typing import Dict, List
+
+import pytest
+
+import module.hotplug as hotplug
+from module.hotplug import HotplugMonitor
+
+
+class _Manager:
+    """Stands in for ReaderManager."""
+
+    def __init__(self):
+        self.devices: Dict[str, Dict[str, str]] = {}
+        self.removed: List[str] = []
+        self.changed = threading.Event()
+
+    def has_port(self, port: str) -> bool:
+        return port in self.devices
+
+    def add_device(self, port: str, sample: Dict[str, str]) -> None:
+        self.devices[port] = sample
+        self.changed.set()
+
+    def remove_port(self, port: str) -> None:
+        if self.devices.pop(port, None) is not None:
+            self.removed.append(port)
+            self.changed.set()
+
+
+class _SilentMonitor:
+    """A netlink monitor that starts fine and never sees an event."""
+
+    def filter_by(self, subsystem):
+        pass
+
+    def start(self):
+        pass
+
+    def poll(self, timeout=None):
+        time.sleep(timeout or 0)
+        return None
+
+
+@pytest.fixture
+def ports(tmp_path, monkeypatch):
+    present: List[str] = []
+    probes: List[str] = []
+    listed = threading.Event()
+
+    def list_ports():
+        listed.set()
+        return sorted(present)
+
+    def probe(port):
+        probes.append(port)
+        return {"PID": "0xA057", "SER#": "HQ1"}
+
+    monkeypatch.setattr(hotplug, "list_serial_ports", list_ports)
+    monkeypatch.setattr(hotplug, "probe_port", probe)
+    monkeypatch.setattr(hotplug, "HOTPLUG_SETTLE_SECONDS", 0)
+    monkeypatch.setattr(hotplug, "HOTPLUG_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(
+        hotplug.pyudev.Monitor,
+        "from_netlink",
+        staticmethod(lambda ctx: _SilentMonitor()),
+    )
+    monkeypatch.setattr(hotplug, "TTY_PREFIXES", (str(tmp_path),))
+    node = tmp_path / "ttyUSB0"
+    node.touch()
+    return present, probes, str(node), listed
+
+
+def _wait(event: threading.Event) -> bool:
+    ok = event.wait(5)
+    event.clear()
+    return ok
+
+
+def test_poll_finds_ports_udev_never_reports(ports, caplog):
+    present, probes, node, listed = ports
+    manager = _Manager()
+    monitor = HotplugMonitor(manager)
+    monitor.start()
+    try:
+        assert listed.wait(5)  # startup snapshot taken without the node
+        present.append(node)
+        assert _wait(manager.changed) and manager.has_port(node)
+        present.remove(node)
+        assert _wait(manager.changed) and manager.removed == [node]
+    finally:
+        monitor.stop()
+        monitor.join(5)
+    assert probes == [node]
+    assert "udev did not report" in caplog.text
+
+
+def test_udev_event_is_not_repeated_by_the_poll(ports, caplog):
+    present, probes, node, _ = ports
+    manager = _Manager()
+    monitor = HotplugMonitor(manager)
+    present.append(node)
+    device = type("Device", (), {"device_node": node, "action": "add"})()
+    monitor._udev_event(device)
+    assert _wait(manager.changed) and manager.has_port(node)
+    monitor._poll(udev=True)
+    assert probes == [node]
+    assert "udev did not report" not in caplog.text
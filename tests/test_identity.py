@@ -0,0 +1,173 @@
+# test_identity.py
+# ------------------------------------------------------------
+# ReaderManager and the device identity cache (module/device.py): hot-plugged
+# devices re-classify the running readers in place, cache entries follow the
+# /dev/serial/by-id link when the tty is renumbered, stale entries are
+# ignored, and verify_identities re-classifies ports whose device differs
+# from the cache and forgets ports that stay silent.
+# Serial ports are plain files and by-id links symlinks under tmp_path;
+# readers are replaced by a fake that only owns a FrameMerger.
+# ------------------------------------------------------------
+
+import json
+from typing import Dict, List
+
+import pytest
+
+import module.device as device
+from module.device import (
+    FrameMerger,
+    ReaderManager,
+    cached_devices,
+    load_identity_cache,
+    save_identity_cache,
+)
+
+CHARGER_1 = {"PID": "0xA057", "SER#": "HQ1", "FW": "161"}
+CHARGER_2 = {"PID": "0xA057", "SER#": "HQ2", "FW": "161"}
+CHARGER_3 = {"PID": "0xA057", "SER#": "HQ3", "FW": "161"}
+
+
+class _Reader:
+    """Stands in for ReaderThread: no serial port, frames are merged by the test."""
+
+    def __init__(self, role, port, latest_frames, window_stats, capture, on_ready):
+        self.role = role
+        self.port = port
+        self.capture = None
+        self.logger = None
+        self.merger = FrameMerger(role, latest_frames, window_stats)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def tty(tmp_path, monkeypatch):
+    """Fake /dev: make(name) creates a tty node, link(name, node) a by-id link."""
+    by_id = tmp_path / "by-id"
+    by_id.mkdir()
+    present: List[str] = []
+
+    def make(name: str) -> str:
+        node = tmp_path / name
+        node.touch()
+        present.append(str(node))
+        return str(node)
+
+    def link(name: str, node: str) -> str:
+        path = by_id / name
+        if path.is_symlink():
+            path.unlink()
+        path.symlink_to(node)
+        return str(path)
+
+    monkeypatch.setattr(device, "SERIAL_BY_ID_DIR", str(by_id))
+    monkeypatch.setattr(device, "IDENTITY_CACHE_PATH", str(tmp_path / "identity.json"))
+    monkeypatch.setattr(device, "list_serial_ports", lambda: sorted(present))
+    monkeypatch.setattr(device, "ReaderThread", _Reader)
+    return make, link, present
+
+
+def _cache() -> Dict[str, Dict]:
+    with open(device.IDENTITY_CACHE_PATH) as f:
+        return json.load(f)
+
+
+def test_renumbered_port_keeps_its_cached_identity(tty):
+    make, link, present = tty
+    usb0 = make("ttyUSB0")
+    by_id = link("usb-VictronEnergy_VE_Direct_cable_HQ1-if00-port0", usb0)
+    save_identity_cache({usb0: CHARGER_1}, {usb0: "charger"})
+    assert list(_cache()) == [by_id]
+
+    # reboot: same adapter, now ttyUSB1
+    present.clear()
+    usb1 = make("ttyUSB1")
+    link("usb-VictronEnergy_VE_Direct_cable_HQ1-if00-port0", usb1)
+    known, unknown, silent = cached_devices()
+    assert known == [(usb1, CHARGER_1)]
+    assert unknown == [] and silent == []
+
+    manager = ReaderManager({})
+    assert manager.start(known) == [("charger", usb1)]
+    assert list(_cache()) == [by_id]  # still one entry, under the by-id link
+
+
+def test_stale_cache_entries_are_ignored_and_kept(tty, tmp_path):
+    make, link, present = tty
+    gone = str(tmp_path / "by-id" / "usb-FTDI_unplugged-if00-port0")
+    save_identity_cache({gone: CHARGER_2}, {gone: "charger_2"})
+    usb0 = make("ttyUSB0")
+
+    known, unknown, silent = cached_devices()
+    assert known == [] and unknown == [usb0] and silent == []
+
+    save_identity_cache({usb0: CHARGER_1}, {usb0: "charger"})
+    assert set(_cache()) == {gone, usb0}  # absent devices are not dropped
+
+
+def test_unreadable_cache_is_empty(tty):
+    with open(device.IDENTITY_CACHE_PATH, "w") as f:
+        f.write("{not json")
+    assert load_identity_cache() == {}
+    make, _, _ = tty
+    usb0 = make("ttyUSB0")
+    assert cached_devices() == ([], [usb0], [])
+
+
+def test_failed_identity_check_reclassifies(tty):
+    make, link, _ = tty
+    usb0, usb1 = make("ttyUSB0"), make("ttyUSB1")
+    latest: Dict[str, FrameMerger] = {}
+    manager = ReaderManager(latest)
+    # the cache says HQ1 on ttyUSB0, but HQ3 is plugged in there now
+    manager.start([(usb0, CHARGER_1), (usb1, CHARGER_2)])
+    assert manager.roles == {usb0: "charger", usb1: "charger_2"}
+    manager.readers[usb0].merger.merge(dict(CHARGER_3, V="12800"))
+    manager.readers[usb1].merger.merge(dict(CHARGER_2, V="12800"))
+
+    manager._verify([usb0, usb1], timeout=5)
+
+    assert manager.roles == {usb0: "charger_2", usb1: "charger"}
+    assert manager.devices[usb0]["SER#"] == "HQ3"
+    assert latest["charger"] is manager.readers[usb1].merger
+    assert latest["charger_2"].snapshot().to_dict()["SER#"] == "HQ3"
+    assert _cache()[usb0] == {"identity": CHARGER_3, "role": "charger_2"}
+
+
+def test_silent_port_is_dropped_from_the_cache(tty):
+    make, _, _ = tty
+    usb0, usb1 = make("ttyUSB0"), make("ttyUSB1")
+    manager = ReaderManager({})
+    manager.start([(usb0, CHARGER_1), (usb1, CHARGER_2)])
+    manager.readers[usb1].merger.merge(dict(CHARGER_2))
+
+    manager._verify([usb0, usb1], timeout=0.5)
+
+    assert set(_cache()) == {usb1}
+    assert cached_devices() == ([(usb1, CHARGER_2)], [usb0], [])
+
+
+def test_hotplugged_device_renames_running_readers(tty):
+    make, _, _ = tty
+    usb0, usb1 = make("ttyUSB0"), make("ttyUSB1")
+    latest: Dict[str, FrameMerger] = {}
+    manager = ReaderManager(latest, persist=False)
+    manager.start([(usb0, CHARGER_2)])
+    first = manager.readers[usb0]
+    first.merger.merge(dict(CHARGER_2, V="12800"))
+
+    manager.add_device(usb1, CHARGER_1)  # lower SER#: takes over "charger"
+
+    assert manager.roles == {usb0: "charger_2", usb1: "charger"}
+    assert manager.readers[usb0] is first and first.role == "charger_2"
+    assert latest["charger_2"].snapshot().to_dict()["SER#"] == "HQ2"
+    assert "charger" not in latest  # the new reader has no frames yet
+
+    manager.remove_port(usb1)
+    assert manager.roles == {usb0: "charger_2"}  # no re-classification
+    assert not manager.has_port(usb1)
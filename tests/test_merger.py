@@ -0,0 +1,100 @@
+# test_merger.py
+# ------------------------------------------------------------
+# Per-key TTL of the merged snapshot (module/device.py FrameMerger): keys not
+# seen for MERGE_KEY_TTL_SECONDS are dropped when a later frame is merged,
+# keys seen again are kept, and unknown labels expire like known ones.
+# Every merged frame counts in the window statistics.
+# Frames are merged on a fake monotonic clock.
+# ------------------------------------------------------------
+
+import pytest
+
+import module.device as device
+from module.device import MERGE_KEY_TTL_SECONDS, FrameMerger
+
+TTL = MERGE_KEY_TTL_SECONDS
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> _Clock:
+    return _Clock()
+
+
+def _merge_at(merger: FrameMerger, clock: _Clock, t: float, frame) -> dict:
+    clock.now = 1000.0 + t
+    merger.merge(frame)
+    return merger.snapshot().to_dict()
+
+
+def test_keys_missing_from_later_frames_expire(clock):
+    merger = FrameMerger("charger", {}, clock=clock)
+    _merge_at(merger, clock, 0, {"V": "12800", "I": "1500", "H22": "12"})
+    _merge_at(merger, clock, TTL / 2, {"V": "12810", "I": "1600"})
+
+    snap = _merge_at(merger, clock, TTL, {"V": "12820"})
+    assert snap == {"V": 12820, "I": 1600, "H22": 12}  # exactly TTL: still kept
+
+    snap = _merge_at(merger, clock, TTL + 1, {"V": "12830"})
+    assert snap == {"V": 12830, "I": 1600}  # H22 last seen at 0
+
+    snap = _merge_at(merger, clock, TTL / 2 + TTL + 1, {"V": "12840"})
+    assert snap == {"V": 12840}  # I last seen at TTL / 2
+
+
+def test_key_seen_again_is_refreshed(clock):
+    merger = FrameMerger("charger", {}, clock=clock)
+    _merge_at(merger, clock, 0, {"V": "12800", "H22": "12"})
+    _merge_at(merger, clock, TTL - 10, {"V": "12800", "H22": "13"})
+
+    snap = _merge_at(merger, clock, TTL + 1, {"V": "12800"})
+    assert snap["H22"] == 13  # the frame at 0 expired, its refresh did not
+
+    snap = _merge_at(merger, clock, 2 * TTL, {"V": "12800"})
+    assert "H22" not in snap
+
+
+def test_unknown_labels_expire(clock):
+    merger = FrameMerger("charger", {}, clock=clock)
+    _merge_at(merger, clock, 0, {"V": "12800", "XYZ": "1", "ABC": "2"})
+    _merge_at(merger, clock, 10, {"V": "12800", "ABC": "3"})
+
+    snap = _merge_at(merger, clock, TTL + 1, {"V": "12800"})
+    assert snap == {"V": 12800, "ABC": "3"}
+    snap = _merge_at(merger, clock, TTL + 11, {"V": "12800"})
+    assert snap == {"V": 12800}
+
+
+def test_no_expiry_without_new_frames(clock):
+    merger = FrameMerger("charger", {}, clock=clock)
+    _merge_at(merger, clock, 0, {"V": "12800", "H22": "12"})
+    clock.now += 10 * TTL
+    snap = merger.snapshot()
+    assert snap.to_dict() == {"V": 12800, "H22": 12}  # staleness shows in age()
+    assert snap.age(clock.now) == 10 * TTL
+
+
+def test_ttl_zero_keeps_every_key(clock, monkeypatch):
+    monkeypatch.setattr(device, "MERGE_KEY_TTL_SECONDS", 0)
+    merger = FrameMerger("charger", {}, clock=clock)
+    _merge_at(merger, clock, 0, {"V": "12800", "H22": "12", "XYZ": "1"})
+    snap = _merge_at(merger, clock, 10 * TTL, {"V": "12810"})
+    assert snap == {"V": 12810, "H22": 12, "XYZ": "1"}
+
+
+def test_every_frame_counts_towards_frames_per_second(clock):
+    merger = FrameMerger("loadlogger", {}, clock=clock)
+    _merge_at(merger, clock, 0, {"PID": "0xA389", "V": "12800", "P": "-20"})
+    _merge_at(merger, clock, 1, {"H1": "-5000", "H17": "120"})  # history block
+    _merge_at(merger, clock, 2, {"PID": "0xA389", "V": "12810", "P": "-22"})
+    clock.now = 1000.0 + 30
+    out = merger.stats.roll()
+    assert out["frames"] == 3
+    assert out["V"]["n"] == 2
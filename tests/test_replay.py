@@ -0,0 +1,184 @@
+# test_replay.py
+# ------------------------------------------------------------
+# Raw serial capture (module/capture.py) and offline replay (main/replay.py)
+# - synthetic captures on a fake clock (rotation, role change, noise)
+#   replayed into entries, checked against what was written;
+# - a ReaderThread capturing a pty-backed port byte for byte;
+# - a truncated capture file (crash mid-write) still replays.
+# ------------------------------------------------------------
+
+import io
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import pytest
+
+from vedirect_sim import PtyPort, VEDirectSimulator, count_valid
+
+import module.capture as capture
+from module.capture import KIND_DATA, KIND_OPEN, RawCapture, capture_files, read_capture
+from module.device import FrameMerger, ReaderThread
+from replay import replay
+
+START = 1_760_000_000.0  # capture wall-clock start
+SECONDS = 600  # one block per second and device
+
+
+class FakeClock:
+    def __init__(self, t: float):
+        self.t = t
+
+    def __call__(self) -> float:
+        return self.t
+
+
+def _capture_device(
+    directory, kind, role, port, seconds=SECONDS, seed=0, noise=True, role_change=None
+):
+    """Capture `seconds` of one simulated device, split into random serial reads."""
+    clock = FakeClock(START)
+    rng = random.Random(seed)
+    sim = VEDirectSimulator(
+        kind,
+        seed=seed,
+        checksum_error_rate=0.05 if noise else 0.0,
+        hex_rate=0.1 if noise else 0.0,
+    )
+    cap = RawCapture(port, role, port_id=port, directory=str(directory), clock=clock)
+    cap.opened()
+    blocks = []
+    for second in range(seconds):
+        if role_change and second == role_change[0]:
+            cap.set_role(role_change[1])
+        raw, ok = sim.next_block()
+        blocks.append((raw, ok))
+        pos = 0
+        while pos < len(raw):
+            n = rng.randint(1, 64)
+            clock.t = START + second + pos / 2000  # ~19200 baud
+            cap.write(raw[pos : pos + n])
+            pos += n
+    cap.close()
+    return blocks
+
+
+@pytest.fixture
+def small_files(monkeypatch):
+    monkeypatch.setattr(capture, "RAW_CAPTURE_FILE_BYTES", 4096)
+    monkeypatch.setattr(capture, "RAW_CAPTURE_FLUSH_SECONDS", 0)
+    monkeypatch.setattr(capture, "RAW_CAPTURE_MAX_FILES", 1000)
+
+
+def _replay(paths, **kwargs):
+    out = io.StringIO()
+    summary = replay([str(p) for p in paths], out, **kwargs)
+    return summary, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_capture_replay_roundtrip(tmp_path, small_files):
+    mppt = _capture_device(tmp_path, "mppt", "charger", "/dev/ttyUSB0", seed=1)
+    shunt = _capture_device(tmp_path, "shunt", "loadlogger", "/dev/ttyUSB1", seed=2)
+
+    groups = capture_files([str(tmp_path)])
+    assert sorted(groups) == ["ttyUSB0", "ttyUSB1"]
+    assert all(len(files) > 1 for files in groups.values())  # rotated
+
+    summary, entries = _replay([tmp_path])
+    for key, blocks in (("ttyUSB0", mppt), ("ttyUSB1", shunt)):
+        counts = count_valid(blocks)
+        port = summary["ports"][key]
+        # the first block only syncs the parser
+        assert port["frames_ok"] + port["checksum_errors"] == counts["blocks"] - 1
+        assert port["frames_ok"] >= counts["valid"] - 1
+        assert port["bytes"] == sum(len(raw) for raw, _ in blocks)
+
+    # one entry per 30 s of capture time, on the capture's clock
+    assert len(entries) == SECONDS // 30 - 1
+    stamps = [datetime.fromisoformat(e["timestamp"]).timestamp() for e in entries]
+    assert stamps == [START + 30 * (i + 1) for i in range(len(entries))]
+    assert all("charger" in e and "loadlogger" in e for e in entries)
+    frames = sum(
+        e["charger"]["stats"]["frames"] for e in entries if "stats" in e["charger"]
+    )
+    assert 0 < frames <= summary["ports"]["ttyUSB0"]["frames_ok"]
+
+    # replay is deterministic
+    assert _replay([tmp_path])[1] == entries
+
+
+def test_replay_follows_role_change(tmp_path, small_files):
+    _capture_device(
+        tmp_path,
+        "mppt",
+        "charger_2",
+        "/dev/ttyUSB0",
+        seconds=120,
+        role_change=(60, "charger"),
+    )
+    summary, entries = _replay([tmp_path])
+    assert summary["ports"]["ttyUSB0"]["role"] == "charger"
+    roles = [[k for k in e if k != "timestamp"] for e in entries]
+    assert roles[0] == ["charger_2"]
+    assert roles[-1] == ["charger"]
+
+
+def test_truncated_capture_replays(tmp_path, small_files, monkeypatch):
+    monkeypatch.setattr(capture, "RAW_CAPTURE_FILE_BYTES", 1 << 20)
+    _capture_device(
+        tmp_path, "mppt", "charger", "/dev/ttyUSB0", seconds=120, noise=False
+    )
+    (path,) = capture_files([str(tmp_path)])["ttyUSB0"]
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) * 2 // 3)
+
+    meta, records = read_capture(path)
+    assert meta["role"] == "charger"
+    assert list(records)  # what is readable is kept
+    summary, entries = _replay([path])
+    assert summary["ports"]["ttyUSB0"]["frames_ok"] > 0
+    assert entries
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_reader_thread_captures_raw_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture, "RAW_CAPTURE_DIR", str(tmp_path))
+    port = PtyPort()
+    latest_frames = {}
+    reader = ReaderThread("charger", port.name, latest_frames, capture=True)
+    reader.start()
+    written = b""
+    try:
+        deadline = time.monotonic() + 5
+        while reader.capture._gz is None and time.monotonic() < deadline:  # port opened
+            time.sleep(0.01)
+        sim = VEDirectSimulator("mppt", seed=3)
+        for raw, _ in sim.blocks(20):
+            port.write(raw)
+            written += raw
+        deadline = time.monotonic() + 10
+        while reader.parser.frames_ok < 19 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert reader.parser.frames_ok == 19  # the first block only syncs the parser
+    finally:
+        reader.stop()
+        reader.join(5)
+        port.close()
+
+    ((path,),) = capture_files([str(tmp_path)]).values()
+    meta, records = read_capture(path)
+    records = list(records)
+    assert meta["role"] == "charger" and meta["port"] == port.name
+    assert records[0][1] == KIND_OPEN
+    assert b"".join(data for _, kind, data in records if kind == KIND_DATA) == written
+    assert isinstance(latest_frames["charger"], FrameMerger)
+
+
+def test_capture_keeps_newest_files(tmp_path, small_files, monkeypatch):
+    monkeypatch.setattr(capture, "RAW_CAPTURE_MAX_FILES", 3)
+    _capture_device(tmp_path, "mppt", "charger", "/dev/ttyUSB0", seconds=120)
+    files = capture_files([str(tmp_path)])["ttyUSB0"]
+    assert len(files) == 3
+    assert read_capture(files[0])[0]["start"] > START
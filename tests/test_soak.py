@@ -0,0 +1,115 @@
+# test_soak.py
+# ------------------------------------------------------------
+# The API Gateway stub against the real ApiGatewayConnector, and a short,
+# time-compressed outage soak of the whole station (tests/soak.py).
+# Longer soaks: python tests/soak.py --help
+# ------------------------------------------------------------
+
+import gzip
+import json
+import os
+
+import pytest
+import requests
+
+from soak import run_soak
+from stub_apigateway import Faults, StubApiGateway
+
+from module.aws.apigateway import ApiGatewayConnector
+
+
+@pytest.fixture
+def stub():
+    stub = StubApiGateway(seed=1).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def connector(stub):
+    connector = ApiGatewayConnector(stub.url, "test", read_timeout=2)
+    yield connector
+    connector.close()
+
+
+def test_stub_power_formats(stub, connector):
+    entries = [{"timestamp": f"t{i}", "charger": {"V": 12800 + i}} for i in range(3)]
+    assert connector.post_dict("power", entries, {"deviceId": "x"}).status_code == 200
+    assert (
+        connector.post_dict(
+            "power", entries[:1], {"deviceId": "x"}, compress=True
+        ).status_code
+        == 200
+    )
+    data_gz = (
+        gzip.compress(b"[")
+        + gzip.compress(json.dumps(entries[1:]).encode()[1:-1])
+        + gzip.compress(b"]")
+    )
+    assert (
+        connector.post_gzip_data("power", data_gz, {"deviceId": "x"}).status_code == 200
+    )
+
+    assert stub.received() == {"t0": 2, "t1": 2, "t2": 2}
+    assert stub.stats()["power_duplicates"] == 3
+
+
+def test_stub_image_and_device(stub, connector):
+    jpeg = b"\xff\xd8" + os.urandom(1000)
+    resp = connector.post_binary(
+        "image", memoryview(jpeg), "image/jpeg", {"deviceId": "x", "phash": "ab"}
+    )
+    assert resp.status_code == 200
+    assert stub.images == [
+        {
+            "bytes": 1002,
+            "deviceId": "x",
+            "phash": "ab",
+            "timestamp": stub.images[0]["timestamp"],
+        }
+    ]
+
+    resp = connector.session.get(stub.url + "/device?deviceid=x")
+    assert resp.json()["config"] == stub.device_config
+    again = connector.session.get(
+        stub.url + "/device?deviceid=x", headers={"If-None-Match": resp.headers["ETag"]}
+    )
+    assert again.status_code == 304
+
+
+def test_stub_faults(stub, connector):
+    entries = [{"timestamp": "t0"}]
+    stub.faults.update(max_body_bytes=10)
+    assert connector.post_dict("power", entries).status_code == 413
+    stub.faults.update(max_body_bytes=Faults().max_body_bytes, throttle_rate=1.0)
+    assert connector.post_dict("power", entries).status_code == 429
+    stub.faults.update(throttle_rate=0.0, outage="503")
+    assert connector.post_dict("power", entries).status_code == 503
+    stub.faults.update(outage="drop")
+    with pytest.raises(requests.ConnectionError):
+        connector.post_dict("power", entries)
+    stub.faults.update(outage="off", hang_rate=1.0, hang_seconds=3.0)
+    with pytest.raises(requests.Timeout):
+        connector.post_dict("power", entries, timeout=(1, 0.5))
+    # the hung request was stored before the client gave up
+    assert stub.received() == {"t0": 1}
+
+
+def test_outage_soak(tmp_path):
+    report = run_soak(
+        str(tmp_path),
+        healthy=4,
+        outage=8,
+        recovery=40,
+        outage_mode="drop",
+        faults={"error_rate": 0.1, "throttle_rate": 0.05},
+        upload_seconds=2,
+        upload_timeout=2,
+        log=lambda msg: None,
+    )
+    assert report["station_exit_code"] == 0
+    assert report["drained"], report["samples"][-5:]
+    assert report["backlog_growth_entries_per_min"] > 0
+    assert report["lost"] == []
+    assert report["unexpected"] == []
+    assert report["duplicates"] == 0  # no hang faults, so delivery is exactly once
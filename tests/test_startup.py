@@ -0,0 +1,116 @@
+# test_startup.py
+# ------------------------------------------------------------
+# Readiness-driven startup (module/startup.py): "required keys present"
+# events from FrameMerger, the StartupGate's clock/role conditions and
+# upper bounds, and a pty-backed reader opening the gate.
+# ------------------------------------------------------------
+
+import os
+import time
+
+import pytest
+
+from vedirect_sim import Feeder, PtyPort, VEDirectSimulator
+
+from module.device import FrameMerger, ReaderManager, required_keys_for
+from module.startup import StartupGate, clock_synchronized
+
+
+def _charger_frame(**extra):
+    frame = {
+        "PID": "0xA057",
+        "SER#": "HQ1",
+        "V": "12800",
+        "I": "1500",
+        "VPV": "18000",
+        "PPV": "20",
+    }
+    frame.update(extra)
+    return frame
+
+
+def test_merger_announces_ready_once_per_role():
+    events = []
+    merger = FrameMerger("charger", {}, on_ready=events.append)
+    merger.merge(_charger_frame())  # H22 (history block) still missing
+    assert events == []
+    merger.merge({"H22": "12"})
+    merger.merge(_charger_frame(H22="12"))
+    assert events == ["charger"]
+
+    merger.detach()
+    merger.attach("charger_2")
+    assert events == ["charger"]
+    merger.merge({"V": "12810"})  # announced again under the new role
+    assert events == ["charger", "charger_2"]
+    assert set(required_keys_for("charger_2")) <= set(_charger_frame(H22="12"))
+
+
+def test_gate_waits_for_clock_and_roles():
+    clock = {"ok": False}
+    gate = StartupGate(
+        clock_timeout=60, roles_timeout=60, clock_check=lambda: clock["ok"]
+    )
+    gate.role_ready("loadlogger")
+    gate.expect(["charger", "loadlogger"])
+    assert not gate.check()  # clock not synced
+    clock["ok"] = True
+    assert not gate.check()  # charger not ready
+    gate.role_ready("charger")
+    assert gate.check() and gate.opened
+    assert gate.elapsed() < 5
+
+
+def test_gate_waits_for_discovery():
+    gate = StartupGate(clock_timeout=0, roles_timeout=0, clock_check=lambda: True)
+    assert not gate.check()  # roles not known yet, even with the bounds passed
+    gate.expect([])
+    assert gate.check()  # no devices: nothing to wait for
+
+
+def test_gate_upper_bounds():
+    gate = StartupGate(clock_timeout=0.2, roles_timeout=0.2, clock_check=lambda: False)
+    gate.expect(["charger"])
+    assert not gate.check()
+    time.sleep(0.25)
+    assert not gate.check()  # clock bound passed, role bound not yet
+    time.sleep(0.2)
+    assert gate.check()
+
+
+def test_gate_wait_wakes_on_events():
+    gate = StartupGate(clock_timeout=60, roles_timeout=60, clock_check=lambda: True)
+    gate.expect(["charger"])
+    gate.wait(0)  # clear
+    start = time.monotonic()
+    gate.role_ready("charger")
+    gate.wait(5)
+    assert time.monotonic() - start < 1
+    assert gate.check()
+
+
+def test_clock_synchronized_reads_or_reports_unknown():
+    assert clock_synchronized() in (True, False, None)
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_reader_opens_gate(tmp_path):
+    port = PtyPort()
+    sim = VEDirectSimulator("mppt", seed=5)
+    feeder = Feeder(port, list(sim.blocks(50)), interval=0.01, loop=True)
+    gate = StartupGate(clock_timeout=60, roles_timeout=60, clock_check=lambda: True)
+    readers = ReaderManager({}, {}, persist=False, on_ready=gate.role_ready)
+    feeder.start()
+    try:
+        roles = readers.start([(port.name, {"PID": "0xA057", "SER#": sim.serial})])
+        gate.expect(role for role, _ in roles)
+        deadline = time.monotonic() + 10
+        while not gate.check() and time.monotonic() < deadline:
+            gate.wait(0.1)
+        assert gate.opened
+        assert gate.elapsed() < 10  # the fixed delays were 80 s
+    finally:
+        readers.remove_port(port.name)
+        feeder.stop()
+        feeder.join()
+        port.close()
@@ -0,0 +1,128 @@
+# test_vedirect.py
+# ------------------------------------------------------------
+# VE.Direct text protocol (module/vedirect.py): the incremental parser's
+# checksum validation, resync after bad data and HEX-message handling, and
+# the per-window statistics (WindowStats).
+# ------------------------------------------------------------
+
+import pytest
+
+from vedirect_sim import HEX_MESSAGES, encode_block
+
+from module.vedirect import MAX_INTEGRATION_GAP_SECONDS, VEDirectParser, WindowStats
+
+PAIRS = [("PID", "0xA057"), ("V", "12800"), ("I", "1500"), ("PPV", "20")]
+BLOCK = encode_block(PAIRS)
+
+
+def _synced() -> VEDirectParser:
+    """A parser that has already dropped its first (possibly partial) block."""
+    parser = VEDirectParser()
+    assert parser.feed(BLOCK) == []
+    return parser
+
+
+def test_valid_block_is_emitted():
+    parser = _synced()
+    assert parser.feed(BLOCK) == [dict(PAIRS)]
+    assert parser.frames_ok == 1 and parser.frames_rejected == 0
+
+
+def test_bad_checksum_is_rejected_and_parser_resyncs():
+    parser = _synced()
+    bad = BLOCK.replace(b"12800", b"12900")
+    assert parser.feed(bad) == []
+    assert parser.checksum_errors == 1
+    assert parser.feed(BLOCK) == [dict(PAIRS)]  # next block parses normally
+
+
+def test_garbage_between_blocks_costs_one_frame():
+    parser = _synced()
+    frames = parser.feed(b"\x00\xff garbage" + BLOCK + BLOCK)
+    assert frames == [dict(PAIRS)]
+    assert parser.frames_rejected == 1
+
+
+def test_byte_by_byte_feed():
+    parser = _synced()
+    frames = []
+    for b in BLOCK * 3:
+        frames.extend(parser.feed(bytes([b])))
+    assert frames == [dict(PAIRS)] * 3
+
+
+def test_hex_messages_are_skipped():
+    parser = _synced()
+    head, tail = BLOCK.split(b"\r\nV\t", 1)
+    frames = parser.feed(head + HEX_MESSAGES[0] + b"\r\nV\t" + tail + HEX_MESSAGES[1])
+    frames += parser.feed(BLOCK)
+    assert frames == [dict(PAIRS)] * 2
+    assert parser.hex_messages == 2 and parser.frames_rejected == 0
+
+
+def test_oversized_field_is_a_framing_error():
+    parser = _synced()
+    assert parser.feed(encode_block([("PID", "0xA057"), ("X", "9" * 100)])) == []
+    assert parser.framing_errors == 1
+    assert parser.feed(BLOCK) == [dict(PAIRS)]
+
+
+def test_reset_drops_partial_frame():
+    parser = _synced()
+    parser.feed(BLOCK[:10])
+    parser.reset()
+    assert parser.feed(BLOCK) == []  # first block after a reopen only syncs
+    assert parser.feed(BLOCK) == [dict(PAIRS)]
+    assert parser.frames_rejected == 0
+
+
+# --------------------
+# Window statistics
+# --------------------
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_window_stats_summary_and_energy():
+    clock = _Clock()
+    stats = WindowStats(clock=clock)
+    # P ramps 100 -> 200 W over 2 s, then stays at 200 W for 2 s
+    for t, p in ((100.0, 100), (101.0, 150), (102.0, 200), (104.0, 200)):
+        stats.add({"P": p, "I": 2000, "PID": "0xA389"}, t)
+    clock.now = 130.0
+    out = stats.roll()
+
+    assert out["window_s"] == 30.0 and out["frames"] == 4
+    assert out["P"] == {"min": 100, "max": 200, "mean": 162.5, "last": 200, "n": 4}
+    assert "PID" not in out  # only numeric values
+    # trapezoids: 125 + 175 + 2 * 200 = 700 Ws; I: 2 A for 4 s
+    assert out["energy"]["Wh"] == pytest.approx(700 / 3600, abs=1e-4)
+    assert out["energy"]["Ah"] == pytest.approx(2 * 4 / 3600, abs=1e-4)
+
+
+def test_window_stats_roll_resets_and_carries_last_sample():
+    clock = _Clock()
+    stats = WindowStats(clock=clock)
+    stats.add({"P": 100}, 100.0)
+    clock.now = 110.0
+    stats.roll()
+
+    clock.now = 140.0
+    empty = stats.roll()
+    assert empty == {"window_s": 30.0, "frames": 0}
+
+    stats.add({"P": 300}, 102.0)  # integrates from the carried-over sample
+    out = stats.roll()
+    assert out["P"]["n"] == 1 and out["P"]["min"] == 300
+    assert out["energy"]["Wh"] == pytest.approx((100 + 300) / 2 * 2 / 3600, abs=1e-4)
+
+
+def test_window_stats_skips_gaps():
+    stats = WindowStats(clock=_Clock())
+    stats.add({"P": 100}, 100.0)
+    stats.add({"P": 100}, 100.0 + MAX_INTEGRATION_GAP_SECONDS + 1)  # reader outage
+    assert stats.roll()["energy"]["Wh"] == 0.0
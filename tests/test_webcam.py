@@ -0,0 +1,105 @@
+# test_webcam.py
+# ------------------------------------------------------------
+# Webcam upload dedup (module/device.py): dHash of synthetic frames
+# (near-duplicates within WEBCAM_DEDUP_DISTANCE, distinct scenes not),
+# ImageHashCache across a restart, and what each WEBCAM_DEDUP_MODE sends.
+# ------------------------------------------------------------
+
+import time
+
+import numpy as np
+import pytest
+
+import module.device as device
+from module.device import ImageHashCache, Webcam, dhash, hamming
+
+
+def _scene(seed: int, shape=(180, 320)) -> np.ndarray:
+    """A BGR frame of smooth random blobs (a 'scene' with structure)."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(9, 16), dtype=np.uint8)
+    gray = np.kron(coarse, np.ones((shape[0] // 9 + 1, shape[1] // 16 + 1)))
+    gray = gray[: shape[0], : shape[1]].astype(np.float64)
+    return np.repeat(gray[:, :, None], 3, axis=2).astype(np.uint8)
+
+
+def _near_duplicate(frame: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Same scene a bit brighter and with sensor noise."""
+    rng = np.random.default_rng(seed)
+    noisy = frame.astype(np.int16) + 6 + rng.integers(-3, 4, size=frame.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def hash_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "webcam_hashes.json")
+    monkeypatch.setattr(device, "WEBCAM_HASH_CACHE_PATH", path)
+    return path
+
+
+def test_dhash_near_duplicates_and_distinct_scenes():
+    scene = _scene(1)
+    assert hamming(dhash(scene), dhash(_near_duplicate(scene))) < (
+        device.WEBCAM_DEDUP_DISTANCE
+    )
+    for other in (2, 3, 4):
+        assert hamming(dhash(scene), dhash(_scene(other))) >= (
+            device.WEBCAM_DEDUP_DISTANCE
+        )
+
+
+def test_hash_cache_survives_restart(hash_path):
+    cache = ImageHashCache()
+    cache.add(0x1234, "full")
+    cache.add(0x5678, "thumbnail")
+
+    restarted = ImageHashCache()
+    assert restarted.last_full()["hash"] == f"{0x1234:016x}"
+    assert [i["kind"] for i in restarted.items] == ["full", "thumbnail"]
+
+    with open(hash_path, "w") as f:
+        f.write("{broken")
+    assert ImageHashCache().items == []  # unreadable cache: start over
+
+
+@pytest.mark.parametrize(
+    "mode, near, far",
+    [
+        ("off", "full", "full"),
+        ("skip", None, "full"),
+        ("thumbnail", "thumbnail", "full"),
+    ],
+)
+def test_dedup_modes(hash_path, monkeypatch, mode, near, far):
+    monkeypatch.setattr(device, "WEBCAM_DEDUP_MODE", mode)
+    webcam = Webcam()
+    scene = _scene(1)
+    assert webcam._dedup_kind(dhash(scene)) == "full"  # nothing uploaded yet
+    webcam.hashes.add(dhash(scene), "full")
+
+    assert webcam._dedup_kind(dhash(_near_duplicate(scene))) == near
+    assert webcam._dedup_kind(dhash(_scene(2))) == far
+
+    webcam.hashes.items[-1]["ts"] = time.time() - device.WEBCAM_DEDUP_MAX_AGE - 1
+    assert webcam._dedup_kind(dhash(_near_duplicate(scene))) == "full"
+
+
+class _Connector:
+    def __init__(self):
+        self.requests = []
+
+    def post_dict(self, endpoint, data, payload_parent_keys={}, timeout=None):
+        self.requests.append((endpoint, payload_parent_keys, data))
+        return type("Response", (), {"status_code": 200})()
+
+
+def test_default_upload_body_is_unchanged(hash_path, monkeypatch):
+    connector = _Connector()
+    monkeypatch.setattr(device, "get_connector", lambda url, key: connector)
+    assert device.WEBCAM_DEDUP_MODE == "off" and device.IMAGE_UPLOAD_MODE == "json"
+
+    webcam = Webcam()
+    assert webcam._send_image(memoryview(b"\xff\xd8jpeg"), 0xABCD)
+    endpoint, parent_keys, data = connector.requests[0]
+    assert endpoint == "image" and set(parent_keys) == {"deviceId"}
+    assert data == {"image": "/9hqcGVn"}
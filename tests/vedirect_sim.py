@@ -0,0 +1,269 @@
+# vedirect_sim.py
+# ------------------------------------------------------------
+# Synthetic VE.Direct text-protocol devices for benchmarks and tests
+# - VEDirectSimulator produces checksum-correct blocks for an MPPT charger
+#   (one block with live values and H19..H23) or a SmartShunt (alternating
+#   live block and H1..H18 history block, like the real device), with values
+#   doing a seeded random walk.
+# - Optional noise: blocks with a corrupted value (checksum error) and
+#   HEX-protocol messages (":...\n") interleaved at field boundaries.
+# - PtyPort is a pseudo-terminal pair whose slave path can be opened with
+#   pyserial exactly like /dev/ttyUSB0; Feeder writes blocks to it from a
+#   thread, as fast as possible or paced, and records when each block was
+#   written.
+# ------------------------------------------------------------
+
+import os
+import random
+import threading
+import time
+import tty
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Block = Tuple[bytes, bool]  # (raw bytes, passes the checksum)
+
+MPPT_PID = "0xA057"
+SHUNT_PID = "0xA389"
+
+# HEX-protocol messages seen interleaved on real ports (async "Get"/"Set" replies)
+HEX_MESSAGES = (
+    b":A0102000543\n",
+    b":AD5ED008C04B3\n",
+    b":7F0ED0071\n",
+    b":ABCED00D5070089\n",
+)
+
+
+def encode_block(pairs: List[Tuple[str, str]]) -> bytes:
+    """One VE.Direct block: "\\r\\n<label>\\t<value>" fields plus the checksum field."""
+    body = b"".join(b"\r\n" + k.encode() + b"\t" + v.encode() for k, v in pairs)
+    body += b"\r\nChecksum\t"
+    return body + bytes([(256 - sum(body) % 256) % 256])
+
+
+class VEDirectSimulator:
+    """Deterministic (seeded) block generator for one simulated device."""
+
+    def __init__(
+        self,
+        kind: str = "mppt",
+        serial: str = "HQ2242ABCDE",
+        seed: int = 0,
+        checksum_error_rate: float = 0.0,
+        hex_rate: float = 0.0,
+    ):
+        if kind not in ("mppt", "shunt"):
+            raise ValueError(f"Unknown device kind: {kind}")
+        self.kind = kind
+        self.serial = serial
+        self.checksum_error_rate = checksum_error_rate
+        self.hex_rate = hex_rate
+        self._rng = random.Random(seed)
+        self._n = 0
+
+        # random-walk state (native VE.Direct units)
+        self._v = 12_800  # mV
+        self._i = 1_500  # mA
+        self._vpv = 18_500  # mV
+        self._soc = 870  # ‰
+        self._ce = -25_000  # mAh
+        self._yield = 1_234  # 0.01 kWh
+
+    # --------------------
+    # Values
+    # --------------------
+    def _walk(self) -> None:
+        rng = self._rng
+        self._v = min(14_400, max(11_500, self._v + rng.randint(-20, 20)))
+        self._i = min(20_000, max(-20_000, self._i + rng.randint(-150, 150)))
+        self._vpv = min(45_000, max(0, self._vpv + rng.randint(-200, 200)))
+        self._soc = min(1_000, max(0, self._soc + rng.randint(-1, 1)))
+        self._ce = min(0, self._ce + rng.randint(-50, 50))
+        self._yield += rng.randint(0, 1)
+
+    def _mppt_pairs(self) -> List[Tuple[str, str]]:
+        ppv = self._vpv * max(self._i, 0) // 1_000_000
+        return [
+            ("PID", MPPT_PID),
+            ("FW", "164"),
+            ("SER#", self.serial),
+            ("V", str(self._v)),
+            ("I", str(self._i)),
+            ("VPV", str(self._vpv)),
+            ("PPV", str(ppv)),
+            ("CS", "3"),
+            ("MPPT", "2"),
+            ("OR", "0x00000000"),
+            ("ERR", "0"),
+            ("LOAD", "ON"),
+            ("IL", "300"),
+            ("H19", str(self._yield + 10_000)),
+            ("H20", str(self._yield % 500)),
+            ("H21", "97"),
+            ("H22", str(self._yield % 480)),
+            ("H23", "112"),
+            ("HSDS", str(300 + self._yield // 1_000)),
+        ]
+
+    def _shunt_pairs(self) -> List[Tuple[str, str]]:
+        p = self._v * self._i // 1_000_000
+        return [
+            ("PID", SHUNT_PID),
+            ("V", str(self._v)),
+            ("VS", "12"),
+            ("I", str(self._i)),
+            ("P", str(p)),
+            ("CE", str(self._ce)),
+            ("SOC", str(self._soc)),
+            ("TTG", "---" if self._i >= 0 else str(-self._ce * 60 // -self._i)),
+            ("Alarm", "OFF"),
+            ("Relay", "OFF"),
+            ("AR", "0"),
+            ("MON", "0"),
+            ("BMV", "SmartShunt 500A/50mV"),
+            ("FW", "0411"),
+        ]
+
+    def _shunt_history_pairs(self) -> List[Tuple[str, str]]:
+        return [
+            ("H1", "-102431"),
+            ("H2", "-25380"),
+            ("H3", "-98111"),
+            ("H4", "0"),
+            ("H5", "0"),
+            ("H6", str(-3_500_000 + self._ce)),
+            ("H7", "11022"),
+            ("H8", "14655"),
+            ("H9", "52314"),
+            ("H10", "41"),
+            ("H11", "0"),
+            ("H12", "0"),
+            ("H13", "0"),
+            ("H14", "0"),
+            ("H15", "12"),
+            ("H16", "0"),
+            ("H17", str(self._yield)),
+            ("H18", str(self._yield + 211)),
+        ]
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        """Fields of the next block (advances the simulation)."""
+        self._n += 1
+        if self.kind == "mppt":
+            self._walk()
+            return self._mppt_pairs()
+        # SmartShunt alternates live values and history, starting with history
+        # (which is why probes often see H1..H18 before PID)
+        if self._n % 2:
+            return self._shunt_history_pairs()
+        self._walk()
+        return self._shunt_pairs()
+
+    # --------------------
+    # Blocks
+    # --------------------
+    def next_block(self) -> Block:
+        """Next block as raw bytes, with the configured noise applied."""
+        rng = self._rng
+        raw = encode_block(self.pairs())
+        valid = True
+
+        if self.checksum_error_rate and rng.random() < self.checksum_error_rate:
+            raw, valid = self._corrupt(raw), False
+
+        if self.hex_rate and rng.random() < self.hex_rate:
+            # a HEX message may start at any field boundary (never inside the
+            # checksum byte); it is not part of the checksum
+            cuts = [i for i in range(len(raw) - 1) if raw[i : i + 2] == b"\r\n"]
+            cut = rng.choice(cuts)
+            raw = raw[:cut] + rng.choice(HEX_MESSAGES) + raw[cut:]
+        return raw, valid
+
+    def _corrupt(self, raw: bytes) -> bytes:
+        """Change one digit (keeps the framing, breaks the checksum)."""
+        rng = self._rng
+        digits = [i for i, b in enumerate(raw[:-1]) if 0x30 <= b <= 0x39]
+        i = rng.choice(digits)
+        new = 0x30 + (raw[i] - 0x30 + rng.randint(1, 9)) % 10
+        return raw[:i] + bytes([new]) + raw[i + 1 :]
+
+    def blocks(self, n: int) -> Iterator[Block]:
+        for _ in range(n):
+            yield self.next_block()
+
+
+# --------------------
+# Pseudo-terminal serial port
+# --------------------
+class PtyPort:
+    """A pty pair; `name` is the slave device path readers open with pyserial.
+
+    The slave fd stays open here as well, so the master never sees a hangup
+    while a reader closes and reopens the port.
+    """
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+
+    def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            n = os.write(self.master, view)
+            view = view[n:]
+
+    def close(self) -> None:
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class Feeder(threading.Thread):
+    """Writes blocks to a PtyPort from a thread.
+
+    interval=0 writes as fast as the reader drains the pty; otherwise one block
+    per interval seconds. write_times[i] is the perf_counter() right before
+    block i was written; loop=True repeats the blocks until stop().
+    """
+
+    def __init__(
+        self,
+        port: PtyPort,
+        blocks: List[Block],
+        interval: float = 0.0,
+        loop: bool = False,
+    ):
+        super().__init__(daemon=True)
+        self.port = port
+        self.blocks = blocks
+        self.interval = interval
+        self.loop = loop
+        self.write_times: List[float] = []
+        self.stop_event = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                for raw, _ in self.blocks:
+                    if self.stop_event.is_set():
+                        return
+                    self.write_times.append(time.perf_counter())
+                    self.port.write(raw)
+                    if self.interval:
+                        time.sleep(self.interval)
+                if not self.loop:
+                    return
+        except OSError as e:
+            self.error = e
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def count_valid(blocks: List[Block]) -> Dict[str, int]:
+    valid = sum(1 for _, ok in blocks if ok)
+    return {"blocks": len(blocks), "valid": valid, "corrupt": len(blocks) - valid}